@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+bench_cocina.py
+Mediciones de rendimiento de los scripts de cocina (no necesita Odoo ni impresora).
+
+Uso:
+  - Transporte XML-RPC vs JSON-RPC:   python bench_cocina.py transport --lines 2000
+  - Flujo completo contra Odoo falso: python bench_cocina.py pipeline --orders 2000 --latency 0.005
+  - Codificación ESC/POS de tickets:  python bench_cocina.py encode --tickets 5000
+
+`transport` arma una respuesta de `search_read` de pos.order.line como la que
+devuelve Odoo y compara bytes en el cable y tiempo de parseo de:
+  xmlrpc.client (actual), JSON, JSON+gzip, y las mismas variantes con los campos
+  recortados que pide cada consumidor.
+
+`pipeline` levanta en el mismo proceso un Odoo falso (fake_odoo.py, XML-RPC con
+N pedidos cobrados y demora configurable por llamada) y una impresora nula, e
+informa pedidos/segundo, llamadas RPC por tick y memoria de:
+  process_pending_orders (hasta vaciar los pendientes), fetch_recent_printed
+  y el recorrido de listar_pos.py.
+El cursor y la bandeja van a una carpeta temporal: no toca los de producción.
+El servidor falso corre en el mismo proceso, así que su CPU (evaluar dominios)
+entra en los tiempos: sirve para comparar versiones entre sí, no contra Odoo real.
+
+`encode` arma N tickets con acentos, comillas tipográficas y guiones y mide
+tickets/segundo y MB/s de EscPosEncoder en varias páginas de códigos, contra la
+codificación anterior (cp437 con errors="ignore"), y cuántos caracteres pierde
+(o cambia por "?") cada una.
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import runpy
+import tempfile
+import time
+import tracemalloc
+import xmlrpc.client
+from pathlib import Path
+
+from cocina_core import SESSION_FILENAME, KitchenPrinter, OdooClient, build_ticket
+from cocina_escpos import get_encoder, plain_text
+from cocina_metrics import Metrics
+from cocina_odoo import LINE_FIELDS, PENDING_LINE_FIELDS
+from fake_odoo import FakeOdooDB, start_server
+
+_PRODUCTS = [
+    "Hamburguesa Clásica", "Hamburguesa Doble Cheddar", "Papas Fritas Grandes",
+    "Aros de Cebolla", "Cerveza Tirada 500cc", "Gaseosa Línea Coca-Cola", "Ñoquis de la Casa",
+]
+
+
+def sample_lines(n, fields=LINE_FIELDS):
+    """Líneas con la forma de un `search_read` real (many2one como [id, nombre])."""
+    out = []
+    for i in range(1, n + 1):
+        product = _PRODUCTS[i % len(_PRODUCTS)]
+        oid = 1 + i // 3
+        rec = {
+            'id': i,
+            'order_id': [oid, f"Loren Burger/{oid:05d}"],
+            'product_id': [100 + i % len(_PRODUCTS), product],
+            'display_name': f"{product} ({oid:05d})",
+            'qty': float(1 + i % 3),
+            'note': "sin cebolla, bien cocida" if i % 4 == 0 else False,
+            'x_impreso_cocina': False,
+            'write_date': "2026-10-16 21:%02d:%02d" % (i // 60 % 60, i % 60),
+        }
+        out.append({k: rec[k] for k in fields})
+    return out
+
+
+def _timeit(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_transport(n_lines, repeat):
+    print(f"search_read de {n_lines} líneas (mejor de {repeat} corridas)")
+    print(f"{'variante':<34}{'bytes':>12}{'parseo ms':>12}")
+    for label, fields in (("todos los campos", LINE_FIELDS), ("campos recortados", PENDING_LINE_FIELDS)):
+        records = sample_lines(n_lines, fields)
+        xml_body = xmlrpc.client.dumps((records,), methodresponse=True, allow_none=True).encode('utf-8')
+        json_body = json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': records}).encode('utf-8')
+        gz_body = gzip.compress(json_body)
+        rows = [
+            (f"xmlrpc / {label}", len(xml_body), lambda: xmlrpc.client.loads(xml_body)),
+            (f"jsonrpc / {label}", len(json_body), lambda: json.loads(json_body)),
+            (f"jsonrpc+gzip / {label}", len(gz_body), lambda: json.loads(gzip.decompress(gz_body))),
+        ]
+        for name, size, parse in rows:
+            print(f"{name:<34}{size:>12,}{_timeit(parse, repeat) * 1000:>12.2f}")
+
+
+def _legacy_escpos(txt):
+    """Codificación anterior a cocina_escpos, como referencia: descartaba lo que cp437 no tiene."""
+    body = plain_text(txt).replace('\r\n', '\n').replace('\r', '\n').encode("cp437", errors="ignore")
+    return b'\x1b@' + body + b'\n' * 3 + b'\x1d\x56\x01'
+
+
+def bench_encode(n_tickets, repeat):
+    lines = sample_lines(n_tickets * 3)
+    for i, line in enumerate(lines):
+        if i % 5 == 0:
+            line['note'] = "“sin sal” – Ración ÁLAMO para Ñandú, ½ porción €"
+    tickets = [build_ticket({'id': i, 'name': f"Loren Burger/{i:05d}", 'table_id': [1, "Mesa Ú"]},
+                            lines[i * 3:i * 3 + 3]) for i in range(n_tickets)]
+    chars = sum(len(plain_text(t)) for t in tickets)
+    print(f"{n_tickets} tickets, {chars / 1024:.0f} KiB de texto (mejor de {repeat} corridas)")
+    print(f"{'codificación':<28}{'tickets/s':>12}{'MB/s':>10}{'perdidos':>10}{'?':>8}")
+    variants = [("anterior (cp437, ignore)", _legacy_escpos, None)]
+    variants += [(f"EscPosEncoder {cp}", get_encoder(cp).encode, cp) for cp in ("cp437", "cp858", "cp1252")]
+    for name, encode, codepage in variants:
+        elapsed = _timeit(lambda: [encode(t) for t in tickets], repeat)
+        if codepage is None:
+            lost = sum(1 for t in tickets for ch in plain_text(t) if not _encodable(ch, "cp437"))
+            marks = 0
+        else:
+            encoder = get_encoder(codepage)
+            lost = 0
+            marks = sum(encoder.text_bytes(plain_text(t)).count(b'?') - plain_text(t).count('?') for t in tickets)
+        print(f"{name:<28}{n_tickets / elapsed:>12,.0f}{chars / elapsed / 1e6:>10.1f}{lost:>10,}{marks:>8,}")
+
+
+def _encodable(ch, codepage):
+    try:
+        ch.encode(codepage)
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def _calls_line(calls_before, calls_after):
+    delta = {k: v - calls_before.get(k, 0) for k, v in calls_after.items() if v - calls_before.get(k, 0)}
+    return ", ".join(f"{model}.{method}={n}" for (model, method), n in sorted(delta.items()))
+
+
+def _memory_line():
+    if not tracemalloc.is_tracing():
+        return ""
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    return f"  memoria: {current / 1024:.0f} KiB en uso, pico {peak / 1024:.0f} KiB"
+
+
+def bench_pipeline(n_orders, lines_per_order, latency, max_orders, batch_tickets, transport, repeat, memory):
+    db = FakeOdooDB.generate(n_orders, lines_per_order)
+    server = start_server(db=db, latency=latency)
+    print(f"Odoo falso en {server.url}: {n_orders} pedidos x {lines_per_order} líneas, "
+          f"{latency * 1000:.1f} ms por llamada, transporte {transport}")
+    if memory:
+        tracemalloc.start()
+    with tempfile.TemporaryDirectory() as data_dir:
+        client = OdooClient(server.url, "bench", "bench", "bench", transport=transport,
+                            uid_cache=Path(data_dir) / SESSION_FILENAME)
+        kitchen = KitchenPrinter(client, data_dir, printer="null:", metrics=Metrics(), batch_tickets=batch_tickets)
+        try:
+            # --- process_pending_orders hasta vaciar ---
+            calls0 = dict(db.calls)
+            ticks, printed, errors = 0, 0, 0
+            started, cpu_started = time.perf_counter(), time.process_time()
+            while ticks <= n_orders + 10:
+                result = kitchen.process_pending_orders(max_orders=max_orders, verbose=False)
+                ticks += 1
+                printed += len(result['printed'])
+                errors += len(result['errors'])
+                if not result['printed'] and not result['errors'] and not result['backlog']:
+                    break
+            elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+            rpcs = sum(db.calls.values()) - sum(calls0.values())
+            tick_stats = kitchen.metrics.snapshot()['timings'].get('tick', {})
+            print("\nprocess_pending_orders")
+            print(f"  {printed} comandas en {ticks} ticks, {elapsed:.2f} s ({cpu:.2f} s de CPU): "
+                  f"{printed / elapsed if elapsed else 0:.1f} pedidos/s")
+            print(f"  tick p50 {tick_stats.get('p50_ms', 0):.1f} ms, p95 {tick_stats.get('p95_ms', 0):.1f} ms; "
+                  f"{rpcs} llamadas RPC ({rpcs / ticks:.2f} por tick); errores de impresión: {errors}")
+            print(f"  llamadas: {_calls_line(calls0, db.calls)}")
+            print(f"  pendientes en Odoo al terminar: {db.pending_lines()} líneas")
+            if memory:
+                print(_memory_line())
+
+            # --- fetch_recent_printed (GUI): recarga completa y luego incrementales ---
+            print("\nfetch_recent_printed")
+            for label, count in (("recarga completa", 1), ("incremental", repeat)):
+                if label == "recarga completa":
+                    kitchen.store.invalidate()
+                calls0 = dict(db.calls)
+                started = time.perf_counter()
+                for _ in range(count):
+                    recent = kitchen.fetch_recent_printed(limit_orders=max_orders)
+                elapsed = time.perf_counter() - started
+                rpcs = sum(db.calls.values()) - sum(calls0.values())
+                print(f"  {label}: {len(recent)} pedidos, {elapsed / count * 1000:.1f} ms por llamada, "
+                      f"{rpcs / count:.1f} llamadas RPC por llamada")
+            st = kitchen.render.stats()
+            print(f"  caché de tickets: {st['hits']} aciertos / {st['misses']} armados, "
+                  f"{st['encode_hits']} / {st['encode_misses']} codificados, {st['evictions']} descartados")
+            if memory:
+                print(_memory_line())
+        finally:
+            kitchen.close()
+
+    # --- listar_pos.py ---
+    # load_dotenv() no pisa variables ya definidas, así que estas ganan sobre un .env real.
+    os.environ.update(ODOO_URL=server.url, ODOO_DB="bench", ODOO_USERNAME="bench", ODOO_PASSWORD="bench")
+    calls0 = dict(db.calls)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                runpy.run_path(str(Path(__file__).with_name("listar_pos.py")), run_name="__main__")
+            except SystemExit:
+                pass
+    elapsed = time.perf_counter() - started
+    rpcs = sum(db.calls.values()) - sum(calls0.values())
+    print("\nlistar_pos.py")
+    print(f"  {elapsed / repeat * 1000:.1f} ms por corrida, {rpcs / repeat:.1f} llamadas execute_kw por corrida")
+    if memory:
+        print(_memory_line())
+        tracemalloc.stop()
+    server.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks de los scripts de cocina")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_tr = sub.add_parser("transport", help="Compara XML-RPC vs JSON-RPC (bytes y parseo)")
+    p_tr.add_argument("--lines", type=int, default=2000)
+    p_tr.add_argument("--repeat", type=int, default=5)
+    p_en = sub.add_parser("encode", help="Codificación ESC/POS: tickets/s por página de códigos")
+    p_en.add_argument("--tickets", type=int, default=5000)
+    p_en.add_argument("--repeat", type=int, default=5)
+    p_pl = sub.add_parser("pipeline", help="Flujo completo contra un Odoo XML-RPC falso e impresora nula")
+    p_pl.add_argument("--orders", type=int, default=2000, help="Pedidos cobrados sin imprimir")
+    p_pl.add_argument("--lines", type=int, default=3, help="Líneas por pedido")
+    p_pl.add_argument("--latency", type=float, default=0.0, help="Demora (s) por llamada RPC")
+    p_pl.add_argument("--max-orders", type=int, default=20, help="Pedidos por tick (como --max-orders)")
+    p_pl.add_argument("--batch-tickets", type=int, default=1)
+    p_pl.add_argument("--transport", choices=("xmlrpc", "jsonrpc"), default="xmlrpc")
+    p_pl.add_argument("--repeat", type=int, default=5, help="Repeticiones de fetch_recent_printed y listar_pos")
+    p_pl.add_argument("--memory", action="store_true", help="Mide memoria con tracemalloc (más lento)")
+    a = ap.parse_args()
+    if a.cmd == "transport":
+        bench_transport(a.lines, a.repeat)
+    elif a.cmd == "encode":
+        bench_encode(a.tickets, a.repeat)
+    elif a.cmd == "pipeline":
+        bench_pipeline(a.orders, a.lines, a.latency, a.max_orders, a.batch_tickets, a.transport, a.repeat, a.memory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_archive.py
+Archivo local de comandas impresas, para buscar y reimprimir sin ir a Odoo.
+
+Cada ticket que llega a la impresora se agrega (nunca se modifica) con el texto y
+los bytes ESC/POS exactos que se mandaron, el pedido, la mesa, el cliente, la
+impresora y la hora. La búsqueda va por palabras: "mesa 5", "0042" o "garcía"
+encuentran los tickets cuyo número de pedido, mesa o cliente tienen palabras que
+empiezan así (índice de términos en SQLite, sin recorrer el archivo). Reimprimir
+manda los mismos bytes aunque el pedido ya no esté en la vista del día.
+
+Lo que tiene más de `retention_days` días se borra con `compact()` (el tick lo
+llama a lo sumo una vez por hora) y el espacio libre se devuelve al disco de a
+poco (auto_vacuum incremental).
+
+Uso:
+  archive = TicketArchive(db_path, retention_days=14)
+  archive.add_many([{'order': order, 'lines': lines, 'ticket_text': txt,
+                     'escpos': data, 'printer': None}])
+  hits = archive.search("mesa 5", since='2026-10-15 00:00:00')
+  entry = archive.get(hits[0]['ticket_id'])   # entry['escpos'] -> bytes
+  archive.compact()
+"""
+
+import datetime as dt
+import json
+import re
+import threading
+import time
+
+
+ARCHIVE_RETENTION_DAYS = 14   # días que se guardan los tickets impresos
+ARCHIVE_SEARCH_LIMIT = 50     # resultados por búsqueda
+COMPACT_INTERVAL = 3600       # segundos entre compactaciones desde el tick
+VACUUM_PAGES = 2000           # páginas devueltas al disco por compactación
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _terms(*texts):
+    """Palabras en minúscula de los textos dados (número de pedido, mesa, cliente)."""
+    out = set()
+    for text in texts:
+        out.update(word.lower() for word in _WORD.findall(text or ''))
+    return out
+
+
+def _m2o_name(value):
+    return value[1] if isinstance(value, (list, tuple)) and len(value) > 1 else ''
+
+
+def _now_str():
+    return dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class TicketArchive:
+    """
+    Tickets impresos en SQLite, de sólo agregado. `retention_days` (None o 0 = sin
+    límite) es lo que `compact()` conserva.
+    """
+
+    def __init__(self, db_path, retention_days=ARCHIVE_RETENTION_DAYS, compact_interval=COMPACT_INTERVAL):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.compact_interval = compact_interval
+        from cocina_spool import connect  # sqlite3 sólo al abrir el archivo
+        self._conn = connect(db_path)
+        self._lock = threading.Lock()
+        self._compacted_at = None
+        with self._lock:
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            with self._conn:
+                self._conn.executescript(
+                    "CREATE TABLE IF NOT EXISTS tickets ("
+                    " ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    " printed_at TEXT NOT NULL,"
+                    " order_id INTEGER,"
+                    " order_name TEXT NOT NULL DEFAULT '',"
+                    " table_name TEXT NOT NULL DEFAULT '',"
+                    " partner_name TEXT NOT NULL DEFAULT '',"
+                    " printer TEXT,"
+                    " line_ids TEXT NOT NULL,"
+                    " ticket_text TEXT NOT NULL,"
+                    " escpos BLOB NOT NULL);"
+                    "CREATE INDEX IF NOT EXISTS tickets_printed ON tickets (printed_at);"
+                    "CREATE INDEX IF NOT EXISTS tickets_order ON tickets (order_id);"
+                    "CREATE TABLE IF NOT EXISTS ticket_terms ("
+                    " term TEXT NOT NULL,"
+                    " ticket_id INTEGER NOT NULL,"
+                    " PRIMARY KEY (term, ticket_id)) WITHOUT ROWID;"
+                    "CREATE INDEX IF NOT EXISTS ticket_terms_ticket ON ticket_terms (ticket_id);"
+                )
+            # En una base ya creada (aunque sea por el modo WAL) el auto_vacuum recién
+            # cambia con un VACUUM: se hace sólo mientras el archivo está vacío.
+            if (self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+                    and self._conn.execute("SELECT 1 FROM tickets LIMIT 1").fetchone() is None):
+                self._conn.execute("VACUUM")
+        self.added = 0
+
+    # ----- Escritura -----
+    def add_many(self, entries):
+        """
+        Agrega tickets impresos en una sola transacción. Cada entrada: 'order',
+        'lines', 'ticket_text', 'escpos' (bytes) y opcionales 'printer' y
+        'printed_at' (hora local 'YYYY-MM-DD HH:MM:SS'; por defecto, ahora).
+        Devuelve los ticket_id asignados.
+        """
+        ids = []
+        with self._lock:
+            with self._conn:
+                for entry in entries:
+                    order = entry['order']
+                    name = order.get('name') or ''
+                    table = _m2o_name(order.get('table_id'))
+                    partner = _m2o_name(order.get('partner_id'))
+                    cur = self._conn.execute(
+                        "INSERT INTO tickets (printed_at, order_id, order_name, table_name, partner_name,"
+                        " printer, line_ids, ticket_text, escpos) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (entry.get('printed_at') or _now_str(), order.get('id'), name, table, partner,
+                         entry.get('printer'), json.dumps([line['id'] for line in entry['lines']]),
+                         entry['ticket_text'], entry['escpos']),
+                    )
+                    ticket_id = cur.lastrowid
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO ticket_terms (term, ticket_id) VALUES (?, ?)",
+                        [(term, ticket_id) for term in _terms(name, table, partner)],
+                    )
+                    ids.append(ticket_id)
+        self.added += len(ids)
+        return ids
+
+    # ----- Lectura -----
+    def search(self, text='', since=None, until=None, limit=ARCHIVE_SEARCH_LIMIT):
+        """
+        Tickets (más nuevos primero) cuyo pedido, mesa o cliente tienen, por cada
+        palabra de `text`, alguna palabra que empieza así; `since`/`until` acotan
+        `printed_at`. Sin texto devuelve los últimos. No incluye los bytes ESC/POS.
+        """
+        where, params = [], []
+        for word in sorted(_terms(text)):
+            # Prefijo como rango: usa la clave primaria de ticket_terms.
+            where.append("ticket_id IN (SELECT ticket_id FROM ticket_terms WHERE term >= ? AND term < ?)")
+            params += [word, word + '\uffff']
+        if since:
+            where.append("printed_at >= ?")
+            params.append(since)
+        if until:
+            where.append("printed_at < ?")
+            params.append(until)
+        query = ("SELECT ticket_id, printed_at, order_id, order_name, table_name, partner_name, printer,"
+                 " line_ids, ticket_text FROM tickets")
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY ticket_id DESC LIMIT ?"
+        params.append(max(1, int(limit)))
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row(row) for row in rows]
+
+    def get(self, ticket_id):
+        """Un ticket con sus bytes ESC/POS (`escpos`), o None si no está (o ya se compactó)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ticket_id, printed_at, order_id, order_name, table_name, partner_name, printer,"
+                " line_ids, ticket_text, escpos FROM tickets WHERE ticket_id = ?",
+                (ticket_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        entry = self._row(row[:9])
+        entry['escpos'] = bytes(row[9])
+        return entry
+
+    def order_tickets(self, order_id):
+        """Tickets impresos de un pedido (más nuevos primero), sin los bytes."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ticket_id, printed_at, order_id, order_name, table_name, partner_name, printer,"
+                " line_ids, ticket_text FROM tickets WHERE order_id = ? ORDER BY ticket_id DESC",
+                (order_id,),
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    @staticmethod
+    def _row(row):
+        ticket_id, printed_at, order_id, name, table, partner, printer, line_ids, ticket_text = row
+        return {
+            'ticket_id': ticket_id,
+            'printed_at': printed_at,
+            'order_id': order_id,
+            'order_name': name,
+            'table': table,
+            'partner': partner,
+            'printer': printer,
+            'line_ids': json.loads(line_ids),
+            'ticket_text': ticket_text,
+        }
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tickets").fetchone()[0]
+
+    # ----- Retención -----
+    def compact(self, retention_days=None):
+        """
+        Borra los tickets con más de `retention_days` días (por defecto, los del
+        archivo) y devuelve al disco parte del espacio liberado. Devuelve cuántos borró.
+        """
+        days = self.retention_days if retention_days is None else retention_days
+        self._compacted_at = time.monotonic()
+        if not days:
+            return 0
+        limit = (dt.datetime.now() - dt.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM ticket_terms WHERE ticket_id IN (SELECT ticket_id FROM tickets WHERE printed_at < ?)",
+                    (limit,),
+                )
+                removed = self._conn.execute("DELETE FROM tickets WHERE printed_at < ?", (limit,)).rowcount
+            if removed:
+                # executescript corre el pragma hasta el final (execute libera una sola página).
+                self._conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+        return removed
+
+    def maybe_compact(self):
+        """compact() si pasaron `compact_interval` segundos desde la última (o nunca se hizo)."""
+        if self._compacted_at is not None and time.monotonic() - self._compacted_at < self.compact_interval:
+            return 0
+        return self.compact()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
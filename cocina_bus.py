@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_bus.py
+Aviso inmediato de pedidos cobrados vía el bus de Odoo (long-polling).
+
+En lugar de dormir `auto_interval` segundos entre consultas, el modo automático
+queda colgado de `/longpolling/poll` y consulta pendientes apenas Odoo avisa (y
+cada tanto igual, como red de seguridad). Si el bus no responde (Odoo sin
+longpolling, proxy que no lo deja pasar, caída), se vuelve a consultar cada
+`auto_interval` segundos y el bus se reintenta en segundo plano.
+
+Odoo no publica los cambios de pos.order por sí solo: hace falta una acción
+automatizada sobre pos.order (al modificar `state`) que avise en el canal, p. ej.
+  Odoo 14:  env['bus.bus'].sendone('cocina_pos', {'id': record.id, 'state': record.state})
+  Odoo 15:  env['bus.bus']._sendone('cocina_pos', 'pos.order/state', {'id': record.id, 'state': record.state})
+
+Uso:
+  client = BusClient(url, db, login, password, channels=['cocina_pos'])
+  trigger = BusTrigger(client)
+  trigger.start()
+  reason = trigger.wait(120, fallback_timeout=30, stop=stop_event)   # 'bus', 'timeout' o 'stop'
+"""
+
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+from http.cookies import SimpleCookie
+
+DEFAULT_BUS_PATH = '/longpolling/poll'
+DEFAULT_CHANNEL = 'cocina_pos'
+
+# Odoo corta cada long-poll a los 50 s; esperamos un poco más antes de dar la conexión por muerta.
+POLL_SOCKET_TIMEOUT = 65
+
+_SESSION_EXPIRED = 100  # código JSON-RPC de SessionExpiredException
+
+
+class BusUnavailable(Exception):
+    """El bus de Odoo no respondió como se esperaba (endpoint ausente, error HTTP, sesión rechazada)."""
+
+
+class _SessionExpired(BusUnavailable):
+    pass
+
+
+class BusClient:
+    """
+    Cliente mínimo del long-polling de Odoo: abre una sesión web con usuario y
+    contraseña (`/web/session/authenticate`) y consulta `/longpolling/poll` sobre
+    una conexión HTTP/1.1 persistente. Recuerda el último id recibido.
+    """
+
+    def __init__(self, base_url, db, login, password, channels=(DEFAULT_CHANNEL,),
+                 path=DEFAULT_BUS_PATH, timeout=POLL_SOCKET_TIMEOUT):
+        parsed = urllib.parse.urlsplit(base_url.rstrip('/'))
+        self._https = parsed.scheme == 'https'
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._prefix = parsed.path
+        self.db = db
+        self.login = login
+        self.password = password
+        self.channels = list(channels)
+        self.path = path
+        self.timeout = timeout
+        self.last = 0
+        self._session = None
+        self._conn = None
+        self._ids = 0
+
+    def _post(self, path, params):
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            self._conn = cls(self._host, self._port, timeout=self.timeout)
+        self._ids += 1
+        payload = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'params': params, 'id': self._ids})
+        headers = {'Content-Type': 'application/json'}
+        if self._session:
+            headers['Cookie'] = f"session_id={self._session}"
+        try:
+            self._conn.request('POST', self._prefix + path, body=payload.encode('utf-8'), headers=headers)
+            resp = self._conn.getresponse()
+            raw = resp.read()
+        except (http.client.HTTPException, OSError):
+            self.reset()
+            raise
+        for header in resp.headers.get_all('Set-Cookie') or []:
+            morsel = SimpleCookie(header).get('session_id')
+            if morsel is not None and morsel.value:
+                self._session = morsel.value
+        if resp.status != 200:
+            raise BusUnavailable(f"HTTP {resp.status} {resp.reason} en {path}")
+        try:
+            data = json.loads(raw)
+        except ValueError as exc:
+            raise BusUnavailable(f"respuesta no JSON en {path}") from exc
+        error = data.get('error')
+        if error:
+            detail = error.get('data') or {}
+            msg = detail.get('message') or error.get('message') or str(error)
+            if error.get('code') == _SESSION_EXPIRED:
+                raise _SessionExpired(msg)
+            raise BusUnavailable(msg)
+        return data.get('result')
+
+    def authenticate(self):
+        self._session = None
+        result = self._post('/web/session/authenticate',
+                            {'db': self.db, 'login': self.login, 'password': self.password})
+        if not result or not result.get('uid') or not self._session:
+            raise BusUnavailable("el bus rechazó el usuario/contraseña (las claves API no abren sesión web)")
+
+    def poll(self):
+        """Un long-poll: devuelve las notificaciones nuevas (lista vacía si venció sin novedades)."""
+        if not self._session:
+            self.authenticate()
+        params = {'channels': self.channels, 'last': self.last, 'options': {}}
+        try:
+            notifications = self._post(self.path, params)
+        except _SessionExpired:
+            self.authenticate()
+            notifications = self._post(self.path, params)
+        notifications = notifications or []
+        for note in notifications:
+            if isinstance(note, dict) and isinstance(note.get('id'), int) and note['id'] > self.last:
+                self.last = note['id']
+        return notifications
+
+    def reset(self):
+        """Cierra la conexión (la próxima llamada abre otra)."""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class BusTrigger:
+    """
+    Hilo que escucha el bus y despierta al bucle automático cuando llega un aviso.
+    Mientras el bus no está disponible, `wait()` usa el intervalo de respaldo
+    (polling común); la reconexión se reintenta con espera creciente.
+    """
+
+    def __init__(self, client, retry_interval=15, max_retry_interval=300, on_status=None):
+        self.client = client
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.on_status = on_status  # on_status(available, error) al cambiar de estado
+        self.available = None  # None: todavía no se intentó conectar
+        self.last_error = None
+        self.notifications = 0
+        self._event = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="cocina-bus", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._event.set()
+        self.client.reset()
+
+    def _set_available(self, available, error=None):
+        self.last_error = error
+        if available == self.available:
+            return
+        self.available = available
+        if self.on_status is not None:
+            try:
+                self.on_status(available, error)
+            except Exception:
+                pass
+
+    def _run(self):
+        delay = self.retry_interval
+        while not self._stop.is_set():
+            try:
+                notifications = self.client.poll()
+            except Exception as exc:
+                if self._stop.is_set():
+                    break
+                self.client.reset()
+                self._set_available(False, exc)
+                if self._stop.wait(delay):
+                    break
+                delay = min(delay * 2, self.max_retry_interval)
+                continue
+            delay = self.retry_interval
+            self._set_available(True)
+            if notifications:
+                self.notifications += len(notifications)
+                self._event.set()
+
+    def wait(self, timeout, fallback_timeout=None, stop=None):
+        """
+        Espera el próximo tick: un aviso del bus ('bus'), o que pasen `timeout`
+        segundos con el bus disponible / `fallback_timeout` sin él ('timeout'),
+        o que se active `stop` ('stop'). Los avisos llegados durante el tick
+        anterior despiertan enseguida.
+        """
+        if fallback_timeout is None:
+            fallback_timeout = timeout
+        start = time.monotonic()
+        while True:
+            if (stop is not None and stop.is_set()) or self._stop.is_set():
+                return 'stop'
+            limit = timeout if self.available else fallback_timeout
+            remaining = start + limit - time.monotonic()
+            if remaining <= 0:
+                return 'timeout'
+            if self._event.wait(min(remaining, 0.5)):
+                self._event.clear()
+                if self._stop.is_set():
+                    return 'stop'
+                return 'bus'
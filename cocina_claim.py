@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_claim.py
+Reserva optimista de líneas, para que varios puestos (p. ej. la PC del mostrador y
+la de cocina, como respaldo) impriman del mismo Odoo sin duplicar comandas.
+
+Antes de imprimir, cada puesto escribe en las líneas que leyó su token
+(`x_cocina_claim`) y la hora UTC (`x_cocina_claim_at`). Después de `settle`
+segundos relee cuáles siguen con su token y sólo imprime ésas: si dos puestos
+reservan la misma línea, gana el último `write` y el otro la ve ajena al releer.
+Las lecturas de pendientes sólo traen líneas libres, propias o con una reserva de
+más de `ttl` segundos (puesto caído antes de imprimir): ésas se vuelven a tomar.
+
+Odoo no tiene un `write` condicional por RPC. Queda una ventana de duplicado si
+entre la lectura de un puesto y su reserva pasan más de `settle` segundos (el otro
+ya verificó y no ve la pisada). Por eso la reserva se hace apenas se lee.
+
+Una reserva no se renueva mientras el trabajo espera en la bandeja (p. ej. con la
+impresora sin papel): pasado `ttl` otro puesto puede tomarla e imprimirla. Por eso,
+antes de mandar a la impresora, la bandeja pregunta con `owned()` qué líneas siguen
+siendo de este puesto y suelta las demás. Las reservadas hace menos de
+`ttl - CLAIM_MARGIN` segundos (en este proceso) no se consultan: nadie pudo tomarlas.
+
+Las líneas que se lleva otro puesto (en `claim()` o en `owned()`) quedan detrás del
+cursor incremental de pendientes: si ese puesto se cae, su reserva vence sin que la
+línea vuelva a cambiar. `due()` devuelve las perdidas hace más de `ttl` segundos
+para que las lecturas siguientes las vuelvan a pedir por id, sin esperar al barrido
+completo.
+
+Requiere dos campos en pos.order.line: `x_cocina_claim` (Char) y
+`x_cocina_claim_at` (Fecha y hora).
+
+Uso:
+  claimer = LineClaimer(execute, station="mostrador")
+  domain += claimer.domain()        # libres, propias o vencidas
+  batches = claimer.claim(batches)  # {order_id: {'order', 'lines'}} sólo con lo ganado
+  owned = claimer.owned(line_ids)   # antes de imprimir: las que siguen siendo propias
+  recheck = claimer.due()           # perdidas cuya reserva ajena ya pudo vencer
+"""
+
+import datetime as dt
+import threading
+import time
+
+CLAIM_TTL = 120      # segundos hasta que otro puesto puede tomar una reserva sin imprimir
+CLAIM_SETTLE = 0.3   # segundos entre la reserva y la relectura
+CLAIM_MARGIN = 15    # segundos antes del vencimiento en que owned() ya consulta a Odoo
+
+
+def _utc_str(offset_seconds=0):
+    return (dt.datetime.utcnow() - dt.timedelta(seconds=offset_seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class LineClaimer:
+    """
+    Reserva de líneas para el puesto `station` (su token: tiene que ser distinto en
+    cada PC). `won` y `lost` cuentan las líneas ganadas y las que se llevó otro puesto.
+    """
+
+    def __init__(self, execute, station, ttl=CLAIM_TTL, settle=CLAIM_SETTLE):
+        if not station:
+            raise ValueError("LineClaimer necesita un nombre de puesto")
+        self._execute = execute
+        self.token = str(station)
+        self.ttl = ttl
+        self.settle = settle
+        self.won = 0
+        self.lost = 0
+        self._claimed_at = {}  # line_id -> time.monotonic() de la reserva ganada
+        self._lost_at = {}     # line_id -> time.monotonic() de cuando se la llevó otro puesto
+        self._lock = threading.Lock()  # owned() corre en los hilos de impresión
+
+    def domain(self):
+        """Condición para las lecturas de pendientes: sin reserva, reservadas por este puesto o vencidas."""
+        return [
+            '|', '|',
+            ('x_cocina_claim', '=', False),
+            ('x_cocina_claim', '=', self.token),
+            ('x_cocina_claim_at', '<', _utc_str(self.ttl)),
+        ]
+
+    def claim(self, batches):
+        """
+        Reserva las líneas de `batches` ({order_id: {'order', 'lines'}}) y devuelve el
+        mismo dict sólo con las líneas ganadas (sin los pedidos que quedaron vacíos).
+        Cuesta dos llamadas: el `write` de la reserva y un `search` de verificación.
+        """
+        line_ids = [line['id'] for payload in batches.values() for line in payload['lines']]
+        if not line_ids:
+            return batches
+        claimed = time.monotonic()
+        self._execute('pos.order.line', 'write',
+                      [line_ids, {'x_cocina_claim': self.token, 'x_cocina_claim_at': _utc_str()}], {})
+        if self.settle:
+            time.sleep(self.settle)
+        won = set(self._execute('pos.order.line', 'search',
+                                [[('id', 'in', line_ids), ('x_cocina_claim', '=', self.token)]], {}))
+        self.won += len(won)
+        self.lost += len(line_ids) - len(won)
+        self._remember(won, claimed)
+        with self._lock:
+            for lid in won:
+                self._lost_at.pop(lid, None)
+        self._lose((lid for lid in line_ids if lid not in won), claimed)
+        out = {}
+        for oid, payload in batches.items():
+            lines = [line for line in payload['lines'] if line['id'] in won]
+            if lines:
+                out[oid] = {'order': payload['order'], 'lines': lines}
+        return out
+
+    def _remember(self, line_ids, claimed):
+        horizon = claimed - self.ttl
+        with self._lock:
+            self._claimed_at = {lid: at for lid, at in self._claimed_at.items() if at > horizon}
+            self._claimed_at.update((lid, claimed) for lid in line_ids)
+
+    def _lose(self, line_ids, at):
+        with self._lock:
+            for lid in line_ids:
+                self._claimed_at.pop(lid, None)
+                self._lost_at[lid] = at
+
+    def due(self):
+        """
+        Ids perdidos hace más de `ttl` segundos (la reserva ajena ya pudo vencer). Se
+        siguen devolviendo durante otros `ttl` segundos (por si los relojes no coinciden)
+        o hasta que `claim()` vuelva a leerlos; después queda el barrido completo.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._lost_at = {lid: at for lid, at in self._lost_at.items() if at > now - 2 * self.ttl}
+            return [lid for lid, at in self._lost_at.items() if at <= now - self.ttl]
+
+    def owned(self, line_ids):
+        """
+        Las de `line_ids` que siguen reservadas por este puesto. Sólo consulta a Odoo
+        las que pudieron vencer (reservadas hace más de `ttl - CLAIM_MARGIN` segundos o
+        antes de arrancar este proceso); si la consulta falla, la excepción sube.
+        """
+        fresh_after = time.monotonic() - max(0, self.ttl - CLAIM_MARGIN)
+        with self._lock:
+            owned = {lid for lid in line_ids if self._claimed_at.get(lid, fresh_after) > fresh_after}
+        stale = [lid for lid in line_ids if lid not in owned]
+        if stale:
+            still = self._execute('pos.order.line', 'search',
+                                  [[('id', 'in', stale), ('x_cocina_claim', '=', self.token)]], {})
+            owned.update(still)
+            self._lose((lid for lid in stale if lid not in owned), time.monotonic())
+        return owned
@@ -0,0 +1,1202 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_core.py
+Núcleo de las comandas de cocina, importable sin efectos secundarios: leer de
+Odoo las líneas cobradas sin imprimir, armar el ticket, imprimirlo y marcarlo.
+
+Importar este módulo no lee `sys.argv` ni `.env` ni abre conexiones:
+  - `OdooClient` autentica recién en la primera llamada y guarda el uid en disco,
+    así la próxima corrida arranca sin pasar por `/xmlrpc/2/common`;
+  - `KitchenPrinter` abre la bandeja y el archivo de tickets (SQLite) y los hilos
+    de impresión recién cuando hacen falta; sqlite3 y cocina_rpc (xmlrpc) también
+    se importan recién ahí;
+  - win32print se importa sólo al usar una impresora de Windows (cocina_print) y
+    tkinter sólo desde la GUI de imprimir_cocina_win.py.
+
+Uso:
+  client = OdooClient(url, db, user, pwd, uid_cache=Path("imprimir_cocina_session.json"))
+  kitchen = KitchenPrinter(client, data_dir=Path("."), printer="null:")
+  result = kitchen.process_pending_orders(max_orders=20, dry_run=True)
+  kitchen.close()
+"""
+
+import datetime as dt
+import json
+import textwrap
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from cocina_archive import ARCHIVE_RETENTION_DAYS, ARCHIVE_SEARCH_LIMIT
+from cocina_claim import LineClaimer
+from cocina_escpos import get_encoder, plain_text
+from cocina_metrics import Metrics
+from cocina_odoo import CategoryResolver, FetchEngine, Router, PENDING_LINE_FIELDS, RECENT_LINE_FIELDS, TICKET_ORDER_FIELDS
+from cocina_print import close_backends, get_backend, get_default_printer, write_batch
+from cocina_store import OrderStore
+
+PENDING_ORDER_STATES = ['paid', 'done', 'invoiced']
+PENDING_SEARCH_LIMIT = 500
+PENDING_PAGE_ORDERS = 100  # pedidos por página al vaciar un atraso (catch_up)
+PIPELINE_MAX_BACKLOG = 2 * PENDING_PAGE_ORDERS  # trabajos sin imprimir antes de pedir otra página
+PIPELINE_POLL = 0.05  # segundos entre consultas de la bandeja mientras se espera a la impresora
+STATE_FILENAME = "imprimir_cocina_state.json"
+SPOOL_FILENAME = "imprimir_cocina_spool.db"
+ARCHIVE_FILENAME = "imprimir_cocina_archive.db"
+SESSION_FILENAME = "imprimir_cocina_session.json"
+BATCH_MAX_BYTES = 64 * 1024  # tope de un documento con varias comandas (bytes ESC/POS enviados)
+CLOSE_WAIT = 10.0  # segundos que close() espera a los hilos de impresión y de marcado
+CURSOR_CLOCK_MARGIN = 120  # segundos de tolerancia si hay que anclar el cursor al reloj local
+
+# Código de Fault con el que Odoo responde odoo.exceptions.AccessDenied por XML-RPC.
+_ACCESS_DENIED_CODE = 3
+
+
+# =========================
+# Conexión Odoo (perezosa)
+# =========================
+class OdooAuthError(RuntimeError):
+    """Odoo rechazó el usuario/contraseña (o la clave API)."""
+
+
+def _access_denied(exc):
+    code = getattr(exc, 'faultCode', None)
+    text = str(getattr(exc, 'faultString', '') or '')
+    return code == _ACCESS_DENIED_CODE or 'AccessDenied' in text or 'Access Denied' in text
+
+
+class OdooClient:
+    """
+    `execute_kw` contra Odoo con conexión y autenticación a demanda.
+
+    El pool de conexiones (cocina_rpc) se crea en la primera llamada. Si hay
+    `uid_cache`, el uid de la última autenticación exitosa (para esa URL, base y
+    usuario) se reutiliza sin volver a autenticar; si Odoo lo rechaza, se
+    autentica de nuevo y se reintenta la llamada una vez. La contraseña nunca se
+    guarda en el archivo.
+
+    Toda llamada pasa por `guard` (cocina_rpc.RpcGuard): cada intento tiene
+    `rpc_timeout` segundos, la llamada entera el doble, las lecturas se reintentan
+    si falla la red y el disyuntor corta en seco mientras Odoo no responde.
+    """
+
+    def __init__(self, url, db, login, password, transport="xmlrpc", pool_size=4, uid_cache=None, metrics=None,
+                 rpc_timeout=None):
+        self.url = url.rstrip('/')
+        self.db = db
+        self.login = login
+        self.password = password
+        self.transport = transport
+        self.pool_size = pool_size
+        self.uid_cache = Path(uid_cache) if uid_cache else None
+        self.metrics = metrics
+        self.rpc_timeout = rpc_timeout
+        self.authentications = 0
+        self._uid = None
+        self._uid_from_cache = False
+        self._pool = None
+        self._guard = None
+        self._lock = threading.Lock()
+
+    # ----- uid -----
+    def _cache_key(self):
+        return {'url': self.url, 'db': self.db, 'login': self.login}
+
+    def _load_cached_uid(self):
+        if self.uid_cache is None:
+            return None
+        try:
+            with self.uid_cache.open("r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return None
+        if not isinstance(data, dict) or any(data.get(k) != v for k, v in self._cache_key().items()):
+            return None
+        uid = data.get('uid')
+        return uid if isinstance(uid, int) and uid > 0 else None
+
+    def _save_cached_uid(self, uid):
+        if self.uid_cache is None:
+            return
+        try:
+            with self.uid_cache.open("w", encoding="utf-8") as fh:
+                json.dump(dict(self._cache_key(), uid=uid), fh, indent=2)
+        except OSError as exc:
+            print(f"Advertencia: no se pudo guardar la sesión de Odoo: {exc}")
+
+    def authenticate(self):
+        """Autentica contra `/xmlrpc/2/common` (siempre, ignorando el uid guardado) y devuelve el uid."""
+        from cocina_rpc import server_proxy
+        common = server_proxy(f"{self.url}/xmlrpc/2/common")
+
+        def attempt(timeout):
+            common("transport").timeout = timeout
+            return common.authenticate(self.db, self.login, self.password, {})
+
+        try:
+            uid = self.guard.call(attempt, 'authenticate', idempotent=True)
+        finally:
+            common("close")()
+        self.authentications += 1
+        if not uid:
+            raise OdooAuthError("No se pudo autenticar en Odoo. Verificá .env")
+        with self._lock:
+            self._uid, self._uid_from_cache = uid, False
+        self._save_cached_uid(uid)
+        return uid
+
+    @property
+    def uid(self):
+        with self._lock:
+            if self._uid is None:
+                cached = self._load_cached_uid()
+                if cached is not None:
+                    self._uid, self._uid_from_cache = cached, True
+            uid = self._uid
+        return uid if uid is not None else self.authenticate()
+
+    # ----- Llamadas -----
+    @property
+    def guard(self):
+        """Plazos, reintentos y disyuntor (cocina_rpc.RpcGuard); se puede suscribir antes de la primera llamada."""
+        with self._lock:
+            if self._guard is None:
+                from cocina_rpc import RPC_TIMEOUT, RpcGuard
+                timeout = self.rpc_timeout or RPC_TIMEOUT
+                self._guard = RpcGuard(timeout=timeout, deadline=2 * timeout)
+            return self._guard
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Una conexión keep-alive por hilo en uso: la GUI llama desde varios hilos.
+                from cocina_rpc import RPC_TIMEOUT, make_pool
+                self._pool = make_pool(self.transport, self.url, size=self.pool_size,
+                                       timeout=self.rpc_timeout or RPC_TIMEOUT)
+            return self._pool
+
+    def _execute_kw(self, uid, model, method, rpc_args, rpc_kwargs):
+        from cocina_rpc import IDEMPOTENT_METHODS
+        pool = self.pool
+        return self.guard.call(
+            lambda timeout: pool.execute_kw(self.db, uid, self.password, model, method, rpc_args, rpc_kwargs,
+                                            timeout=timeout),
+            f"{model}.{method}", idempotent=method in IDEMPOTENT_METHODS,
+        )
+
+    def execute(self, model, method, rpc_args, rpc_kwargs=None):
+        """`execute_kw` con tiempos en `metrics` bajo "rpc <modelo>.<método>"."""
+        uid = self.uid
+        from_cache = self._uid_from_cache
+        started = time.perf_counter()
+        try:
+            try:
+                return self._execute_kw(uid, model, method, rpc_args, rpc_kwargs or {})
+            except Exception as exc:
+                # uid guardado de otra corrida que Odoo ya no acepta: se autentica y se reintenta una vez.
+                if not from_cache or not _access_denied(exc):
+                    raise
+                return self._execute_kw(self.authenticate(), model, method, rpc_args, rpc_kwargs or {})
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe(f"rpc {model}.{method}", time.perf_counter() - started)
+
+    def rpc_stats(self):
+        """Estado del disyuntor y contadores de reintentos (None si todavía no hubo llamadas)."""
+        guard = self._guard
+        return guard.stats() if guard is not None else None
+
+    def stats_line(self):
+        if self._pool is None:
+            return "Conexiones Odoo: ninguna abierta"
+        line = self._pool.stats_line()
+        if self._guard is not None:
+            line += f" · {self._guard.stats_line()}"
+        return line
+
+    def close(self):
+        """Cierra las conexiones ociosas (las estadísticas se conservan; la próxima llamada abre otra)."""
+        pool = self._pool
+        if pool is not None:
+            pool.close()
+
+
+# =========================
+# Utilidades de formato ticket
+# =========================
+LINE_CHARS = 42          # Ancho típico de 80mm (42–48)
+
+def trunc_pad(s: str) -> str:
+    return s[:LINE_CHARS].ljust(LINE_CHARS)
+
+def center(s: str) -> str:
+    s = s[:LINE_CHARS]
+    pad = max(0, (LINE_CHARS - len(s)) // 2)
+    return " " * pad + s
+
+def linea(ch="=") -> str:
+    return ch * LINE_CHARS
+
+def wrap_line(txt: str, indent=2, style=None):
+    res = []
+    for ln in textwrap.wrap(txt, width=LINE_CHARS - indent):
+        if style:
+            ln = f"<{style}>{ln}</{style}>"  # la sangría queda fuera del estilo
+        res.append((" " * indent) + ln)
+    return "\n".join(res)
+
+def format_header(order):
+    """
+    Encabezado: ticket, mesa/cliente, hora. El título sale en negrita y doble alto;
+    ticket y mesa, en negrita (marcado de cocina_escpos).
+    """
+    name = plain_text(order.get('name') or '')
+    table = plain_text((order.get('table_id') or ['',''])[1]) if order.get('table_id') else ''
+    partner = plain_text((order.get('partner_id') or ['',''])[1]) if order.get('partner_id') else ''
+    dt_str = dt.datetime.now().strftime("%d/%m/%Y %H:%M")
+    h = []
+    h.append("<b><h>" + center("COMANDA COCINA") + "</h></b>")
+    h.append(center(dt_str))
+    h.append(linea("-"))
+    h.append("<b>" + trunc_pad(f"Ticket: {name}") + "</b>")
+    if table:
+        h.append("<b>" + trunc_pad(f"Mesa: {table}") + "</b>")
+    if partner:
+        h.append(trunc_pad(f"Cliente: {partner}"))
+    h.append(linea("="))
+    return "\n".join(h) + "\n"
+
+def build_ticket(order, lines):
+    """
+    Cuerpo del ticket a partir de líneas del pedido.
+    Cada ítem: QTY x DESCRIPCION
+               (nota)          <- en inverso, para que no se pase por alto
+    Los textos de Odoo se limpian de etiquetas de estilo (ver cocina_escpos).
+    """
+    out = []
+    out.append(format_header(order))
+    for l in lines:
+        qty = l.get('qty', 0)
+        name = plain_text(l.get('display_name') or (l.get('product_id') or ['',''])[1])
+        base = f"{qty:g} x {name}"
+        out.append(trunc_pad(base))
+        note = plain_text(l.get('note') or "").strip()
+        if note:
+            out.append(wrap_line(f"({note})", indent=2, style="i"))
+        out.append("")  # línea en blanco
+    out.append(linea("="))
+    out.append(center("FIN COMANDA"))
+    out.append("")
+    return "\n".join(out)
+
+# =========================
+# Impresión RAW (backends en cocina_print: Windows, TCP 9100, archivo)
+# =========================
+def escpos_text(txt: str, codepage=None) -> bytes:
+    """Bytes ESC/POS del ticket en la página de códigos `codepage` (None = cp437; ver cocina_escpos)."""
+    return get_encoder(codepage).encode(txt)
+
+
+RENDER_CACHE_ENTRIES = 2048
+RENDER_CACHE_BYTES = 4 * 1024 * 1024
+
+
+class RenderCache:
+    """
+    Caché LRU de tickets armados: texto y bytes ESC/POS (por página de códigos) de
+    cada (pedido, líneas).
+
+    La clave es el id y `write_date` del pedido más los pares (id, `write_date`) de
+    sus líneas, en orden: si Odoo no tocó nada, el ticket no se vuelve a armar ni
+    a codificar. El texto conserva la hora del primer armado (una comanda que se
+    reintenta sale con la hora original). Se descarta lo menos usado al pasar
+    `max_entries` tickets o `max_bytes` (texto + bytes).
+
+    Uso:
+      cache = RenderCache(build_ticket, escpos_text)
+      txt = cache.ticket(order, lines)
+      data = cache.encoded(txt, codepage="cp858")
+    """
+
+    def __init__(self, render_fn, encode_fn, max_entries=RENDER_CACHE_ENTRIES, max_bytes=RENDER_CACHE_BYTES):
+        self.render_fn = render_fn
+        self.encode_fn = encode_fn
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # clave -> [texto, {página de códigos: bytes}]
+        self._by_text = {}              # texto -> clave (para encontrar los bytes al imprimir)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.encode_hits = 0
+        self.encode_misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(order, lines):
+        return (order.get('id'), order.get('write_date'),
+                tuple((line.get('id'), line.get('write_date')) for line in lines))
+
+    def ticket(self, order, lines):
+        """Texto del ticket, armado sólo si este pedido con estas líneas no está en caché."""
+        key = self.key(order, lines)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        text = self.render_fn(order, lines)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = [text, {}]
+                self._by_text[text] = key
+                self.size += len(text)
+                self._evict()
+        return text
+
+    def encoded(self, text, codepage=None):
+        """Bytes ESC/POS de `text` en `codepage`; se codifica una sola vez por ticket y página."""
+        with self._lock:
+            key = self._by_text.get(text)
+            entry = self._entries.get(key) if key is not None else None
+            if entry is not None and codepage in entry[1]:
+                self._entries.move_to_end(key)
+                self.encode_hits += 1
+                return entry[1][codepage]
+            self.encode_misses += 1
+        data = self.encode_fn(text, codepage)
+        with self._lock:
+            entry = self._entries.get(key) if key is not None else None
+            if entry is not None and codepage not in entry[1]:
+                entry[1][codepage] = data
+                self.size += len(data)
+                self._evict()
+        return data
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            key, (text, encoded) = self._entries.popitem(last=False)
+            if self._by_text.get(text) == key:
+                del self._by_text[text]
+            self.size -= len(text) + sum(len(data) for data in encoded.values())
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses,
+                    'encode_hits': self.encode_hits, 'encode_misses': self.encode_misses,
+                    'evictions': self.evictions}
+
+
+# =========================
+# Cursor de pendientes
+# =========================
+class PendingCursor:
+    """
+    Marca de agua (write_date, id) de las líneas pendientes ya vistas.
+
+    Con cursor, cada tick sólo pide a Odoo las líneas (o pedidos) modificados desde
+    la última marca. Cada `full_scan_interval` segundos se hace un barrido completo
+    del dominio para conciliar lo que se haya escapado (transacciones fuera de orden,
+    errores de impresión, etc.). El cursor sólo avanza con `commit()`, es decir,
+    cuando el tick terminó sin errores.
+    """
+
+    def __init__(self, path, full_scan_interval=300):
+        self.path = path
+        self.full_scan_interval = full_scan_interval
+        self.write_date = None
+        self.line_id = 0
+        self.last_full_scan = None
+        self._proposed = None
+        self._proposed_full = False
+        self._seen = None
+        self._seen_full = False
+        self._load()
+
+    def _load(self):
+        try:
+            with self.path.open("r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return
+        cursor = data.get('pending_cursor') if isinstance(data, dict) else None
+        if isinstance(cursor, dict) and isinstance(cursor.get('write_date'), str):
+            self.write_date = cursor['write_date']
+            self.line_id = int(cursor.get('id') or 0)
+            last_full = cursor.get('last_full_scan')
+            if isinstance(last_full, (int, float)):
+                self.last_full_scan = float(last_full)
+
+    def _save(self):
+        try:
+            with self.path.open("w", encoding="utf-8") as fh:
+                json.dump({'pending_cursor': {
+                    'write_date': self.write_date,
+                    'id': self.line_id,
+                    'last_full_scan': self.last_full_scan,
+                }}, fh, indent=2)
+        except OSError as exc:
+            print(f"Advertencia: no se pudo guardar el cursor de pendientes: {exc}")
+
+    def needs_full_scan(self):
+        if not self.write_date or self.full_scan_interval <= 0 or self.last_full_scan is None:
+            return True
+        return time.time() - self.last_full_scan >= self.full_scan_interval
+
+    def domain(self, extra_ids=()):
+        """
+        Filtro incremental: líneas posteriores a la marca o de pedidos tocados desde
+        entonces, más las de `extra_ids` (líneas viejas que hay que volver a mirar).
+        """
+        wd, lid = self.write_date, self.line_id
+        domain = [
+            '|', '|',
+            ('write_date', '>', wd),
+            '&', ('write_date', '=', wd), ('id', '>', lid),
+            ('order_id.write_date', '>=', wd),
+        ]
+        if extra_ids:
+            domain = ['|'] + domain + [('id', 'in', list(extra_ids))]
+        return domain
+
+    def propose(self, lines, orders, full_scan, truncated):
+        """
+        Calcula la nueva marca a partir de lo leído. Si la lectura quedó truncada
+        (límite de búsqueda o de pedidos) no se avanza: lo descartado sigue pendiente.
+        """
+        self.begin(full_scan)
+        self.observe(lines, orders)
+        self.finish(truncated)
+
+    def begin(self, full_scan):
+        """Empieza una lectura por páginas: `observe` por cada página y `finish` al final."""
+        self._seen = (self.write_date or '', self.line_id)
+        self._seen_full = full_scan
+        self._proposed = None
+        self._proposed_full = False
+
+    def observe(self, lines, orders):
+        best = self._seen
+        for line in lines:
+            key = (line.get('write_date') or '', line['id'])
+            if key > best:
+                best = key
+        for order in orders:
+            key = (order.get('write_date') or '', 0)
+            if key > best:
+                best = key
+        self._seen = best
+
+    def finish(self, truncated):
+        full_scan, best = self._seen_full, self._seen
+        self._proposed_full = full_scan and not truncated
+        if truncated:
+            self._proposed = None
+            return
+        if not best[0] and full_scan:
+            # Nada pendiente y sin marca previa: anclamos al reloj local con margen.
+            anchor = dt.datetime.utcnow() - dt.timedelta(seconds=CURSOR_CLOCK_MARGIN)
+            best = (anchor.strftime('%Y-%m-%d %H:%M:%S'), 0)
+        self._proposed = best if best[0] else None
+
+    def commit(self):
+        changed = False
+        if self._proposed_full:
+            self.last_full_scan = time.time()
+            changed = True
+        proposed, self._proposed, self._proposed_full = self._proposed, None, False
+        if proposed and proposed != (self.write_date, self.line_id):
+            self.write_date, self.line_id = proposed
+            changed = True
+        if changed:
+            self._save()
+
+    def discard(self):
+        self._proposed = None
+        self._proposed_full = False
+
+
+def _all_filters(*filters):
+    """Combina filtros de línea (los None se ignoran); None si no queda ninguno."""
+    filters = [f for f in filters if f is not None]
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0]
+    return lambda line: all(f(line) for f in filters)
+
+
+def _order_epoch(order):
+    """date_order de Odoo (UTC, 'YYYY-MM-DD HH:MM:SS') como epoch, o None."""
+    value = order.get('date_order')
+    if not isinstance(value, str):
+        return None
+    try:
+        return dt.datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=dt.timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+def resolve_printer(printer=None):
+    """`printer` si se indicó; si no, la impresora predeterminada de Windows."""
+    if printer:
+        return printer
+    p = get_default_printer()
+    if not p:
+        raise RuntimeError("Windows no reporta impresora predeterminada. Indique --printer.")
+    return p
+
+
+TEST_ACCENTS = "Ñandú, jamón, pingüino, ÁÉÍÓÚ, ¿¡ 1/2 € “ok” –"
+
+
+def print_test_page(printer=None, msg="PRUEBA COCINA – EPSON TM-T20III", codepage=None):
+    """
+    Test simple (sin Odoo). Envía texto plano RAW, con los acentos de la página de códigos.
+    """
+    backend = get_backend(resolve_printer(printer))
+    text = f"{msg}\n{TEST_ACCENTS}\n\n"
+    backend.write(get_encoder(codepage).encode(text, cut=False), doc_name="Test simple")
+
+
+# =========================
+# Leer, imprimir y marcar
+# =========================
+class KitchenPrinter:
+    """
+    Flujo completo de un puesto de cocina sobre un `OdooClient`: pendientes ->
+    bandeja local (SPOOL) -> impresoras -> marcado en Odoo.
+
+    `printer` es la impresora por defecto (None = la predeterminada de Windows) y
+    puede cambiarse en caliente; `routes` es la tabla de ruteo por categoría TPV.
+    El cursor y la bandeja viven en `data_dir`. Los tiempos por etapa van a
+    `metrics` y, si hay `metrics_file`, se vuelcan ahí en cada tick. Con `station`
+    (nombre del puesto) las líneas se reservan en Odoo antes de imprimir, para
+    correr varios puestos sobre los mismos pedidos (ver cocina_claim). Cada ticket
+    impreso se guarda `archive_days` días en el archivo local (0 = sin archivo;
+    ver cocina_archive). `codepage` es la página de códigos de las impresoras; una
+    ruta puede traer la suya en "codepage".
+    """
+
+    def __init__(self, client, data_dir, printer=None, routes=(), metrics=None, batch_tickets=1, batch_wait=2.0,
+                 full_scan_interval=300, metrics_file=None, station=None, archive_days=ARCHIVE_RETENTION_DAYS,
+                 codepage=None):
+        self.client = client
+        self.data_dir = Path(data_dir)
+        self.printer = printer
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics_file = metrics_file
+        self.batch_tickets = batch_tickets
+        self.batch_wait = batch_wait
+        execute = client.execute if client is not None else None
+        self.fetch_engine = FetchEngine(execute)
+        # Ruteo por estación: categoría TPV -> impresora (clave "routes" del config).
+        # Índice de categorías TPV y productos: filtro de `pos_categ_id` y ruteo por estación.
+        self.categories = CategoryResolver(execute)
+        self.router = Router(list(routes), self.categories)
+        self.codepage = codepage
+        self.codepages = {r['printer']: r['codepage'] for r in routes if r.get('printer') and r.get('codepage')}
+        self.cursor = PendingCursor(self.data_dir / STATE_FILENAME, full_scan_interval=full_scan_interval)
+        self.claimer = LineClaimer(execute, station) if station else None
+        # Pedidos del día compartidos por la impresión y la vista (fetch_recent_printed).
+        self.store = OrderStore()
+        self.behind = False  # el último tick llenó max_orders: process_pending_orders(catch_up=None) vacía el atraso
+        # Tickets ya armados (texto y bytes ESC/POS); sólo los fallos de caché cuentan en build_ticket/escpos_text.
+        self.render = RenderCache(self.metrics.timed('build_ticket', build_ticket),
+                                  self.metrics.timed('escpos_text', escpos_text))
+        self.archive_days = archive_days
+        self._spool = None
+        self._archive = None
+        self._workers = None
+        self._marker = None
+        self._lock = threading.Lock()
+
+    # ----- Bandeja e hilos de impresión (a demanda) -----
+    @property
+    def spool(self):
+        """
+        Bandeja local de comandas: cada pedido leído se guarda antes de imprimir y, una
+        vez impreso, se anota en el diario de marcado que se escribe en Odoo en lotes
+        (MarkWorker mientras se imprime y el tick al final).
+        """
+        with self._lock:
+            if self._spool is None:
+                from cocina_spool import PrintSpool
+                self._spool = PrintSpool(self.data_dir / SPOOL_FILENAME,
+                                         lambda line_ids, printed_at: self.mark_printed(line_ids, printed_at=printed_at))
+            return self._spool
+
+    @property
+    def archive(self):
+        """Archivo local de tickets impresos (búsqueda y reimpresión sin Odoo), o None si está desactivado."""
+        if not self.archive_days:
+            return None
+        with self._lock:
+            if self._archive is None:
+                from cocina_archive import TicketArchive
+                self._archive = TicketArchive(self.data_dir / ARCHIVE_FILENAME, retention_days=self.archive_days)
+            return self._archive
+
+    @property
+    def workers(self):
+        """Etapas de impresión: un hilo por impresora (arma e imprime) y uno de marcado en Odoo."""
+        spool = self.spool
+        with self._lock:
+            if self._workers is None:
+                from cocina_spool import MarkWorker, SpoolWorkers
+                self._marker = MarkWorker(spool.marks)
+                self._marker.start()
+                self._workers = SpoolWorkers(
+                    spool, self.render.ticket,
+                    lambda printer: (lambda batch: self._send_jobs(batch, printer)),
+                    max_tickets=self.batch_tickets, max_bytes=BATCH_MAX_BYTES, max_wait=self.batch_wait,
+                    owned_fn=self.claimer.owned if self.claimer is not None else None,
+                    size_fn=self._ticket_bytes,
+                )
+            return self._workers
+
+    def close(self, timeout=CLOSE_WAIT):
+        """
+        Espera (hasta `timeout` segundos) a que terminen los drains y el marcado en
+        curso, escribe en Odoo las marcas pendientes y cierra impresoras, bandeja,
+        archivo y conexiones.
+
+        Si algún hilo sigue trabado (una impresora que no responde), la bandeja y el
+        archivo quedan abiertos para no cortarle la base a mitad de un trabajo: lo que
+        no llegó a registrarse se retoma desde el diario en el próximo arranque.
+        """
+        with self._lock:
+            workers, self._workers = self._workers, None
+            marker, self._marker = self._marker, None
+        deadline = time.monotonic() + timeout
+        idle = True
+        if workers is not None:
+            idle = workers.stop(timeout) and idle
+        if marker is not None:
+            idle = marker.stop(max(0.0, deadline - time.monotonic())) and idle
+        if not idle:
+            print(f"Advertencia: los hilos de impresión/marcado no terminaron en {timeout:g} s; "
+                  "la bandeja local queda abierta hasta que cierre el proceso.")
+        elif self._spool is not None and self.client is not None:
+            self.flush_marks(verbose=False)
+        close_backends()
+        if idle:
+            with self._lock:
+                spool, self._spool = self._spool, None
+                archive, self._archive = self._archive, None
+            if spool is not None:
+                spool.close()
+            if archive is not None:
+                archive.close()
+        if self.client is not None:
+            self.client.close()
+
+    # ----- Impresión -----
+    def resolve_printer(self):
+        return resolve_printer(self.printer)
+
+    def codepage_for(self, printer):
+        """Página de códigos de `printer`: la de su ruta o la general."""
+        return self.codepages.get(printer, self.codepage)
+
+    def print_raw_selected(self, text: str, verbose=True):
+        printer = self.resolve_printer()
+        backend = get_backend(printer)
+        if verbose:
+            print(f"[PRINT] Usando impresora: {backend.name}")
+        backend.write(self.render.encoded(text, self.codepage_for(printer)), doc_name="Comanda Cocina")
+
+    def print_batch_selected(self, texts, verbose=True, printer=None):
+        """
+        Imprime varias comandas en un solo documento (cada una con su corte) en `printer`
+        (o la impresora seleccionada). Si falla a mitad, la excepción (BatchWriteError)
+        indica cuántas llegaron enteras.
+        """
+        printer = printer or self.resolve_printer()
+        backend = get_backend(printer)
+        if verbose:
+            print(f"[PRINT] Usando impresora: {backend.name} ({len(texts)} comandas en un documento)")
+        codepage = self.codepage_for(printer)
+        tickets = [self.render.encoded(txt, codepage) for txt in texts]
+        with self.metrics.timer('printer_write'):
+            return write_batch(backend, tickets)
+
+    def _ticket_bytes(self, job, txt):
+        """Bytes ESC/POS del ticket en la página de su impresora (los mismos que manda _send_jobs, ya en caché)."""
+        try:
+            printer = job['printer'] or self.resolve_printer()
+        except RuntimeError:
+            printer = None  # sin impresora predeterminada: el envío fallará igual, con su propio error
+        return len(self.render.encoded(txt, self.codepage_for(printer)))
+
+    def _send_jobs(self, batch, printer):
+        """
+        Envío de un lote de la bandeja ([(job, texto), ...]) a `printer`. Lo que llegó
+        entero a la impresora se guarda en el archivo con los mismos bytes.
+        """
+        texts = [txt for _, txt in batch]
+        try:
+            self.print_batch_selected(texts, verbose=False, printer=printer)
+        except Exception as exc:
+            self._archive_jobs(batch[:max(0, int(getattr(exc, 'delivered', 0) or 0))], printer)
+            raise
+        self._archive_jobs(batch, printer)
+
+    def _archive_jobs(self, batch, printer):
+        if not batch or not self.archive_days:
+            return
+        printed_at = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            codepage = self.codepage_for(printer or self.resolve_printer())
+            self.archive.add_many([
+                {'order': job['order'], 'lines': job['lines'], 'ticket_text': txt,
+                 'escpos': self.render.encoded(txt, codepage), 'printer': printer, 'printed_at': printed_at}
+                for job, txt in batch
+            ])
+        except Exception as exc:
+            # Lo impreso ya salió: un fallo del archivo no puede hacer que se reimprima.
+            self.metrics.incr('archive_errors')
+            print(f"[ARCHIVO] No se pudo guardar {len(batch)} tickets: {exc}")
+
+    def search_archive(self, text='', since=None, until=None, limit=ARCHIVE_SEARCH_LIMIT):
+        """Tickets impresos que coinciden con `text` (pedido, mesa o cliente), sin consultar Odoo."""
+        archive = self.archive
+        if archive is None:
+            return []
+        with self.metrics.timer('archive_search'):
+            return archive.search(text, since=since, until=until, limit=limit)
+
+    def reprint_archived(self, ticket_id, printer=None, verbose=True):
+        """
+        Reimprime un ticket del archivo con sus bytes originales en `printer` (por
+        defecto, la impresora donde salió). Devuelve la entrada del archivo.
+        """
+        archive = self.archive
+        entry = archive.get(ticket_id) if archive is not None else None
+        if entry is None:
+            raise LookupError(f"El ticket {ticket_id} no está en el archivo")
+        backend = get_backend(printer or entry['printer'] or self.resolve_printer())
+        if verbose:
+            print(f"[PRINT] Reimprimiendo {entry['order_name']} en {backend.name}")
+        backend.write(entry['escpos'], doc_name="Comanda Cocina")
+        return entry
+
+    def print_test_page(self, msg="PRUEBA COCINA – EPSON TM-T20III"):
+        print_test_page(self.printer, msg, codepage=self.codepage_for(self.printer))
+
+    # ----- Odoo: fetch y marcado -----
+    def iter_pending_pages(self, pos_categ_id=None, page_orders=PENDING_PAGE_ORDERS, cursor=None, skip_line=None):
+        """
+        Generador: páginas {order_id: {'order': order_read, 'lines': [line_read,...]}}
+        de pedidos con líneas pendientes (pedido state in PENDING_ORDER_STATES,
+        x_impreso_cocina=False, qty>0), del pedido más viejo al más nuevo y cada uno
+        con todas sus líneas. Sólo la página actual queda en memoria.
+
+        Si se pasa `cursor` (PendingCursor) y no toca barrido completo, sólo se consultan
+        las líneas modificadas desde la última marca; la marca se propone al terminar
+        (recorrido completo) o se descarta si se corta antes. `skip_line(line_id)`
+        descarta líneas localmente (p. ej. ya en la bandeja).
+        """
+        domain_lines = [
+            ('x_impreso_cocina', '=', False),
+            ('qty', '>', 0),
+            ('order_id.state', 'in', PENDING_ORDER_STATES),
+        ]
+        categ_filter = None
+        if pos_categ_id:
+            categ_domain, categ_filter = self.category_domain(pos_categ_id)
+            domain_lines.extend(categ_domain)
+        recheck = ()
+        if self.claimer is not None:
+            domain_lines.extend(self.claimer.domain())
+            recheck = self.claimer.due()  # perdidas ante otro puesto, cuya reserva ya pudo vencer
+        full_scan = cursor is None or cursor.needs_full_scan()
+        if not full_scan:
+            domain_lines.extend(cursor.domain(recheck))
+        if cursor is not None:
+            cursor.begin(full_scan)
+
+        complete = False
+        try:
+            for res in self.fetch_engine.iter_order_pages(
+                domain_lines, PENDING_LINE_FIELDS, TICKET_ORDER_FIELDS, page_orders=page_orders,
+                line_filter=_all_filters(
+                    (lambda line: not skip_line(line['id'])) if skip_line else None, categ_filter),
+            ):
+                if cursor is not None:
+                    cursor.observe(res.lines, list(res.orders_by_id.values()))
+                page = {}
+                for oid, order in res.orders_by_id.items():
+                    page[oid] = {'order': order, 'lines': res.lines_by_order[oid]}
+                complete = not res.more
+                yield page
+            complete = True
+        finally:
+            if cursor is not None:
+                cursor.finish(truncated=not complete)
+
+    def category_domain(self, pos_categ_id):
+        """
+        Filtro de `--pos-categ` para los dominios de líneas: `(domain, line_filter)`.
+        Sale del índice local de categorías (se actualiza por write_date cada tanto),
+        así Odoo no resuelve el árbol de categorías en cada consulta.
+        """
+        started = time.perf_counter()
+        if self.categories.refresh():
+            self.metrics.observe('category_refresh', time.perf_counter() - started)
+        return self.categories.line_domain(pos_categ_id)
+
+    def fetch_pending_lines(self, pos_categ_id=None, limit_orders=20, cursor=None, skip_line=None):
+        """
+        Devuelve dict {order_id: {'order': order_read, 'lines': [line_read,...]}} con
+        los `limit_orders` pedidos pendientes más viejos (ver iter_pending_pages). Se
+        leen sólo las páginas necesarias; si quedan más pedidos, el cursor no avanza.
+        """
+        out, leftover = {}, False
+        pages = self.iter_pending_pages(pos_categ_id, page_orders=max(1, limit_orders), cursor=cursor,
+                                        skip_line=skip_line)
+        try:
+            for page in pages:
+                for oid, payload in page.items():
+                    if len(out) >= limit_orders:
+                        leftover = True
+                        break
+                    out[oid] = payload
+                if len(out) >= limit_orders:
+                    break  # no se pide la página siguiente
+        finally:
+            pages.close()
+        if leftover and cursor is not None:
+            cursor.discard()  # quedaron pedidos de la página sin tomar: siguen pendientes
+        return out
+
+    def fetch_recent_printed(self, pos_categ_id=None, limit_orders=20):
+        """
+        Obtiene los pedidos del día (impresos o pendientes) ordenados por hora descendente.
+
+        Sale del store compartido: la primera vez (y cada `store.reload_interval`, o si
+        cambia el día o la categoría) se lee de Odoo la ventana reciente completa; las
+        demás, sólo las líneas modificadas desde la marca del store y los pedidos que
+        todavía no conoce. Los tickets salen de `render` (no se rearman si no cambiaron).
+        """
+        store = self.store
+        today_start = dt.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        today_start_str = today_start.strftime('%Y-%m-%d %H:%M:%S')
+
+        domain_lines = [
+            ('qty', '>', 0),
+            ('order_id.state', 'in', ['paid', 'done', 'invoiced']),
+            ('order_id.date_order', '>=', today_start_str),
+        ]
+        categ_filter = None
+        if pos_categ_id:
+            categ_domain, categ_filter = self.category_domain(pos_categ_id)
+            domain_lines.extend(categ_domain)
+
+        if store.needs_reload(pos_categ_id, today_start_str):
+            # Traemos suficientes líneas para cubrir el límite deseado de pedidos.
+            res = self.fetch_engine.fetch_lines_with_orders(
+                domain_lines, RECENT_LINE_FIELDS, TICKET_ORDER_FIELDS,
+                limit=max(50, limit_orders * 10), order='write_date desc, id desc', line_filter=categ_filter,
+            )
+            store.reset(pos_categ_id, today_start_str)
+        else:
+            # `>=`: otras líneas pueden compartir el segundo de la marca; repetirlas no cambia nada.
+            domain_lines.append(('write_date', '>=', store.watermark or today_start_str))
+            res = self.fetch_engine.fetch_lines_with_orders(
+                domain_lines, RECENT_LINE_FIELDS, TICKET_ORDER_FIELDS,
+                limit=PENDING_SEARCH_LIMIT, order='write_date desc, id desc',
+                select_orders=lambda order_ids: [oid for oid in order_ids if not store.has_order(oid)],
+                line_filter=categ_filter,
+            )
+            if res.scanned >= PENDING_SEARCH_LIMIT:
+                store.invalidate()  # demasiados cambios juntos: la próxima vez, recarga completa
+        store.merge(res.lines, list(res.orders_by_id.values()), from_odoo=True)
+        return store.view(limit_orders, render=self.render.ticket)
+
+    def recent_orders(self, pos_categ_id=None, limit_orders=20):
+        """
+        Lo mismo que fetch_recent_printed pero sólo desde el store (sin Odoo), p. ej.
+        tras imprimir. None si el store todavía no se cargó para esa categoría.
+        """
+        if not self.store.accepts(pos_categ_id):
+            return None
+        return self.store.view(limit_orders, render=self.render.ticket)
+
+    def mark_printed(self, line_ids, error_msg=None, printed_at=None):
+        vals = {'x_impreso_cocina': True}
+        try:
+            now_str = printed_at or dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+            vals['x_impreso_fecha'] = now_str  # si el campo existe
+        except Exception:
+            pass
+        with self.metrics.timer('mark_printed'):
+            return self.client.execute('pos.order.line', 'write', [line_ids, vals])
+
+    def spool_orders(self, batches):
+        """Guarda los pedidos leídos en la bandeja, repartidos por impresora si hay ruteo."""
+        router, spool = self.router, self.spool
+        if router:
+            router.resolver.prefetch(
+                l['product_id'][0] for p in batches.values() for l in p['lines'] if l.get('product_id')
+            )
+        for payload in batches.values():
+            order, lines = payload['order'], payload['lines']
+            if router:
+                for printer, station_lines in router.split(lines).items():
+                    spool.add_job(order, station_lines, printer=printer)
+            else:
+                spool.add_job(order, lines)
+
+    # ----- Tick -----
+    def process_pending_orders(self, pos_categ_id=None, max_orders=20, dry_run=False, verbose=True, print_wait=None,
+                               catch_up=False):
+        """
+        Un tick: lee pendientes de Odoo, los guarda en la bandeja local (SPOOL), imprime
+        todo lo que la bandeja tenga sin imprimir (incluido lo que quedó de corridas
+        anteriores) y marca en Odoo lo impreso. Los tiempos quedan en `metrics` y el
+        resultado trae además `fetched` (pedidos leídos de Odoo), `tick_seconds` y
+        `backlog` (trabajos sin imprimir).
+
+        Un tick normal lee los `max_orders` pedidos pendientes más viejos. Con
+        `catch_up` (p. ej. tras un corte) se recorre todo lo pendiente por páginas y
+        cada página va a la bandeja apenas llega, mientras las impresoras ya imprimen
+        las anteriores. `catch_up=None` lo decide solo: se activa cuando el tick
+        anterior llenó `max_orders` (quedaba atraso). En dry-run no aplica.
+        """
+        if catch_up is None:
+            catch_up = self.behind
+        started = time.monotonic()
+        try:
+            result = self._process_pending_orders(pos_categ_id, max_orders, dry_run, verbose, print_wait,
+                                                  catch_up and not dry_run)
+        except Exception:
+            self.metrics.incr('tick_errors')
+            self.metrics.observe('tick', time.monotonic() - started)
+            raise
+        self.record_tick_metrics(result, time.monotonic() - started)
+        return result
+
+    def claim_lines(self, batches):
+        """Con `station`: reserva las líneas leídas y deja sólo las ganadas (sin station, igual)."""
+        claimer = self.claimer
+        if claimer is None or not batches:
+            return batches
+        won, lost = claimer.won, claimer.lost
+        with self.metrics.timer('claim_lines'):
+            batches = claimer.claim(batches)
+        self.metrics.incr('claims_won', claimer.won - won)
+        self.metrics.incr('claims_lost', claimer.lost - lost)
+        return batches
+
+    def _merge_pending(self, pos_categ_id, batches):
+        if batches and self.store.accepts(pos_categ_id):
+            self.store.merge([l for p in batches.values() for l in p['lines']],
+                             [p['order'] for p in batches.values()], from_odoo=False)
+
+    def _spool_pending_pages(self, pos_categ_id):
+        """
+        Catch-up: pasa a la bandeja todos los pendientes, página por página, y despierta
+        las impresoras tras cada una; la página siguiente se pide mientras imprimen.
+        Si la bandeja llega a PIPELINE_MAX_BACKLOG trabajos sin imprimir se espera a
+        la impresora antes de leer más, y si las impresoras no avanzan (con error) se
+        corta: el resto queda para el próximo tick. Devuelve (pedidos leídos, segundos
+        esperando a Odoo).
+        """
+        fetched, fetch_seconds = 0, 0.0
+        pages = self.iter_pending_pages(
+            pos_categ_id, page_orders=PENDING_PAGE_ORDERS, cursor=self.cursor,
+            skip_line=lambda line_id: self.spool.is_spooled(line_id),
+        )
+        try:
+            started = time.monotonic()
+            for page in pages:
+                fetch_seconds += time.monotonic() - started
+                page = self.claim_lines(page)
+                self._merge_pending(pos_categ_id, page)
+                self.spool_orders(page)
+                self.workers.wake(self.spool.unfinished_printers())
+                fetched += len(page)
+                if not self._wait_for_printers(PIPELINE_MAX_BACKLOG):
+                    self.behind = True
+                    break
+                started = time.monotonic()
+            else:
+                fetch_seconds += time.monotonic() - started
+        finally:
+            pages.close()
+        return fetched, fetch_seconds
+
+    def _wait_for_printers(self, max_backlog):
+        """Back-pressure: espera a que la bandeja baje de `max_backlog`. False si las impresoras no avanzan."""
+        spool, workers = self.spool, self.workers
+        while True:
+            counts = spool.counts()
+            if counts['fetched'] + counts['rendered'] < max_backlog:
+                return True
+            if not workers.busy():
+                return False
+            time.sleep(PIPELINE_POLL)
+
+    def queue_depths(self):
+        """Trabajos esperando en cada etapa del pipeline (ver PrintSpool.queue_depths)."""
+        return self.spool.queue_depths()
+
+    def _process_pending_orders(self, pos_categ_id, max_orders, dry_run, verbose, print_wait, catch_up):
+        cursor, engine = self.cursor, self.fetch_engine
+        if catch_up:
+            batches = None
+            self.behind = False
+            fetched, fetch_seconds = self._spool_pending_pages(pos_categ_id)
+        else:
+            fetch_started = time.monotonic()
+            # La bandeja (SQLite) se abre al filtrar la respuesta, no antes de la primera consulta.
+            batches = self.fetch_pending_lines(
+                pos_categ_id=pos_categ_id, limit_orders=max_orders, cursor=cursor,
+                skip_line=lambda line_id: self.spool.is_spooled(line_id),
+            )
+            fetch_seconds = time.monotonic() - fetch_started
+            fetched = len(batches)
+            self.behind = bool(max_orders) and fetched >= max_orders
+            if not dry_run:
+                batches = self.claim_lines(batches)  # dry-run no escribe en Odoo: tampoco reserva
+            self._merge_pending(pos_categ_id, batches)
+        spool = self.spool
+        self.metrics.observe('fetch_pending', fetch_seconds)
+        if verbose and fetched:
+            print(f"[ODOO] {fetched} pedidos leídos en {engine.last_round_trips} llamadas.")
+
+        if dry_run:
+            cursor.discard()
+            if not batches:
+                if verbose:
+                    print(f"No hay líneas pendientes para imprimir. ({engine.last_round_trips} llamadas a Odoo)")
+                return {'printed': [], 'errors': [], 'mark_error': None, 'marks_pending': spool.marks.pending_count(),
+                        'fetched': 0, 'fetch_seconds': fetch_seconds}
+            printed_payloads = []
+            for oid, payload in batches.items():
+                order = payload['order']
+                routed = self.router.split(payload['lines']) if self.router else {None: payload['lines']}
+                for printer, lines in routed.items():
+                    txt = self.render.ticket(order, lines)
+                    if verbose:
+                        print(f"\n=== Pedido {order.get('name')} (ID {oid}) -> {printer or 'impresora predeterminada'} ===")
+                        print(plain_text(txt))
+                        print("DRY-RUN: no se imprime ni se marca.")
+                    printed_payloads.append({'order': order, 'lines': lines, 'ticket_text': txt, 'printer': printer})
+            return {'printed': printed_payloads, 'errors': [], 'mark_error': None,
+                    'marks_pending': spool.marks.pending_count(), 'fetched': fetched, 'fetch_seconds': fetch_seconds}
+
+        if batches:
+            self.spool_orders(batches)
+        # Lo leído ya está a salvo en la bandeja local: el cursor puede avanzar aunque
+        # después falle la impresión (los trabajos con error se reintentan desde ahí).
+        cursor.commit()
+
+        # Cada impresora se vacía en su propio hilo (con el armado un paso adelante y
+        # el marcado en Odoo detrás); se espera hasta `print_wait` segundos (None =
+        # hasta terminar). Lo que termine después se informa en el próximo tick.
+        workers = self.workers
+        workers.wake(spool.unfinished_printers())
+        result = workers.collect(timeout=print_wait)
+        for payload in result['printed']:
+            printed_at = payload.get('printed_at')
+            self.store.mark_printed(
+                [line['id'] for line in payload['lines']],
+                write_date=dt.datetime.utcfromtimestamp(printed_at).strftime('%Y-%m-%d %H:%M:%S') if printed_at else None,
+            )
+        if verbose:
+            if not fetched and not result['printed'] and not result['errors']:
+                print(f"No hay líneas pendientes para imprimir. ({engine.last_round_trips} llamadas a Odoo)")
+            for payload in result['printed']:
+                order = payload['order']
+                print(f"\n=== Pedido {order.get('name')} (ID {order.get('id')}) ===")
+                print(plain_text(payload['ticket_text']))
+                print(f"OK: Impreso en {payload['printer'] or 'impresora predeterminada'} (marcado en cola).")
+            for err in result['errors']:
+                print(f"ERROR al imprimir pedido {err['order'].get('name')}: {err['error']}")
+            for payload in result['released']:
+                print(f"Pedido {payload['order'].get('name')}: la reserva venció y otro puesto tomó "
+                      f"{len(payload['lines'])} línea(s); no se imprimen acá.")
+
+        mark_error = self.flush_marks(verbose=verbose)
+        spool.purge()
+        if self.archive is not None:
+            self.archive.maybe_compact()
+        return {
+            'printed': result['printed'],
+            'errors': result['errors'],
+            'released': result['released'],
+            'mark_error': mark_error,
+            'marks_pending': spool.marks.pending_count(),
+            'fetched': fetched,
+            'fetch_seconds': fetch_seconds,
+        }
+
+    def record_tick_metrics(self, result, tick_seconds):
+        """Anota el tick en `metrics` (y en `result`: tick_seconds, backlog, queues) y exporta a `metrics_file`."""
+        metrics = self.metrics
+        depths = self.queue_depths()
+        backlog = depths['to_render'] + depths['to_print']
+        result['tick_seconds'] = tick_seconds
+        result['backlog'] = backlog
+        result['queues'] = depths
+        metrics.observe('tick', tick_seconds)
+        metrics.incr('ticks')
+        metrics.incr('tickets_printed', len(result['printed']))
+        metrics.incr('print_errors', len(result['errors']))
+        metrics.incr('claims_released', sum(len(p['lines']) for p in result.get('released', ())))
+        metrics.set_gauge('last_tick_ms', round(tick_seconds * 1000, 1))
+        metrics.set_gauge('backlog', backlog)
+        metrics.set_gauge('marks_pending', result['marks_pending'])
+        for stage, depth in depths.items():
+            metrics.set_gauge(f"queue_{stage}", depth)
+        for name, value in self.render.stats().items():
+            metrics.set_gauge(f"render_cache_{name}", value)
+        rpc = self.client.rpc_stats() if self.client is not None else None
+        if rpc:
+            metrics.set_gauge('rpc_breaker_open', 0 if rpc['state'] == 'closed' else 1)
+            for name in ('retried', 'failures', 'rejected', 'trips'):
+                metrics.set_gauge(f"rpc_{name}", rpc[name])
+        for payload in result['printed']:
+            paid_at = _order_epoch(payload['order'])
+            if payload.get('printed_at') and paid_at:
+                metrics.observe('paid_to_printed', max(0.0, payload['printed_at'] - paid_at))
+        if self.metrics_file:
+            try:
+                metrics.write_file(self.metrics_file)
+            except OSError as exc:
+                print(f"Advertencia: no se pudo escribir {self.metrics_file}: {exc}")
+
+    def retry_dead_marks(self, line_ids=None, verbose=True):
+        """
+        Devuelve al diario las líneas que Odoo rechazó hasta `mark_dead` (todas o las de
+        `line_ids`) y las escribe ya; si vuelven a fallar quedan en el diario como
+        cualquier otra. Devuelve cuántas se reencolaron.
+        """
+        requeued = self.spool.marks.requeue_dead(line_ids)
+        if requeued:
+            self.flush_marks(verbose=verbose)
+        return requeued
+
+    def flush_marks(self, verbose=True):
+        """Escribe en Odoo el marcado acumulado. Devuelve la excepción si falló (queda en el diario)."""
+        marks = self.spool.marks
+        if not marks.pending_count():
+            return None
+        try:
+            done = marks.flush()
+            if verbose:
+                print(f"[ODOO] Marcadas {done} líneas como impresas.")
+            return None
+        except Exception as exc:
+            if verbose:
+                print(f"ADVERTENCIA: no se pudo marcar en Odoo ({exc}). "
+                      f"{marks.pending_count()} líneas quedan en el diario local y se reintentan.")
+            return exc
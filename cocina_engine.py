@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_engine.py
+Bucle de impresión automática, independiente de la interfaz.
+
+`AutoEngine` repite: tick (leer, imprimir, marcar) -> decidir la espera (intervalo
+fijo o adaptable) -> esperar (intervalo, aviso del bus o pedido de parada). Corre
+en su propio hilo; quien quiera enterarse (consola de `--watch`, GUI) se suscribe
+y recibe cada evento como un dict:
+
+  {'type': 'started', 'mode': 'cada 5 s'}
+  {'type': 'tick', 'result': {...}, 'interval': 5.0, 'status': '...', 'reason_changed': bool}
+  {'type': 'error', 'error': exc, 'interval': 10.0, 'status': '...', 'reason_changed': bool}
+  {'type': 'bus', 'available': bool, 'error': exc_o_None}
+  {'type': 'stopped'}
+
+Los ticks (automáticos o pedidos a mano con `run_once`) nunca corren en paralelo.
+
+Uso:
+  engine = AutoEngine(tick_fn, interval_fn, scheduler_factory=..., trigger_factory=...)
+  engine.subscribe(lambda ev: print(ev['type']))
+  engine.start()
+  ...
+  engine.stop()
+"""
+
+import threading
+import time
+
+BUS_SAFETY_INTERVAL = 120  # con el bus activo se consulta igual cada tanto, por si se perdió un aviso
+_WAIT_SLICE = 0.5          # las esperas se cortan en tramos cortos para atender la parada enseguida
+
+
+class AutoEngine:
+    """
+    `tick_fn()` ejecuta un tick y devuelve el resultado de process_pending_orders.
+    `interval_fn()` da el intervalo fijo (se relee en cada vuelta: puede cambiar).
+    `scheduler_factory(base)` y `trigger_factory(on_status)` crean, al arrancar, el
+    planificador adaptable y el escucha del bus; pueden devolver None.
+    """
+
+    def __init__(self, tick_fn, interval_fn, scheduler_factory=None, trigger_factory=None,
+                 safety_interval=BUS_SAFETY_INTERVAL):
+        self.tick_fn = tick_fn
+        self.interval_fn = interval_fn
+        self.scheduler_factory = scheduler_factory
+        self.trigger_factory = trigger_factory
+        self.safety_interval = safety_interval
+        self.scheduler = None
+        self.trigger = None
+        self.started_at = None
+        self.ticks = 0
+        self.printed = 0
+        self.tick_errors = 0
+        self._tick_lock = threading.Lock()
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ----- Suscripción -----
+    def subscribe(self, fn):
+        with self._listeners_lock:
+            self._listeners.append(fn)
+        return fn
+
+    def unsubscribe(self, fn):
+        with self._listeners_lock:
+            if fn in self._listeners:
+                self._listeners.remove(fn)
+
+    def _emit(self, event):
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for fn in listeners:
+            try:
+                fn(event)
+            except Exception:
+                pass
+
+    # ----- Control -----
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Arranca el bucle. Devuelve False si el anterior todavía está terminando su tick."""
+        if self.running:
+            return not self._stop.is_set()
+        self._stop.clear()
+        self.scheduler = self.scheduler_factory(self.interval_fn()) if self.scheduler_factory else None
+        self.trigger = self.trigger_factory(self._on_bus_status) if self.trigger_factory else None
+        if self.trigger is not None:
+            self.trigger.start()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._loop, name="cocina-auto", daemon=True)
+        self._thread.start()
+        self._emit({'type': 'started', 'mode': self.describe_mode()})
+        return True
+
+    def stop(self, timeout=None):
+        """Pide la parada; el tick en curso termina. Espera hasta `timeout` s (None = sin esperar)."""
+        self._stop.set()
+        trigger, self.trigger = self.trigger, None
+        if trigger is not None:
+            trigger.stop()
+        thread = self._thread
+        if thread is not None and timeout is not None:
+            thread.join(timeout)
+
+    def join(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def describe_mode(self):
+        mode = "intervalo adaptable" if self.scheduler is not None else f"cada {self.interval_fn()} s"
+        if self.trigger is not None:
+            channels = ", ".join(getattr(self.trigger.client, 'channels', []))
+            mode += f", bus de Odoo canal {channels}"
+        return mode
+
+    # ----- Ticks -----
+    def run_once(self):
+        """Un tick ya mismo (p. ej. botón de la GUI); espera si hay otro en curso."""
+        with self._tick_lock:
+            result = self.tick_fn()
+            self._count(result)
+        return result
+
+    def _count(self, result):
+        self.ticks += 1
+        self.printed += len(result.get('printed') or [])
+
+    def _loop(self):
+        try:
+            while not self._stop.is_set():
+                tick_error = None
+                result = None
+                try:
+                    with self._tick_lock:
+                        result = self.tick_fn()
+                        self._count(result)
+                except Exception as exc:
+                    tick_error = exc
+                    with self._tick_lock:
+                        self.ticks += 1
+                        self.tick_errors += 1
+                interval, status, changed = self._next_interval(result, tick_error)
+                if tick_error is not None:
+                    self._emit({'type': 'error', 'error': tick_error, 'interval': interval,
+                                'status': status, 'reason_changed': changed})
+                else:
+                    self._emit({'type': 'tick', 'result': result, 'interval': interval,
+                                'status': status, 'reason_changed': changed})
+                self._wait(interval)
+        finally:
+            self._emit({'type': 'stopped'})
+
+    def _next_interval(self, result, tick_error):
+        if self.scheduler is not None:
+            result = result or {}
+            # Un trabajo que falla en cada tick (impresora apagada) no es trabajo nuevo:
+            # se informa aparte para que el intervalo se estire en vez de quedar al mínimo.
+            found_work = bool(result.get('printed') or result.get('fetched'))
+            error = tick_error or result.get('mark_error')
+            print_errors = result.get('errors') or []
+            print_error = print_errors[-1]['error'] if print_errors else None
+            interval, _ = self.scheduler.record_tick(found_work, latency=result.get('fetch_seconds'), error=error,
+                                                     print_error=print_error)
+            status, changed = self.scheduler.describe(), self.scheduler.changed
+        else:
+            interval = self.interval_fn()
+            status, changed = f"próximo tick en {interval} s: intervalo fijo", False
+        trigger = self.trigger
+        if trigger is not None and trigger.available:
+            status += " · o al recibir aviso del bus"
+        return interval, status, changed
+
+    def _wait(self, interval):
+        """Espera el próximo tick: `interval` s, o con el bus activo hasta el aviso (o safety_interval)."""
+        trigger = self.trigger
+        if trigger is not None:
+            trigger.wait(max(self.safety_interval, interval), fallback_timeout=interval, stop=self._stop)
+            return
+        deadline = time.monotonic() + interval
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._stop.wait(min(remaining, _WAIT_SLICE))
+
+    def _on_bus_status(self, available, error):
+        self._emit({'type': 'bus', 'available': available, 'error': error})
+
+    def stats_line(self):
+        uptime = int(time.time() - self.started_at) if self.started_at else 0
+        hours, rest = divmod(uptime, 3600)
+        return (f"Automático: {hours}h{rest // 60:02d}m en marcha, {self.ticks} ticks, "
+                f"{self.printed} comandas impresas, {self.tick_errors} ticks con error")
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_escpos.py
+Codificación de tickets a bytes ESC/POS, con página de códigos por impresora.
+
+Cada `EscPosEncoder` se arma una vez por página de códigos y se reutiliza: tiene
+precalculados los bytes de inicio (`ESC @` + `ESC t n`, que elige la página en la
+impresora), de avance y corte y de cada estilo, y la tabla de lo que la página no
+tiene con su reemplazo más parecido ("Á" -> "A" en cp437, "–" -> "-", "€" -> "EUR").
+La tabla se consulta desde un manejador de errores del codec, así el texto que la
+página sí tiene (casi todo) se codifica en C sin mirar carácter por carácter. Lo
+que ni así se puede imprimir sale como "?", nunca se pierde en silencio.
+
+Marcado de estilos dentro del texto del ticket (sólo estas etiquetas exactas):
+  <b>negrita</b>   <h>doble alto</h>   <i>inverso (blanco sobre negro)</i>
+`plain_text()` lo quita para mostrar el ticket en pantalla.
+
+Uso:
+  encoder = get_encoder("cp858")              # uno por página, compartido
+  data = encoder.encode("<h>COMANDA</h>\\n1 x Ñoquis")
+  plain_text("<b>Mesa 5</b>")                 # -> "Mesa 5"
+"""
+
+import codecs
+import re
+import threading
+import unicodedata
+
+ESC = b'\x1b'
+GS = b'\x1d'
+LF = b'\n'
+INIT = ESC + b'@'
+CUT = GS + b'\x56\x01'     # corte parcial; probá \x00 si no corta
+FEED_LINES = 3             # avance antes del corte
+
+# Página de códigos de Python -> n de `ESC t n` (tabla de Epson; la TM-T20III tiene todas).
+CODEPAGES = {
+    'cp437': 0,    # PC437 (EE.UU.), la de fábrica
+    'cp850': 2,    # PC850 Multilingüe
+    'cp860': 3,    # PC860 Portugués
+    'cp863': 4,    # PC863 Francés canadiense
+    'cp865': 5,    # PC865 Nórdico
+    'cp1252': 16,  # WPC1252 (Windows Latin 1)
+    'cp866': 17,   # PC866 Cirílico
+    'cp852': 18,   # PC852 Latin 2
+    'cp858': 19,   # PC858 (PC850 con €)
+}
+DEFAULT_CODEPAGE = 'cp437'
+
+# Estilos: etiqueta -> (activar, desactivar)
+STYLES = {
+    'b': (ESC + b'E\x01', ESC + b'E\x00'),    # negrita
+    'h': (GS + b'!\x01', GS + b'!\x00'),      # doble alto
+    'i': (GS + b'B\x01', GS + b'B\x00'),      # inverso
+}
+_MARKUP = re.compile(r"<(/?)([bhi])>")
+# Las secuencias de estilo son ASCII: se reemplazan en el texto antes de codificar.
+_STYLE_TEXT = [(f"<{'/' if off else ''}{tag}>", codes[off].decode('ascii'))
+               for tag, codes in STYLES.items() for off in (0, 1)]
+
+# Reemplazos que la descomposición Unicode no resuelve (comillas, guiones, símbolos).
+TRANSLIT = {
+    '‘': "'", '’': "'", '‚': "'", '‛': "'", '′': "'",
+    '“': '"', '”': '"', '„': '"', '‟': '"', '″': '"', '«': '"', '»': '"',
+    '‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '―': '-', '−': '-',
+    '…': '...', '•': '*', '·': '.', '€': 'EUR', '™': 'TM', '®': '(R)', '©': '(C)',
+    '½': '1/2', '¼': '1/4', '¾': '3/4', 'º': 'o', 'ª': 'a', '°': 'o', '×': 'x',
+    '\u00a0': ' ', '\u2009': ' ', '\u200b': '', 'ß': 'ss', 'Æ': 'AE', 'æ': 'ae', 'Ø': 'O', 'ø': 'o',
+}
+# Caracteres que se revisan al armar cada tabla: Latin-1, Latin extendido A/B y puntuación general.
+_TABLE_RANGES = ((0x00a0, 0x0250), (0x2000, 0x20d0), (0x2100, 0x2200))
+
+
+def plain_text(text):
+    """El texto del ticket sin etiquetas de estilo (para pantalla y registro)."""
+    return _MARKUP.sub('', text or '')
+
+
+def _fallback(ch):
+    if ch in TRANSLIT:
+        return TRANSLIT[ch]
+    folded = unicodedata.normalize('NFKD', ch).encode('ascii', 'ignore').decode('ascii')
+    return folded or '?'
+
+
+def translit_table(codepage):
+    """Lo que `codepage` no puede codificar (de los rangos habituales) y su reemplazo ASCII."""
+    table = {}
+    for start, end in _TABLE_RANGES:
+        for code in range(start, end):
+            ch = chr(code)
+            try:
+                ch.encode(codepage)
+            except UnicodeEncodeError:
+                table[ch] = _fallback(ch)
+    return table
+
+
+# Reemplazos de todas las páginas juntas: son ASCII, así que sirven en cualquiera.
+_TRANSLIT_CACHE = {}
+_TRANSLIT_ERRORS = 'cocina_translit'
+
+
+def _translit_errors(exc):
+    if not isinstance(exc, UnicodeEncodeError):
+        raise exc
+    chunk = exc.object[exc.start:exc.end]
+    out = []
+    for ch in chunk:
+        repl = _TRANSLIT_CACHE.get(ch)
+        if repl is None:
+            repl = _TRANSLIT_CACHE[ch] = _fallback(ch)  # fuera de los rangos precalculados (p. ej. emoji)
+        out.append(repl)
+    return ''.join(out), exc.end
+
+
+codecs.register_error(_TRANSLIT_ERRORS, _translit_errors)
+
+
+class EscPosEncoder:
+    """Texto (con marcado de estilos) -> bytes ESC/POS en la página `codepage`."""
+
+    def __init__(self, codepage=DEFAULT_CODEPAGE, feed_lines=FEED_LINES, cut=CUT):
+        if codepage not in CODEPAGES:
+            raise ValueError(f"Página de códigos no soportada: {codepage} (opciones: {', '.join(CODEPAGES)})")
+        self.codepage = codepage
+        _TRANSLIT_CACHE.update(translit_table(codepage))
+        self.prefix = INIT + ESC + b't' + bytes([CODEPAGES[codepage]])
+        self.suffix = LF * feed_lines + cut
+
+    def text_bytes(self, text):
+        """Sólo el cuerpo: codificado con reemplazos, sin inicio ni corte (ni estilos)."""
+        return text.encode(self.codepage, errors=_TRANSLIT_ERRORS)
+
+    def encode(self, text, cut=True):
+        """Ticket completo: inicio y página de códigos, cuerpo con estilos y, con `cut`, avance y corte."""
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if '<' in text:
+            for tag, codes in _STYLE_TEXT:
+                text = text.replace(tag, codes)
+        return self.prefix + self.text_bytes(text) + (self.suffix if cut else b'')
+
+
+_ENCODERS = {}
+_ENCODERS_LOCK = threading.Lock()
+
+
+def get_encoder(codepage=None):
+    """Encoder compartido de `codepage` (None = DEFAULT_CODEPAGE); la tabla se arma una sola vez."""
+    codepage = codepage or DEFAULT_CODEPAGE
+    with _ENCODERS_LOCK:
+        encoder = _ENCODERS.get(codepage)
+        if encoder is None:
+            encoder = _ENCODERS[codepage] = EscPosEncoder(codepage)
+        return encoder
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_metrics.py
+Tiempos por etapa (Odoo, armado del ticket, impresora, marcado) y de punta a punta
+(cobro -> impresión), para saber de quién es la culpa cuando una comanda tarda.
+
+Cada etapa guarda sus últimas `window` mediciones y calcula p50/p95/p99 al
+consultarla; además hay contadores y valores instantáneos (backlog, último tick).
+Se exporta en JSON (archivo o `/metrics.json`) o en formato de texto de
+Prometheus (`/metrics`).
+
+Uso:
+  METRICS = Metrics()
+  with METRICS.timer('mark_printed'):
+      ...
+  render = METRICS.timed('build_ticket', build_ticket)
+  METRICS.set_gauge('backlog', 3)
+  METRICS.write_file('metrics.json')
+  start_http_server(METRICS, 9108)   # http://127.0.0.1:9108/metrics
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_WINDOW = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """Últimas `size` mediciones (segundos) más cuenta y suma de toda la vida del proceso."""
+
+    def __init__(self, size=DEFAULT_WINDOW):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        samples = sorted(self._samples)
+        out = {'count': self.count, 'sum_s': round(self.total, 6), 'window': len(samples)}
+        if not samples:
+            return out
+        for q in QUANTILES:
+            # Rango más cercano: el menor valor que deja al menos q de la ventana por debajo.
+            idx = min(len(samples) - 1, max(0, int(q * len(samples) + 0.999999) - 1))
+            out[f"p{int(q * 100)}_ms"] = round(samples[idx] * 1000, 3)
+        out['max_ms'] = round(samples[-1] * 1000, 3)
+        out['mean_ms'] = round(sum(samples) / len(samples) * 1000, 3)
+        return out
+
+
+class Metrics:
+    """Registro de histogramas, contadores y valores instantáneos (seguro entre hilos)."""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = RollingHistogram(self.window)
+            hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def timed(self, name, fn):
+        """Envuelve `fn` para medir cada llamada bajo `name`."""
+        def wrapper(*fn_args, **fn_kwargs):
+            with self.timer(name):
+                return fn(*fn_args, **fn_kwargs)
+        wrapper.__name__ = getattr(fn, '__name__', name)
+        wrapper.__doc__ = getattr(fn, '__doc__', None)
+        return wrapper
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def gauge(self, name, default=None):
+        with self._lock:
+            return self._gauges.get(name, default)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'generated_at': time.time(),
+                'uptime_s': round(time.time() - self.started, 1),
+                'gauges': dict(self._gauges),
+                'counters': dict(self._counters),
+                'timings': {name: hist.summary() for name, hist in sorted(self._histograms.items())},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix="cocina"):
+        """Formato de texto de Prometheus: un `summary` por etapa, contadores y gauges."""
+        snap = self.snapshot()
+        out = [f"# TYPE {prefix}_stage_seconds summary"]
+        for name, summary in snap['timings'].items():
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            for q in QUANTILES:
+                key = f"p{int(q * 100)}_ms"
+                if key in summary:
+                    out.append(f'{prefix}_stage_seconds{{stage="{label}",quantile="{q}"}} {summary[key] / 1000:.6f}')
+            out.append(f'{prefix}_stage_seconds_count{{stage="{label}"}} {summary["count"]}')
+            out.append(f'{prefix}_stage_seconds_sum{{stage="{label}"}} {summary["sum_s"]:.6f}')
+        for name, value in sorted(snap['counters'].items()):
+            out.append(f"# TYPE {prefix}_{name}_total counter")
+            out.append(f"{prefix}_{name}_total {value}")
+        for name, value in sorted(snap['gauges'].items()):
+            if isinstance(value, (int, float)):
+                out.append(f"# TYPE {prefix}_{name} gauge")
+                out.append(f"{prefix}_{name} {value}")
+        out.append(f"{prefix}_uptime_seconds {snap['uptime_s']}")
+        return "\n".join(out) + "\n"
+
+    def write_file(self, path):
+        """Escribe el JSON de forma atómica (archivo temporal + reemplazo)."""
+        path = str(path)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(self.to_json())
+        os.replace(tmp, path)
+
+
+def start_http_server(metrics, port, host='127.0.0.1'):
+    """Sirve `/metrics` (Prometheus) y `/metrics.json` en un hilo de fondo. Devuelve el servidor."""
+    # http.server se importa recién acá: la mayoría de las corridas no exporta por HTTP.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *log_args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] == '/metrics':
+                body, ctype = metrics.to_prometheus(), 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path.split('?')[0] == '/metrics.json':
+                body, ctype = metrics.to_json(), 'application/json; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="cocina-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_odoo.py
+Capa compartida de lectura de Odoo para los scripts de cocina.
+
+Junta `search` + `read` + `read` en un `search_read` de líneas más (si hace falta)
+un único `read` de pedidos, y cuenta cuántas llamadas RPC usó cada consulta.
+
+Uso:
+  engine = FetchEngine(execute)   # execute(model, method, args, kwargs) -> resultado
+  res = engine.fetch_lines_with_orders(domain, LINE_FIELDS, ORDER_FIELDS, limit=500)
+  res.lines, res.orders_by_id, res.round_trips
+  for page in engine.iter_order_pages(domain, LINE_FIELDS, ORDER_FIELDS, page_orders=100):
+      page.orders_by_id, page.lines_by_order, page.more
+"""
+
+import threading
+import time
+
+LINE_FIELDS = ['id', 'order_id', 'product_id', 'display_name', 'qty', 'note', 'x_impreso_cocina', 'write_date']
+ORDER_FIELDS = ['id', 'name', 'partner_id', 'table_id', 'date_order', 'amount_total', 'state', 'write_date']
+
+# Campos justos que usa cada consumidor (menos bytes y menos parseo por llamada).
+# En pendientes `x_impreso_cocina` siempre es False por dominio, así que no se pide.
+PENDING_LINE_FIELDS = ['id', 'order_id', 'product_id', 'display_name', 'qty', 'note', 'write_date']
+RECENT_LINE_FIELDS = PENDING_LINE_FIELDS + ['x_impreso_cocina']
+TICKET_ORDER_FIELDS = ['id', 'name', 'partner_id', 'table_id', 'date_order', 'write_date']
+
+# Campos de pedido que ya vienen en el par many2one `order_id` de cada línea.
+_ORDER_FIELDS_FROM_LINE = {'id', 'name'}
+
+CATEGORY_REFRESH_INTERVAL = 300  # segundos entre actualizaciones del índice de categorías/productos
+CATEGORY_MAX_IDS = 5000          # más productos que esto en una categoría: se filtra con child_of
+
+
+def order_domain_from_lines(domain):
+    """
+    Traduce un dominio de pos.order.line a uno de pos.order: `order_id.campo` pasa
+    a `campo` y el resto a `lines.campo` (algún renglón lo cumple). Cada condición
+    se evalúa por separado sobre las líneas, así que el resultado puede incluir
+    pedidos de más (nunca de menos): las líneas se vuelven a filtrar con `domain`.
+    """
+    out = []
+    for term in domain:
+        if isinstance(term, (list, tuple)):
+            field, op, value = term
+            if field.startswith('order_id.'):
+                field = field[len('order_id.'):]
+            elif field == 'order_id':
+                field = 'id'
+            else:
+                field = 'lines.' + field
+            term = (field, op, value)
+        out.append(term)
+    return out
+
+
+class FetchResult:
+    """Resultado de una consulta: líneas agrupadas por pedido y pedidos leídos."""
+
+    def __init__(self, lines, lines_by_order, orders_by_id, round_trips, scanned=None, more=False):
+        self.lines = lines
+        self.lines_by_order = lines_by_order
+        self.orders_by_id = orders_by_id
+        self.round_trips = round_trips
+        self.scanned = len(lines) if scanned is None else scanned  # filas devueltas por Odoo
+        self.more = more  # en iter_order_pages: puede haber más páginas después de esta
+
+    def __bool__(self):
+        return bool(self.lines)
+
+
+class FetchEngine:
+    """
+    Ejecuta las lecturas de líneas+pedidos con la menor cantidad de llamadas posible
+    y lleva la cuenta de llamadas (última consulta y acumulado). Puede usarse desde
+    varios hilos: cada consulta cuenta sus propias llamadas (`FetchResult.round_trips`)
+    y `last_round_trips` es la de la última consulta del hilo que pregunta.
+    """
+
+    def __init__(self, execute):
+        self._execute = execute
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.total_round_trips = 0
+        self.fetches = 0
+
+    @property
+    def last_round_trips(self):
+        return getattr(self._local, 'round_trips', 0)
+
+    @last_round_trips.setter
+    def last_round_trips(self, value):
+        self._local.round_trips = value
+
+    def call(self, model, method, args, kwargs=None):
+        with self._lock:
+            self.total_round_trips += 1
+        return self._execute(model, method, args, kwargs or {})
+
+    def fetch_lines_with_orders(self, domain, line_fields, order_fields, limit=None, order=None,
+                                select_orders=None, line_filter=None):
+        """
+        Lee las líneas que cumplen `domain` con un `search_read` y los pedidos
+        correspondientes con un único `read`.
+
+        `line_filter(line)` descarta líneas del lado cliente antes de agrupar y
+        `select_orders(order_ids)` permite quedarse con un subconjunto de pedidos
+        (p. ej. los primeros N) antes de leerlos. Si los campos de pedido pedidos
+        ya vienen en `order_id` (id, nombre), no se hace la segunda llamada.
+        """
+        with self._lock:
+            self.fetches += 1
+        round_trips = 0
+
+        fields = list(line_fields)
+        if 'order_id' not in fields:
+            fields.append('order_id')
+        kwargs = {'fields': fields}
+        if limit:
+            kwargs['limit'] = limit
+        if order:
+            kwargs['order'] = order
+        lines = self.call('pos.order.line', 'search_read', [domain], kwargs)
+        round_trips += 1
+        scanned = len(lines)
+        if line_filter is not None:
+            lines = [line for line in lines if line_filter(line)]
+        if not lines:
+            return self._result([], {}, {}, round_trips, scanned)
+
+        lines_by_order = {}
+        for line in lines:
+            oid = line['order_id'][0]
+            lines_by_order.setdefault(oid, []).append(line)
+
+        order_ids = list(lines_by_order)
+        if select_orders is not None:
+            order_ids = list(select_orders(order_ids))
+
+        if set(order_fields) <= _ORDER_FIELDS_FROM_LINE:
+            orders_by_id = {}
+            for oid in order_ids:
+                pair = lines_by_order[oid][0]['order_id']
+                orders_by_id[oid] = {'id': oid, 'name': pair[1] if len(pair) > 1 else ''}
+        elif order_ids:
+            orders = self.call('pos.order', 'read', [order_ids], {'fields': list(order_fields)})
+            round_trips += 1
+            orders_by_id = {o['id']: o for o in orders}
+        else:
+            orders_by_id = {}
+
+        return self._result(lines, lines_by_order, orders_by_id, round_trips, scanned)
+
+    def iter_order_pages(self, domain, line_fields, order_fields, page_orders=100, line_filter=None):
+        """
+        Generador: recorre los pedidos con líneas que cumplen `domain` del más viejo
+        al más nuevo (id de pedido ascendente), de a `page_orders` pedidos, y entrega
+        un FetchResult por página con los pedidos completos (todas sus líneas).
+
+        Cada página cuesta un `search_read` de pedidos (desde el último id visto, sin
+        offset: nada se lee dos veces aunque entren pedidos nuevos) y otro de sus
+        líneas. Sólo la página actual queda en memoria. `last_round_trips` acumula
+        las llamadas de todo el recorrido.
+        """
+        with self._lock:
+            self.fetches += 1
+        order_domain = order_domain_from_lines(domain)
+        fields = list(line_fields)
+        if 'order_id' not in fields:
+            fields.append('order_id')
+        last_id, round_trips = 0, 0
+        while True:
+            orders = self.call('pos.order', 'search_read', [order_domain + [('id', '>', last_id)]],
+                               {'fields': list(order_fields), 'limit': page_orders, 'order': 'id asc'})
+            round_trips += 1
+            more = len(orders) >= page_orders
+            if not orders:
+                self.last_round_trips = round_trips
+                return
+            last_id = orders[-1]['id']
+            lines = self.call('pos.order.line', 'search_read',
+                              [list(domain) + [('order_id', 'in', [o['id'] for o in orders])]],
+                              {'fields': fields, 'order': 'id asc'})
+            round_trips += 1
+            scanned = len(lines)
+            if line_filter is not None:
+                lines = [line for line in lines if line_filter(line)]
+            lines_by_order = {}
+            for line in lines:
+                lines_by_order.setdefault(line['order_id'][0], []).append(line)
+            orders_by_id = {o['id']: o for o in orders if o['id'] in lines_by_order}
+            self.last_round_trips = round_trips
+            yield FetchResult(lines, lines_by_order, orders_by_id, round_trips, scanned, more=more)
+            if not more:
+                return
+
+    def _result(self, lines, lines_by_order, orders_by_id, round_trips, scanned):
+        self.last_round_trips = round_trips
+        return FetchResult(lines, lines_by_order, orders_by_id, round_trips, scanned)
+
+
+class CategoryResolver:
+    """
+    Índice local del árbol de categorías TPV y de la categoría de cada producto.
+
+    `refresh()` carga la primera vez todas las categorías y los productos con
+    categoría TPV (dos llamadas) y después, cada `refresh_interval` segundos, sólo
+    lo modificado desde el último `write_date` visto. `pos_categ_id` se guarda en
+    product.template: cambiar la categoría en la ficha sólo toca el `write_date` de
+    la plantilla, así que las actualizaciones también leen las plantillas modificadas
+    (una llamada más) y pasan la categoría a sus variantes. Con el índice cargado, el
+    filtro por categoría se arma localmente (`products_in`) en lugar de pedirle a
+    Odoo un `child_of` en cada consulta. `prefetch` sigue leyendo a demanda lo que
+    el índice no tiene (productos nuevos o sin categoría), una sola vez por proceso.
+    """
+
+    def __init__(self, execute, refresh_interval=CATEGORY_REFRESH_INTERVAL):
+        self._execute = execute
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._product_categ = {}
+        self._parent = {}
+        self._categ_stamp = None     # mayor write_date leído de pos.category
+        self._product_stamp = None   # ídem de product.product
+        self._template_stamp = None  # ídem de product.template
+        self.max_product_id = 0      # productos con id mayor son posteriores a la última actualización
+        self.loaded_at = None
+        self.refreshes = 0
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def refresh(self, force=False):
+        """
+        Carga o actualiza el índice si pasó `refresh_interval` (o con `force`).
+        Devuelve True si consultó a Odoo.
+        """
+        with self._lock:
+            if (not force and self.loaded_at is not None
+                    and time.monotonic() - self.loaded_at < self.refresh_interval):
+                return False
+            categ_stamp, product_stamp, template_stamp = self._categ_stamp, self._product_stamp, self._template_stamp
+        # `>=`: otro registro puede compartir el segundo de la marca; releerlo no cambia nada.
+        categ_domain = [('write_date', '>=', categ_stamp)] if categ_stamp else []
+        categs = self._execute('pos.category', 'search_read', [categ_domain],
+                               {'fields': ['parent_id', 'write_date']})
+        # La primera carga trae sólo productos con categoría; las siguientes, todo lo modificado
+        # (también los que se quedaron sin categoría). Incluye archivados: pueden tener ventas del día.
+        product_domain = [('write_date', '>=', product_stamp)] if product_stamp else [('pos_categ_id', '!=', False)]
+        products = self._execute('product.product', 'search_read', [product_domain],
+                                 {'fields': ['pos_categ_id', 'write_date'], 'context': {'active_test': False}})
+        templates = []
+        if template_stamp:
+            templates = self._execute('product.template', 'search_read', [[('write_date', '>=', template_stamp)]],
+                                      {'fields': ['pos_categ_id', 'product_variant_ids', 'write_date'],
+                                       'context': {'active_test': False}})
+        with self._lock:
+            for row in categs:
+                parent = row.get('parent_id')
+                self._parent[row['id']] = parent[0] if parent else None
+                if row.get('write_date') and (self._categ_stamp is None or row['write_date'] > self._categ_stamp):
+                    self._categ_stamp = row['write_date']
+            for row in products:
+                categ = row.get('pos_categ_id')
+                self._product_categ[row['id']] = categ[0] if categ else None
+                self.max_product_id = max(self.max_product_id, row['id'])
+                if row.get('write_date') and (self._product_stamp is None or row['write_date'] > self._product_stamp):
+                    self._product_stamp = row['write_date']
+            for row in templates:
+                categ = row.get('pos_categ_id')
+                for pid in row.get('product_variant_ids') or ():
+                    self._product_categ[pid] = categ[0] if categ else None
+                if row.get('write_date') and row['write_date'] > self._template_stamp:
+                    self._template_stamp = row['write_date']
+            if self._categ_stamp is None:
+                self._categ_stamp = '1970-01-01 00:00:00'
+            if self._product_stamp is None:
+                self._product_stamp = '1970-01-01 00:00:00'
+            if self._template_stamp is None:
+                # Primera carga: lo que ya leímos refleja toda plantilla modificada antes.
+                self._template_stamp = self._product_stamp
+            self.loaded_at = time.monotonic()
+            self.refreshes += 1
+        return True
+
+    def prefetch(self, product_ids):
+        """Lee las categorías de los productos que todavía no están en caché (y sus padres)."""
+        with self._lock:
+            missing = [pid for pid in set(product_ids) if pid not in self._product_categ]
+        if missing:
+            rows = self._execute('product.product', 'read', [missing], {'fields': ['pos_categ_id']})
+            with self._lock:
+                for row in rows:
+                    categ = row.get('pos_categ_id')
+                    self._product_categ[row['id']] = categ[0] if categ else None
+                for pid in missing:
+                    self._product_categ.setdefault(pid, None)
+        # Subimos por el árbol hasta tener todos los padres.
+        while True:
+            with self._lock:
+                pending = {c for c in self._product_categ.values() if c and c not in self._parent}
+                pending |= {p for p in self._parent.values() if p and p not in self._parent}
+            if not pending:
+                return
+            rows = self._execute('pos.category', 'read', [list(pending)], {'fields': ['parent_id']})
+            with self._lock:
+                for row in rows:
+                    parent = row.get('parent_id')
+                    self._parent[row['id']] = parent[0] if parent else None
+                for cid in pending:
+                    self._parent.setdefault(cid, None)
+
+    def category_of(self, product_id):
+        with self._lock:
+            return self._product_categ.get(product_id)
+
+    def ancestors(self, categ_id):
+        """La categoría y todos sus padres, de la más específica a la raíz."""
+        out = []
+        with self._lock:
+            while categ_id and categ_id not in out:
+                out.append(categ_id)
+                categ_id = self._parent.get(categ_id)
+        return out
+
+    def descendants(self, categ_id):
+        """La categoría y todas sus hijas (lo mismo que `child_of` en Odoo)."""
+        with self._lock:
+            children = {}
+            for cid, parent in self._parent.items():
+                if parent:
+                    children.setdefault(parent, []).append(cid)
+        out, stack = set(), [categ_id]
+        while stack:
+            cid = stack.pop()
+            if cid not in out:
+                out.add(cid)
+                stack.extend(children.get(cid, ()))
+        return out
+
+    def products_in(self, categ_id):
+        """Ids de los productos conocidos de `categ_id` o sus hijas, ordenados."""
+        categs = self.descendants(categ_id)
+        with self._lock:
+            return sorted(pid for pid, cid in self._product_categ.items() if cid in categs)
+
+    def line_domain(self, categ_id, max_ids=CATEGORY_MAX_IDS):
+        """
+        Condición de categoría para un dominio de pos.order.line y filtro local que la
+        completa: `(domain, line_filter)`. Con el índice cargado es `product_id in
+        [...]` más los productos creados después de la última actualización (id mayor),
+        que se verifican localmente con `line_filter`. Sin índice o con demasiados
+        productos, el `child_of` de siempre (y `line_filter` None).
+        """
+        if not self.loaded:
+            return [('product_id.pos_categ_id', 'child_of', categ_id)], None
+        product_ids = self.products_in(categ_id)
+        if len(product_ids) > max_ids:
+            return [('product_id.pos_categ_id', 'child_of', categ_id)], None
+        max_id = self.max_product_id
+
+        def line_filter(line):
+            product = line.get('product_id')
+            if not product or product[0] <= max_id:
+                return True  # ya filtrado por Odoo
+            self.prefetch([product[0]])
+            return categ_id in self.ancestors(self.category_of(product[0]))
+
+        return ['|', ('product_id', 'in', product_ids), ('product_id', '>', max_id)], line_filter
+
+
+class Router:
+    """
+    Reparte las líneas de un pedido entre impresoras según la categoría TPV del
+    producto (incluye subcategorías). `routes` es una lista de dicts
+    {"pos_categ": id, "printer": "destino", "name": "Parrilla"}; la primera que
+    coincide gana. Las líneas sin ruta van a `None` (impresora por defecto).
+    """
+
+    def __init__(self, routes, resolver):
+        self.routes = [r for r in routes if r.get('pos_categ') and r.get('printer')]
+        self.resolver = resolver
+
+    def __bool__(self):
+        return bool(self.routes)
+
+    def printers(self):
+        return [r['printer'] for r in self.routes]
+
+    def split(self, lines):
+        """Devuelve {printer: [líneas]} conservando el orden de las líneas."""
+        self.resolver.prefetch(line['product_id'][0] for line in lines if line.get('product_id'))
+        out = {}
+        for line in lines:
+            product = line.get('product_id')
+            chain = self.resolver.ancestors(self.resolver.category_of(product[0])) if product else []
+            target = None
+            for route in self.routes:
+                if route['pos_categ'] in chain:
+                    target = route['printer']
+                    break
+            out.setdefault(target, []).append(line)
+        return out
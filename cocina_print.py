@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_print.py
+Salidas de impresión para las comandas (bytes ESC/POS ya armados).
+
+Backends:
+  - Win32Backend:  impresora de Windows vía win32print (spooler, RAW).
+  - SocketBackend: impresora Ethernet por TCP crudo (puerto 9100), con el socket
+                   abierto entre trabajos.
+  - FileBackend:   archivo o pipe (pruebas, depuración, `-` = stdout).
+  - NullBackend:   descarta los bytes y sólo cuenta (benchmarks).
+
+El destino se elige con una sola cadena (la misma de `--printer`):
+  "EPSON TM-T20III Receipt"     -> Win32Backend
+  "tcp://192.168.1.50:9100"     -> SocketBackend (puerto 9100 si se omite)
+  "file:C:/tmp/comandas.bin"    -> FileBackend
+  "null:"                       -> NullBackend
+
+Uso:
+  backend = get_backend("tcp://192.168.1.50")
+  backend.write(data, doc_name="Comanda Cocina")
+  write_batch(backend, [ticket1, ticket2])   # varios tickets (cada uno con su corte) en un documento
+"""
+
+import select
+import socket
+import sys
+import threading
+
+RAW_PORT = 9100
+
+
+class PartialWriteError(OSError):
+    """La escritura se cortó después de entregar `written` bytes a la impresora/spooler."""
+
+    def __init__(self, written, cause):
+        super().__init__(f"escritura interrumpida tras {written} bytes: {cause}")
+        self.written = written
+        self.cause = cause
+
+
+class BatchWriteError(Exception):
+    """Falló un lote: `delivered` es la cantidad de tickets (del principio) que llegaron enteros."""
+
+    def __init__(self, delivered, total, cause):
+        super().__init__(f"lote de {total} tickets interrumpido ({delivered} entregados): {cause}")
+        self.delivered = delivered
+        self.total = total
+        self.cause = cause
+
+
+class PrinterBackend:
+    """Interfaz común: `write(data, doc_name)` envía un documento completo."""
+
+    name = ""
+
+    def write(self, data: bytes, doc_name="Comanda Cocina"):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name}>"
+
+
+# =========================
+# Windows (win32print)
+# =========================
+def _open_printer(printer_name: str):
+    import win32print
+    return win32print.OpenPrinter(printer_name)
+
+
+def _start_doc(handle, doc_name="Comanda Cocina", datatype="RAW"):
+    """
+    Compatibilidad: algunas versiones exigen tupla; otras aceptan dict.
+    Forzamos tupla y, si falla, probamos dict.
+    """
+    import win32print
+    try:
+        # ✅ Tupla (docname, outputfile, datatype)
+        return win32print.StartDocPrinter(handle, 1, (doc_name, None, datatype))
+    except TypeError:
+        # Fallback por si tu build acepta dict
+        doc_info = {"pDocName": doc_name, "pOutputFile": None, "pDatatype": datatype}
+        return win32print.StartDocPrinter(handle, 1, doc_info)
+
+
+def print_raw(printer_name: str, data: bytes, doc_name="Comanda Cocina"):
+    import win32print
+    h = _open_printer(printer_name)
+    try:
+        _start_doc(h, doc_name, "RAW")
+        # Aunque la escritura falle, el documento se cierra: si no, queda a medio
+        # abrir en la cola del spooler y traba los trabajos siguientes.
+        try:
+            win32print.StartPagePrinter(h)
+            try:
+                written = win32print.WritePrinter(h, data)
+                if isinstance(written, int) and written < len(data):
+                    raise PartialWriteError(written, "WritePrinter no aceptó todo el documento")
+            finally:
+                win32print.EndPagePrinter(h)
+        finally:
+            win32print.EndDocPrinter(h)
+    finally:
+        win32print.ClosePrinter(h)
+
+
+def get_default_printer():
+    try:
+        import win32print
+        return win32print.GetDefaultPrinter()
+    except Exception:
+        return None
+
+
+def list_available_printers():
+    try:
+        import win32print
+    except ImportError:
+        return []
+
+    flags = win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
+    try:
+        printers = win32print.EnumPrinters(flags)
+    except Exception:
+        printers = []
+
+    names = []
+    for entry in printers:
+        if len(entry) >= 3:
+            name = entry[2]
+            if name and name not in names:
+                names.append(name)
+
+    default = get_default_printer()
+    if default:
+        names = [default] + [n for n in names if n != default]
+    return names
+
+
+class Win32Backend(PrinterBackend):
+    """Impresora del spooler de Windows (un documento RAW por `write`)."""
+
+    def __init__(self, printer_name):
+        self.name = printer_name
+
+    def write(self, data: bytes, doc_name="Comanda Cocina"):
+        print_raw(self.name, data, doc_name=doc_name)
+
+
+# =========================
+# TCP crudo (9100)
+# =========================
+class SocketBackend(PrinterBackend):
+    """
+    Impresora de red por TCP crudo. El socket queda abierto entre trabajos; si la
+    impresora cerró la conexión (reinicio, timeout propio) se reconecta una vez.
+    """
+
+    def __init__(self, host, port=RAW_PORT, timeout=10.0):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.name = f"tcp://{host}:{self.port}"
+        self._sock = None
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.jobs = 0
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.connects += 1
+        return sock
+
+    def _peer_closed(self, sock):
+        # Si el socket está "legible" sin que pidamos nada, o la impresora mandó
+        # estado (se descarta) o cerró la conexión (recv devuelve b"").
+        try:
+            while select.select([sock], [], [], 0)[0]:
+                if not sock.recv(1024):
+                    return True
+        except OSError:
+            return True
+        return False
+
+    def _close_socket(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def write(self, data: bytes, doc_name="Comanda Cocina"):
+        with self._lock:
+            if self._sock is not None and self._peer_closed(self._sock):
+                self._close_socket()
+            fresh = self._sock is None
+            if fresh:
+                self._sock = self._connect()
+            try:
+                self._send(data)
+            except PartialWriteError:
+                self._close_socket()
+                raise
+            except OSError:
+                self._close_socket()
+                if fresh:
+                    raise
+                # La conexión reutilizada estaba muerta: un reintento con una nueva.
+                self._sock = self._connect()
+                try:
+                    self._send(data)
+                except OSError:
+                    self._close_socket()
+                    raise
+            self.jobs += 1
+
+    def _send(self, data):
+        """Como sendall, pero si se corta a mitad informa cuántos bytes salieron."""
+        view = memoryview(data)
+        sent = 0
+        while sent < len(view):
+            try:
+                sent += self._sock.send(view[sent:])
+            except OSError as exc:
+                if sent:
+                    raise PartialWriteError(sent, exc) from exc
+                raise
+
+    def close(self):
+        with self._lock:
+            self._close_socket()
+
+
+# =========================
+# Archivo / pipe
+# =========================
+class FileBackend(PrinterBackend):
+    """Agrega los bytes a un archivo o pipe (o a stdout con `-`)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = f"file:{path}"
+        self._fh = None
+        self._lock = threading.Lock()
+        self.jobs = 0
+
+    def write(self, data: bytes, doc_name="Comanda Cocina"):
+        with self._lock:
+            if self._fh is None:
+                self._fh = sys.stdout.buffer if self.path == "-" else open(self.path, "ab")
+            written = self._fh.write(data)
+            self._fh.flush()
+            if written is not None and written < len(data):
+                raise PartialWriteError(written, "escritura incompleta")
+            self.jobs += 1
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None and self.path != "-":
+                self._fh.close()
+            self._fh = None
+
+
+class NullBackend(PrinterBackend):
+    """Impresora que no imprime: cuenta trabajos y bytes (para medir sin papel)."""
+
+    def __init__(self, name="null:"):
+        self.name = name
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.bytes = 0
+
+    def write(self, data: bytes, doc_name="Comanda Cocina"):
+        with self._lock:
+            self.jobs += 1
+            self.bytes += len(data)
+
+
+# =========================
+# Lotes
+# =========================
+def write_batch(backend, tickets, doc_name="Comandas Cocina"):
+    """
+    Envía varios tickets ESC/POS (cada uno con su propio corte) en un único documento
+    o escritura de socket. Si la escritura se corta, levanta BatchWriteError con la
+    cantidad de tickets que llegaron completos según los bytes entregados.
+    """
+    if not tickets:
+        return 0
+    if len(tickets) == 1:
+        data = tickets[0]
+    else:
+        data = b"".join(tickets)
+    try:
+        backend.write(data, doc_name=doc_name)
+    except PartialWriteError as exc:
+        delivered, end = 0, 0
+        for ticket in tickets:
+            end += len(ticket)
+            if end > exc.written:
+                break
+            delivered += 1
+        raise BatchWriteError(delivered, len(tickets), exc.cause) from exc
+    except Exception as exc:
+        raise BatchWriteError(0, len(tickets), exc) from exc
+    return len(tickets)
+
+
+# =========================
+# Selección por nombre
+# =========================
+def create_backend(spec):
+    spec = (spec or "").strip()
+    if not spec:
+        raise ValueError("No se indicó impresora.")
+    if spec.startswith("tcp://"):
+        hostport = spec[len("tcp://"):].rstrip("/")
+        host, _, port = hostport.rpartition(":") if ":" in hostport else (hostport, "", "")
+        return SocketBackend(host, int(port) if port else RAW_PORT)
+    if spec.startswith("file:"):
+        return FileBackend(spec[len("file:"):])
+    if spec.startswith("null:"):
+        return NullBackend(spec)
+    return Win32Backend(spec)
+
+
+_BACKENDS = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def get_backend(spec):
+    """Devuelve (y reutiliza) el backend para `spec`, así el socket TCP sigue abierto entre trabajos."""
+    with _BACKENDS_LOCK:
+        backend = _BACKENDS.get(spec)
+        if backend is None:
+            backend = _BACKENDS[spec] = create_backend(spec)
+        return backend
+
+
+def close_backends():
+    with _BACKENDS_LOCK:
+        backends = list(_BACKENDS.values())
+        _BACKENDS.clear()
+    for backend in backends:
+        backend.close()
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_rpc.py
+Transporte RPC hacia Odoo para los scripts de cocina.
+
+`xmlrpc.client.ServerProxy` no se puede compartir entre hilos, pero cada instancia
+mantiene su propia conexión HTTP/1.1 persistente (keep-alive). El pool entrega un
+proxy por hilo mientras dura la llamada y lo recupera después, así la GUI puede
+refrescar e imprimir en paralelo sin pisar conexiones ni repetir el handshake TLS.
+
+Como alternativa, `JsonRpcPool` habla con el endpoint `/jsonrpc` de Odoo: JSON se
+parsea en C (más rápido que el XML de `xmlrpc.client`) y acepta respuestas gzip
+si hay un proxy inverso que comprima.
+
+Ninguna llamada espera para siempre: las conexiones de ambos pools tienen
+`timeout` y `RpcGuard` pone a cada llamada un plazo total. Dentro de ese plazo,
+las lecturas que fallan por red se reintentan con espera aleatoria. Un disyuntor
+(circuit breaker) corta en seco mientras Odoo no responde y prueba de a una
+llamada hasta que vuelve.
+
+Uso:
+  pool = make_pool("xmlrpc", url, size=4, timeout=30)      # o "jsonrpc"
+  pool.execute_kw(db, uid, pwd, 'pos.order', 'read', [[1]], {'fields': ['name']})
+  pool.stats()  # {'created': 1, 'reused': 0, ...}
+
+  guard = RpcGuard(timeout=30, deadline=60)
+  guard.subscribe(lambda ev: print(ev['type']))          # 'retry' / 'breaker'
+  guard.call(lambda timeout: pool.execute_kw(..., timeout=timeout), 'pos.order.read', idempotent=True)
+"""
+
+import gzip
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+import xmlrpc.client
+from contextlib import contextmanager
+
+TRANSPORTS = ('xmlrpc', 'jsonrpc')
+
+RPC_TIMEOUT = 30          # segundos por intento (conexión, envío y cada lectura del socket)
+RPC_DEADLINE = 60         # segundos por llamada, reintentos incluidos
+RPC_RETRIES = 2           # reintentos de una lectura que falló por red
+RPC_BACKOFF = 0.5         # base de la espera entre reintentos (se duplica, con jitter)
+RPC_MAX_BACKOFF = 5.0
+BREAKER_THRESHOLD = 5     # fallas de red seguidas que abren el disyuntor
+BREAKER_COOLDOWN = 15.0   # segundos abierto antes de la primera prueba
+BREAKER_MAX_COOLDOWN = 120.0
+
+# Métodos de sólo lectura: repetirlos no cambia nada en Odoo.
+IDEMPOTENT_METHODS = frozenset({'search', 'read', 'search_read', 'search_count', 'fields_get', 'name_get',
+                                'read_group', 'authenticate', 'version'})
+
+# Errores tras los cuales la conexión del proxy puede haber quedado a medias.
+_CONNECTION_ERRORS = (xmlrpc.client.ProtocolError, http.client.HTTPException, OSError)
+
+
+class JsonRpcFault(xmlrpc.client.Fault):
+    """Error devuelto por Odoo vía JSON-RPC (se comporta como un Fault de XML-RPC)."""
+
+
+class RpcTimeout(TimeoutError):
+    """Se agotó el plazo de la llamada (incluida la espera de una conexión libre del pool)."""
+
+
+class CircuitOpenError(ConnectionError):
+    """Disyuntor abierto: Odoo viene fallando y la llamada ni se intenta."""
+
+
+def transient_error(exc):
+    """Falla de red o del servidor (sin respuesta de Odoo): cuenta para el disyuntor y se puede reintentar."""
+    if isinstance(exc, xmlrpc.client.Fault):
+        return False
+    if isinstance(exc, xmlrpc.client.ProtocolError):
+        return exc.errcode >= 500
+    return isinstance(exc, (http.client.HTTPException, OSError))
+
+
+class _ConnectionPool:
+    """
+    Pool acotado de conexiones reutilizables. Cada subclase define cómo crear,
+    cerrar y usar una conexión (`_new_connection`, `_close_connection`, `_call`).
+    """
+
+    def __init__(self, url, size=4):
+        self.url = url
+        self.size = max(1, int(size))
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.waits = 0
+
+    def _new_connection(self):
+        raise NotImplementedError
+
+    def _close_connection(self, conn):
+        raise NotImplementedError
+
+    def _call(self, conn, rpc_args):
+        raise NotImplementedError
+
+    def checkout(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.size:
+                self.waits += 1
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise RpcTimeout(f"sin conexión libre hacia Odoo en {timeout:.0f} s")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.created += 1
+        try:
+            return self._new_connection()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, conn, discard=False):
+        if discard:
+            try:
+                self._close_connection(conn)
+            except Exception:
+                pass
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self.discarded += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.checkout(timeout)
+        discard = False
+        try:
+            yield conn
+        except _CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            self.checkin(conn, discard=discard)
+
+    def execute_kw(self, *rpc_args, timeout=None):
+        """`timeout`: plazo de este intento (espera del pool y socket); None = el del pool."""
+        started = time.monotonic()
+        with self.connection(timeout) as conn:
+            if timeout is not None:
+                timeout = max(0.1, timeout - (time.monotonic() - started))
+            return self._call(conn, rpc_args, timeout)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                self._close_connection(conn)
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'waits': self.waits,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+            }
+
+    def stats_line(self):
+        st = self.stats()
+        return (f"Conexiones Odoo: {st['created']} creadas, {st['reused']} reutilizadas, "
+                f"{st['discarded']} descartadas, {st['waits']} esperas")
+
+
+class _TimeoutMixin:
+    """Timeout de socket para los Transport de xmlrpc.client (los originales esperan para siempre)."""
+
+    def __init__(self, timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(self.timeout)
+        return conn
+
+
+class _TimeoutTransport(_TimeoutMixin, xmlrpc.client.Transport):
+    pass
+
+
+class _SafeTimeoutTransport(_TimeoutMixin, xmlrpc.client.SafeTransport):
+    pass
+
+
+def server_proxy(url, timeout=RPC_TIMEOUT, allow_none=True):
+    """ServerProxy con timeout de socket (http o https según la URL)."""
+    cls = _SafeTimeoutTransport if url.startswith('https') else _TimeoutTransport
+    return xmlrpc.client.ServerProxy(url, transport=cls(timeout=timeout), allow_none=allow_none)
+
+
+class ServerProxyPool(_ConnectionPool):
+    """Pool de ServerProxy (`/xmlrpc/2/object`) con una conexión keep-alive por proxy."""
+
+    def __init__(self, url, size=4, allow_none=True, timeout=RPC_TIMEOUT):
+        super().__init__(url, size=size)
+        self.allow_none = allow_none
+        self.timeout = timeout
+
+    def _new_connection(self):
+        proxy = server_proxy(self.url, timeout=self.timeout, allow_none=self.allow_none)
+        return proxy, proxy("transport")
+
+    def _close_connection(self, conn):
+        proxy, _ = conn
+        proxy("close")()
+
+    def _call(self, conn, rpc_args, timeout=None):
+        proxy, transport = conn
+        transport.timeout = self.timeout if timeout is None else timeout
+        return proxy.execute_kw(*rpc_args)
+
+
+class JsonRpcPool(_ConnectionPool):
+    """
+    Pool de conexiones HTTP/1.1 persistentes hacia `/jsonrpc` de Odoo.
+    Pide respuestas gzip y cuenta los bytes recibidos (comprimidos y sin comprimir).
+    """
+
+    def __init__(self, url, size=4, timeout=RPC_TIMEOUT):
+        super().__init__(url, size=size)
+        parsed = urllib.parse.urlsplit(url)
+        self._https = parsed.scheme == 'https'
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._path = parsed.path or '/jsonrpc'
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self.bytes_wire = 0
+        self.bytes_decoded = 0
+
+    def _new_connection(self):
+        cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+        return cls(self._host, self._port, timeout=self.timeout)
+
+    def _close_connection(self, conn):
+        conn.close()
+
+    def _call(self, conn, rpc_args, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        payload = json.dumps({
+            'jsonrpc': '2.0',
+            'method': 'call',
+            'params': {'service': 'object', 'method': 'execute_kw', 'args': list(rpc_args)},
+            'id': next(self._ids),
+        }).encode('utf-8')
+        conn.request('POST', self._path, body=payload, headers={
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip',
+        })
+        resp = conn.getresponse()
+        raw = resp.read()
+        if resp.status != 200:
+            raise xmlrpc.client.ProtocolError(self.url, resp.status, resp.reason, dict(resp.getheaders()))
+        body = gzip.decompress(raw) if resp.getheader('Content-Encoding') == 'gzip' else raw
+        with self._cond:
+            self.bytes_wire += len(raw)
+            self.bytes_decoded += len(body)
+        data = json.loads(body)
+        error = data.get('error')
+        if error:
+            detail = error.get('data') or {}
+            raise JsonRpcFault(error.get('code', 0), detail.get('message') or error.get('message') or str(error))
+        return data.get('result')
+
+    def stats(self):
+        st = super().stats()
+        with self._cond:
+            st['bytes_wire'] = self.bytes_wire
+            st['bytes_decoded'] = self.bytes_decoded
+        return st
+
+
+def make_pool(transport, base_url, size=4, timeout=RPC_TIMEOUT):
+    """Crea el pool para `execute_kw` según el transporte elegido ('xmlrpc' o 'jsonrpc')."""
+    base_url = base_url.rstrip('/')
+    if transport == 'jsonrpc':
+        return JsonRpcPool(f"{base_url}/jsonrpc", size=size, timeout=timeout)
+    if transport == 'xmlrpc':
+        return ServerProxyPool(f"{base_url}/xmlrpc/2/object", size=size, timeout=timeout)
+    raise ValueError(f"Transporte desconocido: {transport!r} (opciones: {', '.join(TRANSPORTS)})")
+
+
+class RpcGuard:
+    """
+    Plazos, reintentos y disyuntor para las llamadas a Odoo.
+
+    `call(fn, label, idempotent)` ejecuta `fn(timeout)`, donde `timeout` es lo que
+    le queda al intento (nunca más que `timeout` ni que el plazo total `deadline`).
+    Si falla por red y la llamada es idempotente, se reintenta hasta `retries`
+    veces con espera aleatoria entre 0 y `backoff * 2**intento` (full jitter),
+    siempre que quepa en el plazo. Las escrituras no se reintentan.
+
+    Disyuntor: tras `threshold` fallas de red seguidas se abre y las llamadas fallan
+    enseguida con CircuitOpenError. Pasado `cooldown` deja pasar una sola llamada de
+    prueba (semiabierto): si anda se cierra, si no vuelve a abrirse con el doble de
+    espera (hasta `max_cooldown`). Un Fault de Odoo (error de negocio, acceso) no
+    cuenta como falla: el servidor respondió.
+
+    Los suscriptores reciben cada evento como dict:
+      {'type': 'retry', 'call': 'pos.order.search_read', 'attempt': 1, 'delay': 0.4, 'error': exc}
+      {'type': 'breaker', 'state': 'open'|'half_open'|'closed', 'error': exc_o_None, 'cooldown': 15.0}
+    """
+
+    def __init__(self, timeout=RPC_TIMEOUT, deadline=RPC_DEADLINE, retries=RPC_RETRIES, backoff=RPC_BACKOFF,
+                 max_backoff=RPC_MAX_BACKOFF, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.threshold = max(1, int(threshold))
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.state = 'closed'
+        self.cooldown = cooldown
+        self.opened_at = None
+        self.consecutive_failures = 0
+        self._probing = False
+        self.calls = 0
+        self.retried = 0
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def subscribe(self, fn):
+        with self._lock:
+            self._listeners.append(fn)
+
+    def unsubscribe(self, fn):
+        with self._lock:
+            if fn in self._listeners:
+                self._listeners.remove(fn)
+
+    def _emit(self, event):
+        with self._lock:
+            listeners = list(self._listeners)
+        for fn in listeners:
+            try:
+                fn(event)
+            except Exception:
+                pass
+
+    # ----- Disyuntor -----
+    def _admit(self):
+        """Deja pasar la llamada o levanta CircuitOpenError. Devuelve True si es la prueba."""
+        with self._lock:
+            self.calls += 1
+            if self.state == 'closed':
+                return False
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state, self._probing = 'half_open', True
+                event = {'type': 'breaker', 'state': 'half_open', 'error': None, 'cooldown': self.cooldown}
+            elif self.state == 'half_open' and not self._probing:
+                self._probing = True
+                event = None
+            else:
+                self.rejected += 1
+                wait = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+                raise CircuitOpenError(f"Odoo no responde: llamadas suspendidas (se reintenta en {wait:.0f} s)")
+        if event:
+            self._emit(event)
+        return True
+
+    def _succeeded(self, probe):
+        with self._lock:
+            self.consecutive_failures = 0
+            if probe:
+                self._probing = False
+            if self.state == 'closed':
+                return
+            self.state, self.cooldown, self.opened_at = 'closed', self.base_cooldown, None
+        self._emit({'type': 'breaker', 'state': 'closed', 'error': None, 'cooldown': self.base_cooldown})
+
+    def _failed(self, exc, probe):
+        """Anota una falla de red; True si el disyuntor quedó abierto."""
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if probe:
+                self._probing = False
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            elif self.state != 'closed' or self.consecutive_failures < self.threshold:
+                return self.state == 'open'
+            self.state, self.opened_at = 'open', time.monotonic()
+            self.trips += 1
+            cooldown = self.cooldown
+        self._emit({'type': 'breaker', 'state': 'open', 'error': exc, 'cooldown': cooldown})
+        return True
+
+    def _release(self, probe):
+        """La prueba terminó con un error que no es de red: Odoo respondió."""
+        if probe:
+            self._succeeded(probe)
+
+    # ----- Llamadas -----
+    def call(self, fn, label='', idempotent=False):
+        probe = self._admit()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RpcTimeout(f"{label}: sin respuesta de Odoo en {self.deadline:.0f} s")
+            try:
+                result = fn(min(self.timeout, remaining))
+            except Exception as exc:
+                if not transient_error(exc):
+                    self._release(probe)
+                    raise
+                is_open = self._failed(exc, probe)
+                # La prueba no se reintenta: si falló, el disyuntor ya volvió a abrirse.
+                if probe or is_open or not idempotent or attempt >= self.retries:
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.retried += 1
+                self._emit({'type': 'retry', 'call': label, 'attempt': attempt, 'delay': delay, 'error': exc})
+                time.sleep(delay)
+                continue
+            self._succeeded(probe)
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'calls': self.calls, 'retried': self.retried, 'failures': self.failures,
+                    'rejected': self.rejected, 'trips': self.trips}
+
+    def stats_line(self):
+        st = self.stats()
+        states = {'closed': "normal", 'open': "abierto (Odoo no responde)", 'half_open': "probando"}
+        return (f"Disyuntor Odoo: {states[st['state']]}, {st['retried']} reintentos, "
+                f"{st['failures']} fallas de red, {st['rejected']} llamadas cortadas")
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_scheduler.py
+Intervalo adaptable entre ticks del modo automático.
+
+En vez de consultar a Odoo cada `auto_interval` segundos fijos:
+  - después de un tick con comandas, el intervalo baja al mínimo;
+  - cada tick vacío lo estira un poco (x `backoff`) hasta el máximo;
+  - si Odoo responde lento o con errores, se estira de más para no cargarlo;
+  - si las impresoras fallan y no llegó nada nuevo, se estira igual (hasta el máximo):
+    reintentar cada 2 s contra una impresora apagada sólo carga a Odoo;
+  - los mínimos/máximos dependen del horario (perfiles "almuerzo", "noche", ...).
+
+Configuración (clave "scheduler" de imprimir_cocina_config.json), todo opcional:
+  {
+    "min_interval": 2, "max_interval": 60, "backoff": 1.5, "slow_latency": 1.5,
+    "profiles": [
+      {"name": "Almuerzo", "days": [0, 1, 2, 3, 4, 5, 6], "start": "11:30", "end": "15:30",
+       "min_interval": 2, "max_interval": 10},
+      {"name": "Noche", "start": "19:30", "end": "00:30", "max_interval": 10}
+    ],
+    "off_hours": {"min_interval": 30, "max_interval": 300}
+  }
+`days` usa 0 = lunes; un rango que cruza medianoche vale hasta `end` del día siguiente.
+"off_hours" sólo se aplica si hay perfiles y ninguno coincide.
+
+Uso:
+  sched = AdaptiveScheduler.from_config(cfg, base_interval=5)
+  interval, reason = sched.record_tick(found_work=True, latency=0.3)
+  interval, reason = sched.record_tick(found_work=False, error=exc)
+  interval, reason = sched.record_tick(found_work=False, print_error=exc)
+"""
+
+import datetime as dt
+
+DEFAULT_MIN_INTERVAL = 2
+DEFAULT_MAX_INTERVAL = 60
+DEFAULT_BACKOFF = 1.5
+DEFAULT_SLOW_LATENCY = 1.5    # segundos de consulta a Odoo a partir de los cuales se lo considera lento
+ERROR_MAX_INTERVAL = 300
+LATENCY_SMOOTHING = 0.3       # peso de la última medición en el promedio móvil
+MAX_LATENCY_FACTOR = 4
+
+
+def _parse_hhmm(value):
+    hours, _, minutes = str(value).partition(':')
+    return int(hours) * 60 + int(minutes or 0)
+
+
+class ScheduleProfile:
+    """Franja horaria con sus propios límites de intervalo."""
+
+    def __init__(self, name, min_interval, max_interval, start=None, end=None, days=None):
+        self.name = name
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.start = _parse_hhmm(start) if start is not None else None
+        self.end = _parse_hhmm(end) if end is not None else None
+        self.days = set(days) if days is not None else None
+
+    def matches(self, now):
+        if self.start is None or self.end is None:
+            return True
+        minute = now.hour * 60 + now.minute
+        weekday = now.weekday()
+        if self.start <= self.end:
+            return self.start <= minute < self.end and (self.days is None or weekday in self.days)
+        # Cruza medianoche: la parte de después de las 00:00 pertenece al día anterior.
+        if minute >= self.start:
+            return self.days is None or weekday in self.days
+        if minute < self.end:
+            return self.days is None or (weekday - 1) % 7 in self.days
+        return False
+
+
+class AdaptiveScheduler:
+    """
+    Decide cuánto esperar hasta el próximo tick a partir del resultado del último
+    (si hubo comandas, cuánto tardó Odoo, si hubo error) y del horario.
+    `reason` explica en castellano por qué se eligió el intervalo actual.
+    """
+
+    def __init__(self, base_interval=5, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 backoff=DEFAULT_BACKOFF, slow_latency=DEFAULT_SLOW_LATENCY, profiles=None, off_hours=None,
+                 clock=dt.datetime.now):
+        self.default = ScheduleProfile("", min_interval, max_interval)
+        self.profiles = list(profiles or [])
+        self.off_hours = off_hours
+        self.backoff = max(1.0, float(backoff))
+        self.slow_latency = float(slow_latency)
+        self.clock = clock
+        self.interval = float(base_interval)
+        self.reason = "inicio"
+        self.empty_ticks = 0
+        self.errors = 0
+        self.print_errors = 0
+        self.latency = None
+        self.changed = False  # si el motivo cambió de tipo en el último tick (para no repetir logs)
+        self._last_kind = None
+
+    @classmethod
+    def from_config(cls, cfg, base_interval=5, **kwargs):
+        cfg = cfg if isinstance(cfg, dict) else {}
+        min_interval = cfg.get('min_interval', DEFAULT_MIN_INTERVAL)
+        max_interval = cfg.get('max_interval', DEFAULT_MAX_INTERVAL)
+        profiles = []
+        for idx, entry in enumerate(cfg.get('profiles') or []):
+            if not isinstance(entry, dict):
+                continue
+            try:
+                profiles.append(ScheduleProfile(
+                    entry.get('name') or f"perfil {idx + 1}",
+                    entry.get('min_interval', min_interval), entry.get('max_interval', max_interval),
+                    start=entry.get('start', '00:00'), end=entry.get('end', '24:00'), days=entry.get('days'),
+                ))
+            except (TypeError, ValueError):
+                continue
+        off_hours = None
+        off_cfg = cfg.get('off_hours')
+        if profiles and isinstance(off_cfg, dict):
+            off_hours = ScheduleProfile("fuera de horario", off_cfg.get('min_interval', min_interval),
+                                        off_cfg.get('max_interval', max_interval))
+        return cls(base_interval=base_interval, min_interval=min_interval, max_interval=max_interval,
+                   backoff=cfg.get('backoff', DEFAULT_BACKOFF), slow_latency=cfg.get('slow_latency', DEFAULT_SLOW_LATENCY),
+                   profiles=profiles, off_hours=off_hours, **kwargs)
+
+    def profile(self, now=None):
+        now = now or self.clock()
+        for profile in self.profiles:
+            if profile.matches(now):
+                return profile
+        return self.off_hours or self.default
+
+    def record_tick(self, found_work, latency=None, error=None, print_error=None):
+        """
+        Registra el resultado de un tick y devuelve (intervalo, motivo) para esperar al
+        siguiente. `error` es un error de Odoo; `print_error`, el de una impresora (sólo
+        estira el intervalo si el tick no trajo nada nuevo).
+        """
+        profile = self.profile()
+        lo, hi = profile.min_interval, profile.max_interval
+        if latency is not None:
+            self.latency = latency if self.latency is None else (
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency)
+
+        if error is not None:
+            self.errors += 1
+            self.empty_ticks = 0
+            interval = min(max(hi, ERROR_MAX_INTERVAL), max(lo, self.interval) * 2)
+            kind, reason = 'error', f"error de Odoo ({self.errors} seguidos)"
+        elif found_work:
+            self.errors = 0
+            self.print_errors = 0
+            self.empty_ticks = 0
+            interval = lo
+            kind, reason = 'work', "hubo comandas"
+        elif print_error is not None:
+            self.errors = 0
+            self.print_errors += 1
+            self.empty_ticks = 0
+            interval = min(hi, max(lo, self.interval) * 2)
+            kind, reason = 'printer', f"error de impresora ({self.print_errors} seguidos)"
+        else:
+            self.errors = 0
+            self.print_errors = 0
+            self.empty_ticks += 1
+            interval = min(hi, max(lo, self.interval * self.backoff))
+            kind, reason = 'idle', f"sin comandas ({self.empty_ticks} ticks)"
+
+        if error is None and self.latency is not None and self.latency > self.slow_latency:
+            factor = min(MAX_LATENCY_FACTOR, self.latency / self.slow_latency)
+            interval = min(hi * factor, interval * factor)  # puede pasar el máximo del perfil
+            kind, reason = 'slow', f"{reason}; Odoo lento ({self.latency:.1f} s)"
+
+        if profile.name:
+            reason = f"{reason} · {profile.name}"
+            kind = f"{kind}/{profile.name}"
+        self.interval = interval
+        self.reason = reason
+        self.changed = kind != self._last_kind
+        self._last_kind = kind
+        return interval, reason
+
+    def describe(self):
+        return f"próximo tick en {self.interval:.0f} s: {self.reason}"
@@ -0,0 +1,869 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_spool.py
+Persistencia local (SQLite) entre la impresora y Odoo.
+
+PrintSpool: bandeja de salida de comandas. Cada pedido leído de Odoo se guarda
+como un trabajo que pasa por los estados fetched -> rendered -> printed -> acked.
+La impresión la hace `drain()`, que toma los trabajos sin imprimir (incluidos los
+que quedaron a medias si el proceso se cortó) y los manda a la impresora. Las
+líneas quedan indexadas por id: saber si una línea ya está en la bandeja es O(1)
+y no requiere consultar Odoo.
+
+MarkQueue: cola "write-behind" del marcado `x_impreso_cocina`. Cada comanda impresa
+se anota primero en un diario local (una fila por línea) y recién después se
+escribe en Odoo juntando todas las líneas en la menor cantidad de `write` posible:
+lo hace MarkWorker mientras se sigue imprimiendo y, por las dudas, el tick al
+final. Mientras una línea siga en el diario se considera impresa: si el proceso
+se corta o Odoo no responde después de imprimir, no se vuelve a imprimir.
+
+Uso:
+  queue = MarkQueue(db_path, write_fn)      # write_fn(line_ids, printed_at)
+  queue.enqueue(order_id, line_ids)         # tras imprimir (durable al volver)
+  queue.is_journaled(line_id)               # O(1), sin consultar Odoo
+  queue.flush()                             # escribe en Odoo lo acumulado
+
+  spool = PrintSpool(db_path, write_fn)
+  spool.add_job(order, lines)               # estado fetched
+  spool.drain(render_fn, send_fn)           # rendered -> printed (+ diario de marcado)
+  spool.marks.flush()                       # printed -> acked
+
+  workers = SpoolWorkers(spool, render_fn, send_for_printer)
+  workers.wake(spool.unfinished_printers())  # un hilo por impresora vacía su parte
+  workers.collect(timeout=5)                 # resultados de lo que terminó
+
+  marker = MarkWorker(spool.marks)           # escribe el marcado mientras se imprime
+  marker.start()
+
+Cada drain es un pequeño pipeline: un hilo arma los tickets (a lo sumo
+`render_ahead` por delante, en una cola acotada) mientras el de la impresora manda
+los anteriores; si la impresora se atrasa, el armado se frena.
+"""
+
+import datetime as dt
+import itertools
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+MARK_BATCH_SIZE = 1000  # ids por llamada `write`
+MARK_LINGER = 0.5       # segundos que MarkWorker espera para juntar más líneas en un `write`
+MARK_RETRY_WAIT = 10    # segundos antes de reintentar si Odoo rechazó el marcado
+MARK_MAX_ATTEMPTS = 3   # flushes en que una línea puede fallar sola antes de ir a mark_dead
+RENDER_AHEAD = 32       # tickets armados esperando a la impresora, por drain
+JOB_CHUNK = 100         # trabajos leídos de la bandeja por consulta
+
+
+def connect(db_path):
+    """Abre la base local compartida entre hilos (el acceso se serializa con un lock)."""
+    conn = sqlite3.connect(str(db_path), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
+
+
+class MarkQueue:
+    """
+    Diario durable + escritura agrupada del marcado de líneas impresas.
+
+    Cada `write` lleva las líneas impresas en el mismo segundo (`x_impreso_fecha` es
+    la hora real de cada una). Si Odoo rechaza un lote por un error de datos (línea
+    borrada, sin acceso), las líneas se reintentan de a una: las demás se confirman
+    y la que falla sigue en el diario. Tras `max_attempts` flushes fallando sola pasa
+    a `mark_dead` (se avisa por consola) y deja de bloquear el diario; `requeue_dead()`
+    la devuelve al diario. Un error de red, o un rechazo de todas las líneas, corta
+    el flush: todo queda para el próximo intento.
+    """
+
+    def __init__(self, db_path, write_fn, batch_size=MARK_BATCH_SIZE, conn=None, lock=None, on_flushed=None,
+                 max_attempts=MARK_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.write_fn = write_fn
+        self.on_flushed = on_flushed
+        self.batch_size = max(1, int(batch_size))
+        self.max_attempts = max(1, int(max_attempts))
+        self._conn = conn or connect(db_path)
+        self._lock = lock or threading.RLock()
+        self._flush_lock = threading.Lock()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS mark_journal ("
+                    " line_id INTEGER PRIMARY KEY,"
+                    " order_id INTEGER,"
+                    " printed_at TEXT NOT NULL)"
+                )
+                columns = {row[1] for row in self._conn.execute("PRAGMA table_info(mark_journal)")}
+                if 'attempts' not in columns:
+                    # Diarios creados antes del reintento por línea.
+                    self._conn.execute("ALTER TABLE mark_journal ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS mark_dead ("
+                    " line_id INTEGER PRIMARY KEY,"
+                    " order_id INTEGER,"
+                    " printed_at TEXT NOT NULL,"
+                    " error TEXT,"
+                    " failed_at TEXT NOT NULL)"
+                )
+            rows = self._conn.execute("SELECT line_id FROM mark_journal").fetchall()
+            dead = self._conn.execute("SELECT line_id FROM mark_dead").fetchall()
+        self._pending = {row[0] for row in rows}
+        self._dead = {row[0] for row in dead}  # impresas que Odoo no deja marcar: tampoco se reimprimen
+        self.has_pending = threading.Event()  # avisa a MarkWorker que hay líneas nuevas
+        if self._pending:
+            self.has_pending.set()
+        self.writes = 0
+        self.lines_written = 0
+        self.failures = 0
+        self.faults = 0   # líneas rechazadas por Odoo en un write individual
+        self.dead = len(self._dead)
+        self.last_error = None
+
+    def enqueue(self, order_id, line_ids, printed_at=None):
+        with self._lock:
+            with self._conn:
+                ids = self._record(order_id, line_ids, printed_at)
+            self._journaled(ids)
+
+    def _journaled(self, ids):
+        """Llamar con el lock tomado, tras confirmar la transacción del diario."""
+        self._pending.update(ids)
+        self.has_pending.set()
+
+    def _record(self, order_id, line_ids, printed_at=None):
+        """Inserta en el diario dentro de la transacción en curso (sin confirmar)."""
+        printed_at = printed_at or dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [(int(lid), order_id, printed_at) for lid in line_ids]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO mark_journal (line_id, order_id, printed_at, attempts) VALUES (?, ?, ?, 0)",
+            rows,
+        )
+        return [r[0] for r in rows]
+
+    def is_journaled(self, line_id):
+        return line_id in self._pending or line_id in self._dead
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def dead_letters(self):
+        """Líneas impresas que Odoo no dejó marcar (ver `max_attempts`), con el error."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT line_id, order_id, printed_at, error, failed_at FROM mark_dead ORDER BY failed_at, line_id"
+            ).fetchall()
+        return [dict(zip(('line_id', 'order_id', 'printed_at', 'error', 'failed_at'), r)) for r in rows]
+
+    def requeue_dead(self, line_ids=None):
+        """
+        Devuelve al diario las líneas de `mark_dead` (todas, o las de `line_ids`) para
+        que el próximo flush las vuelva a intentar desde cero. Devuelve cuántas.
+        """
+        query = "SELECT line_id, order_id, printed_at FROM mark_dead"
+        params = ()
+        if line_ids is not None:
+            line_ids = [int(lid) for lid in line_ids]
+            if not line_ids:
+                return 0
+            query += f" WHERE line_id IN ({','.join('?' * len(line_ids))})"
+            params = tuple(line_ids)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+            if not rows:
+                return 0
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO mark_journal (line_id, order_id, printed_at, attempts) VALUES (?, ?, ?, 0)",
+                    rows,
+                )
+                self._conn.executemany("DELETE FROM mark_dead WHERE line_id = ?", [(r[0],) for r in rows])
+            ids = [r[0] for r in rows]
+            self._dead.difference_update(ids)
+            self.dead = len(self._dead)
+            self._journaled(ids)
+        return len(rows)
+
+    def flush(self):
+        """
+        Escribe en Odoo todas las líneas del diario: un `write` por hora de impresión,
+        en lotes de `batch_size`. Devuelve la cantidad de líneas confirmadas. Si falla
+        la conexión, lo que quedó sin confirmar sigue en el diario para el próximo
+        intento y la excepción sube.
+
+        Un rechazo de Odoo se le atribuye a una línea sólo si otras se pudieron marcar
+        (sus compañeras del lote al reintentar de a una o, si iba sola, alguna otra de
+        este flush), o si ya había quedado señalada así en un flush anterior. Si no
+        entró ninguna, el problema es general (acceso revocado, campo inexistente): el
+        diario queda como estaba, sin sumar intentos, y la excepción sube.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT line_id, order_id, printed_at, attempts FROM mark_journal ORDER BY printed_at, line_id"
+                ).fetchall()
+            done, rejected = 0, []
+            for printed_at, group in itertools.groupby(rows, key=lambda r: r[2]):
+                group = list(group)
+                for start in range(0, len(group), self.batch_size):
+                    ok, bad = self._write_chunk(group[start:start + self.batch_size], printed_at)
+                    done += ok
+                    rejected.extend(bad)
+            if not done and self._unproven(rejected):
+                self._failed(rejected[-1][1])
+            for row, exc in rejected:
+                self._reject(row, exc)
+            self.last_error = None
+            return done
+
+    def _write_chunk(self, chunk, printed_at):
+        """Devuelve (confirmadas, [(fila, error)] rechazadas de a una)."""
+        ids = [r[0] for r in chunk]
+        try:
+            self.write_fn(ids, printed_at)
+        except Exception as exc:
+            if self._transient(exc):
+                self._failed(exc)
+            if len(chunk) == 1:
+                return 0, [(chunk[0], exc)]
+            # De a una, así una línea borrada o sin acceso no traba a las demás.
+            done, rejected = 0, []
+            for row in chunk:
+                try:
+                    self.write_fn([row[0]], printed_at)
+                except Exception as err:
+                    if self._transient(err):
+                        self._failed(err)
+                    rejected.append((row, err))
+                    continue
+                self._confirm([row[0]])
+                done += 1
+            if not done and self._unproven(rejected):
+                self._failed(exc)
+            return done, rejected
+        self._confirm(ids)
+        return len(ids), []
+
+    @staticmethod
+    def _unproven(rejected):
+        # `attempts` sólo sube cuando otras líneas sí entraron: una línea con intentos
+        # ya quedó señalada; una sin intentos que cae junto con todo no prueba nada.
+        return any(row[3] == 0 for row, _exc in rejected)
+
+    @staticmethod
+    def _transient(exc):
+        from cocina_rpc import transient_error
+        return transient_error(exc)
+
+    def _failed(self, exc):
+        """Error de conexión o general: todo sigue en el diario, sin contar intentos por línea."""
+        self.failures += 1
+        self.last_error = exc
+        raise exc
+
+    def _reject(self, row, exc):
+        """Odoo rechazó esta línea y no las demás: suma un intento o, al llegar a `max_attempts`, va a mark_dead."""
+        line_id, order_id, printed_at, attempts = row
+        self.faults += 1
+        if attempts + 1 < self.max_attempts:
+            with self._lock, self._conn:
+                self._conn.execute("UPDATE mark_journal SET attempts = attempts + 1 WHERE line_id = ?", (line_id,))
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO mark_dead (line_id, order_id, printed_at, error, failed_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (line_id, order_id, printed_at, str(exc), _now_str()),
+                )
+                self._conn.execute("DELETE FROM mark_journal WHERE line_id = ?", (line_id,))
+                if self.on_flushed is not None:
+                    self.on_flushed([line_id])
+            self._pending.discard(line_id)
+            self._dead.add(line_id)
+        self.dead += 1
+        print(f"Advertencia: Odoo rechazó {attempts + 1} veces el marcado de la línea {line_id} "
+              f"(pedido {order_id}, impresa {printed_at}): {exc}. Queda en mark_dead, sin marcar "
+              f"(--retry-dead-marks la vuelve a intentar).")
+
+    def _confirm(self, ids):
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("DELETE FROM mark_journal WHERE line_id = ?", [(i,) for i in ids])
+                if self.on_flushed is not None:
+                    self.on_flushed(ids)
+            self._pending.difference_update(ids)
+        self.writes += 1
+        self.lines_written += len(ids)
+
+
+class MarkWorker:
+    """
+    Hilo que vacía el diario de marcado a medida que se imprime, así el `write` a
+    Odoo se superpone con la impresión de las comandas siguientes. Tras el primer
+    aviso espera `linger` segundos para juntar más líneas en la misma llamada. Si
+    Odoo falla, reintenta recién a los `retry_wait` segundos (el error queda en
+    `marks.last_error` y el tick lo informa al intentar su propio flush).
+    """
+
+    def __init__(self, marks, linger=MARK_LINGER, retry_wait=MARK_RETRY_WAIT):
+        self.marks = marks
+        self.linger = linger
+        self.retry_wait = retry_wait
+        self.flushes = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="marcado-odoo", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        marks = self.marks
+        while not self._stop.is_set():
+            if not marks.has_pending.wait(0.5):
+                continue
+            if self._stop.wait(self.linger):
+                return
+            marks.has_pending.clear()
+            if not marks.pending_count():
+                continue
+            try:
+                marks.flush()
+                self.flushes += 1
+            except Exception:
+                self.errors += 1
+                if self._stop.wait(self.retry_wait):
+                    return
+                marks.has_pending.set()  # lo que falló sigue en el diario
+
+    def stop(self, timeout=None):
+        """Pide que el hilo termine y lo espera hasta `timeout` segundos. True si terminó."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+
+# released: el trabajo se soltó sin imprimir porque otro puesto se quedó con sus líneas (cocina_claim).
+SPOOL_STATES = ('fetched', 'rendered', 'printed', 'acked', 'released')
+ALL_PRINTERS = object()  # filtro "todas las impresoras" (None es la impresora por defecto)
+
+
+def _now_str():
+    return dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class PrintSpool:
+    """
+    Bandeja de salida durable de comandas (una fila por pedido, otra por línea).
+    El marcado en Odoo se delega a `self.marks` (MarkQueue sobre la misma base).
+    """
+
+    def __init__(self, db_path, write_fn, batch_size=MARK_BATCH_SIZE):
+        self.db_path = db_path
+        self._conn = connect(db_path)
+        self._lock = threading.RLock()
+        with self._lock, self._conn:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS spool_jobs ("
+                " job_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " order_id INTEGER NOT NULL,"
+                " state TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " ticket_text TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " last_error TEXT,"
+                " created_at TEXT NOT NULL,"
+                " updated_at TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS spool_jobs_order ON spool_jobs (order_id);"
+                "CREATE INDEX IF NOT EXISTS spool_jobs_state ON spool_jobs (state, job_id);"
+                "CREATE TABLE IF NOT EXISTS spool_lines ("
+                " line_id INTEGER PRIMARY KEY,"
+                " job_id INTEGER NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS spool_lines_job ON spool_lines (job_id);"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(spool_jobs)")}
+            if 'printer' not in columns:
+                # Bandejas creadas antes del ruteo por estación: NULL = impresora por defecto.
+                self._conn.execute("ALTER TABLE spool_jobs ADD COLUMN printer TEXT")
+            rows = self._conn.execute("SELECT line_id FROM spool_lines").fetchall()
+        self._spooled = {row[0] for row in rows}
+        self._ready_queues = []  # colas de tickets armados de los drains en curso
+        self.marks = MarkQueue(db_path, write_fn, batch_size=batch_size, conn=self._conn,
+                               lock=self._lock, on_flushed=self._acknowledge)
+
+    # ----- Consultas O(1) -----
+    def is_spooled(self, line_id):
+        """True si la línea ya está en la bandeja (en cualquier estado) o en el diario de marcado."""
+        return line_id in self._spooled or self.marks.is_journaled(line_id)
+
+    def line_state(self, line_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT j.state FROM spool_lines l JOIN spool_jobs j ON j.job_id = l.job_id WHERE l.line_id = ?",
+                (line_id,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def order_jobs(self, order_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, state FROM spool_jobs WHERE order_id = ? ORDER BY job_id", (order_id,)
+            ).fetchall()
+        return [{'job_id': r[0], 'state': r[1]} for r in rows]
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM spool_jobs GROUP BY state").fetchall()
+        out = {state: 0 for state in SPOOL_STATES}
+        out.update(dict(rows))
+        return out
+
+    def queue_depths(self):
+        """
+        Trabajos esperando en cada etapa: por armar (fetched), armados esperando a la
+        impresora (rendered; `render_ahead` son los que ya están en memoria) y líneas
+        impresas esperando el marcado en Odoo.
+        """
+        counts = self.counts()
+        with self._lock:
+            ahead = sum(q.qsize() for q in self._ready_queues)
+        return {'to_render': counts['fetched'], 'to_print': counts['rendered'], 'render_ahead': ahead,
+                'to_mark': self.marks.pending_count()}
+
+    # ----- Estados -----
+    def add_job(self, order, lines, printer=None):
+        """
+        Guarda un pedido leído (estado fetched) para la impresora `printer` (None =
+        la impresora por defecto al momento de imprimir). Ignora líneas que ya
+        estaban en la bandeja.
+        """
+        lines = [l for l in lines if not self.is_spooled(l['id'])]
+        if not lines:
+            return None
+        now = _now_str()
+        payload = json.dumps({'order': order, 'lines': lines}, ensure_ascii=False)
+        with self._lock:
+            with self._conn:
+                cur = self._conn.execute(
+                    "INSERT INTO spool_jobs (order_id, state, payload, printer, created_at, updated_at)"
+                    " VALUES (?, 'fetched', ?, ?, ?, ?)",
+                    (order['id'], payload, printer, now, now),
+                )
+                job_id = cur.lastrowid
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO spool_lines (line_id, job_id) VALUES (?, ?)",
+                    [(l['id'], job_id) for l in lines],
+                )
+            self._spooled.update(l['id'] for l in lines)
+        return job_id
+
+    def unfinished_jobs(self, printer=ALL_PRINTERS):
+        """Trabajos sin imprimir (fetched/rendered), en orden de llegada, de una impresora o de todas."""
+        return list(self.iter_unfinished_jobs(printer))
+
+    def iter_unfinished_jobs(self, printer=ALL_PRINTERS, chunk=JOB_CHUNK):
+        """
+        Como unfinished_jobs pero de a `chunk` trabajos por consulta (memoria acotada).
+        Avanza por job_id: ve los trabajos que se agregan mientras recorre y no repite
+        los que siguen sin imprimir detrás de la posición actual.
+        """
+        query = ("SELECT job_id, state, payload, ticket_text, printer FROM spool_jobs"
+                 " WHERE state IN ('fetched', 'rendered') AND job_id > ?")
+        params = ()
+        if printer is None:
+            query += " AND printer IS NULL"
+        elif printer is not ALL_PRINTERS:
+            query += " AND printer = ?"
+            params = (printer,)
+        query += " ORDER BY job_id LIMIT ?"
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(query, (last_id,) + params + (chunk,)).fetchall()
+            for job_id, state, payload, ticket_text, job_printer in rows:
+                data = json.loads(payload)
+                yield {
+                    'job_id': job_id,
+                    'state': state,
+                    'order': data['order'],
+                    'lines': data['lines'],
+                    'ticket_text': ticket_text,
+                    'printer': job_printer,
+                }
+            if len(rows) < chunk:
+                return
+            last_id = rows[-1][0]
+
+    def unfinished_printers(self):
+        """Impresoras (None = por defecto) con trabajos sin imprimir."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT printer FROM spool_jobs WHERE state IN ('fetched', 'rendered')"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _set_rendered(self, job_id, ticket_text):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE spool_jobs SET state = 'rendered', ticket_text = ?, updated_at = ? WHERE job_id = ?",
+                (ticket_text, _now_str(), job_id),
+            )
+
+    def _set_printed(self, job):
+        line_ids = [l['id'] for l in job['lines']]
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE spool_jobs SET state = 'printed', attempts = attempts + 1, last_error = NULL,"
+                    " updated_at = ? WHERE job_id = ?",
+                    (_now_str(), job['job_id']),
+                )
+                ids = self.marks._record(job['order']['id'], line_ids)
+            self.marks._journaled(ids)
+
+    def _set_failed(self, job_id, exc):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE spool_jobs SET attempts = attempts + 1, last_error = ?, updated_at = ? WHERE job_id = ?",
+                (str(exc), _now_str(), job_id),
+            )
+
+    def _release(self, job, line_ids):
+        """
+        Suelta `line_ids` del trabajo sin imprimirlas: salen de la bandeja, así un
+        próximo fetch puede volver a traerlas si la reserva vuelve a quedar libre. Si
+        quedan líneas propias, el trabajo sigue con ésas (vuelve a fetched, hay que
+        rearmarlo) y se devuelve; si no, pasa a released y devuelve None.
+        """
+        lost = set(line_ids)
+        kept = [l for l in job['lines'] if l['id'] not in lost]
+        now = _now_str()
+        with self._lock:
+            with self._conn:
+                if kept:
+                    payload = json.dumps({'order': job['order'], 'lines': kept}, ensure_ascii=False)
+                    self._conn.execute(
+                        "UPDATE spool_jobs SET state = 'fetched', payload = ?, ticket_text = NULL, updated_at = ?"
+                        " WHERE job_id = ?",
+                        (payload, now, job['job_id']),
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE spool_jobs SET state = 'released', updated_at = ? WHERE job_id = ?",
+                        (now, job['job_id']),
+                    )
+                self._conn.executemany(
+                    "DELETE FROM spool_lines WHERE line_id = ? AND job_id = ?",
+                    [(lid, job['job_id']) for lid in lost],
+                )
+            self._spooled.difference_update(lost)
+        if not kept:
+            return None
+        return dict(job, state='fetched', lines=kept, ticket_text=None)
+
+    def _acknowledge(self, line_ids):
+        """Callback de MarkQueue: pasa a acked los trabajos sin líneas pendientes de marcar."""
+        self._conn.executemany(
+            "UPDATE spool_jobs SET state = 'acked', updated_at = ? WHERE state = 'printed' AND job_id IN"
+            " (SELECT job_id FROM spool_lines WHERE line_id = ?) AND NOT EXISTS"
+            " (SELECT 1 FROM spool_lines sl JOIN mark_journal m ON m.line_id = sl.line_id"
+            "  WHERE sl.job_id = spool_jobs.job_id)",
+            [(_now_str(), lid) for lid in line_ids],
+        )
+
+    # ----- Worker de impresión -----
+    def drain(self, render_fn, send_fn, max_tickets=1, max_bytes=None, max_wait=None, printer=ALL_PRINTERS,
+              render_ahead=RENDER_AHEAD, owned_fn=None, size_fn=None):
+        """
+        Imprime los trabajos pendientes: `render_fn(order, lines) -> texto` y
+        `send_fn([(job, texto), ...])` manda un lote a la impresora.
+
+        Un lote se cierra al llegar a `max_tickets`, a `max_bytes` o cuando pasaron
+        `max_wait` segundos desde el primer ticket del lote. `size_fn(job, texto)` da
+        los bytes que el ticket ocupa en el documento (sin ella, el texto en UTF-8). Si
+        `send_fn` falla y la excepción trae `delivered` (tickets que llegaron enteros),
+        esos se dan por impresos y el resto queda con error. Si no llegó ninguno por
+        un error de conexión (impresora apagada), el drain no manda nada más: el resto
+        de los trabajos queda con ese error, sin armar ni enviar, para el próximo drain.
+
+        Con `printer` sólo se procesan los trabajos de esa impresora. El armado corre
+        en otro hilo, hasta `render_ahead` tickets por delante de la impresora.
+
+        `owned_fn(line_ids) -> ids` (varios puestos) dice, justo antes de mandar cada
+        lote, qué líneas siguen reservadas por este puesto: las ajenas se sueltan sin
+        imprimir (`released`) y el resto del pedido se rearma y sale en el mismo lote.
+        Si la consulta falla, el lote queda con error y se reintenta.
+
+        Devuelve {'printed': [...], 'errors': [...], 'released': [...]} (lo impreso
+        trae `printed_at`, epoch de cuando la impresora lo aceptó); los trabajos con
+        error quedan en la bandeja y se reintentan en el próximo drain.
+        """
+        printed, errors, released = [], [], []
+        batch, batch_bytes, batch_started = [], 0, None
+        offline = []  # error de conexión con la impresora: no se le manda nada más en este drain
+
+        def fail(batch, exc):
+            for job, txt in batch:
+                self._set_failed(job['job_id'], exc)
+                errors.append({'order': job['order'], 'lines': job['lines'], 'ticket_text': txt,
+                               'printer': job['printer'], 'error': exc})
+
+        def send(batch):
+            if offline:
+                fail(batch, offline[0])
+                return
+            if owned_fn is not None:
+                try:
+                    owned = set(owned_fn([l['id'] for job, _ in batch for l in job['lines']]))
+                except Exception as err:
+                    fail(batch, err)
+                    return
+                kept = []
+                for job, txt in batch:
+                    lost = [l for l in job['lines'] if l['id'] not in owned]
+                    if not lost:
+                        kept.append((job, txt))
+                        continue
+                    released.append({'order': job['order'], 'lines': lost, 'printer': job['printer']})
+                    job = self._release(job, [l['id'] for l in lost])
+                    if job is None:
+                        continue
+                    # El resto sigue siendo de este puesto: se rearma y sale en este mismo lote.
+                    try:
+                        txt = render_fn(job['order'], job['lines'])
+                        self._set_rendered(job['job_id'], txt)
+                    except Exception as err:
+                        fail([(job, None)], err)
+                        continue
+                    kept.append((job, txt))
+                batch = kept
+                if not batch:
+                    return
+            try:
+                send_fn(batch)
+                delivered = len(batch)
+                exc = None
+            except Exception as err:
+                delivered = max(0, min(len(batch), int(getattr(err, 'delivered', 0) or 0)))
+                exc = err
+                if not delivered and _connection_failed(err):
+                    offline.append(err)
+            printed_at = time.time()
+            for idx, (job, txt) in enumerate(batch):
+                if idx < delivered:
+                    self._set_printed(job)
+                    printed.append({'order': job['order'], 'lines': job['lines'], 'ticket_text': txt,
+                                    'printer': job['printer'], 'printed_at': printed_at})
+                else:
+                    self._set_failed(job['job_id'], exc)
+                    errors.append({'order': job['order'], 'lines': job['lines'], 'ticket_text': txt,
+                                   'printer': job['printer'], 'error': exc})
+
+        ready = queue.Queue(maxsize=max(1, render_ahead))
+        cancelled = threading.Event()
+        failure = []
+
+        def put(item):
+            # Cola llena = la impresora va atrasada: el armado espera (salvo que el drain se corte).
+            while not cancelled.is_set():
+                try:
+                    ready.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def render_stage():
+            try:
+                for job in self.iter_unfinished_jobs(printer):
+                    txt = job['ticket_text']
+                    try:
+                        if (job['state'] == 'fetched' or txt is None) and not offline:
+                            txt = render_fn(job['order'], job['lines'])
+                            self._set_rendered(job['job_id'], txt)
+                    except Exception as exc:
+                        if not put((job, txt, exc)):
+                            return
+                        continue
+                    if not put((job, txt, None)):
+                        return
+            except Exception as exc:
+                failure.append(exc)
+            finally:
+                put(None)
+
+        renderer = threading.Thread(target=render_stage, name="armado-tickets", daemon=True)
+        with self._lock:
+            self._ready_queues.append(ready)
+        renderer.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                job, txt, exc = item
+                if offline and exc is None:
+                    exc = offline[0]
+                if exc is not None:
+                    self._set_failed(job['job_id'], exc)
+                    errors.append({'order': job['order'], 'lines': job['lines'], 'ticket_text': txt,
+                                   'printer': job['printer'], 'error': exc})
+                    continue
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.append((job, txt))
+                batch_bytes += size_fn(job, txt) if size_fn is not None else len(txt.encode('utf-8'))
+                if (len(batch) >= max(1, max_tickets)
+                        or (max_bytes and batch_bytes >= max_bytes)
+                        or (max_wait is not None and time.monotonic() - batch_started >= max_wait)):
+                    send(batch)
+                    batch, batch_bytes = [], 0
+            if batch:
+                send(batch)
+        finally:
+            cancelled.set()
+            # El armado termina al ver `cancelled` (como mucho, tras el ticket en curso):
+            # que no siga usando la bandeja después de que el drain volvió.
+            renderer.join()
+            with self._lock:
+                self._ready_queues.remove(ready)
+        if failure:
+            raise failure[0]
+        return {'printed': printed, 'errors': errors, 'released': released}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def purge(self, max_age_hours=24):
+        """Borra trabajos ya confirmados en Odoo (o soltados) con más de `max_age_hours` horas."""
+        limit = (dt.datetime.now() - dt.timedelta(hours=max_age_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            with self._conn:
+                rows = self._conn.execute(
+                    "SELECT l.line_id FROM spool_lines l JOIN spool_jobs j ON j.job_id = l.job_id"
+                    " WHERE j.state = 'acked' AND j.updated_at < ?",
+                    (limit,),
+                ).fetchall()
+                self._conn.execute(
+                    "DELETE FROM spool_lines WHERE job_id IN"
+                    " (SELECT job_id FROM spool_jobs WHERE state = 'acked' AND updated_at < ?)",
+                    (limit,),
+                )
+                self._conn.execute("DELETE FROM spool_jobs WHERE state IN ('acked', 'released') AND updated_at < ?",
+                                   (limit,))
+            self._spooled.difference_update(r[0] for r in rows)
+        return len(rows)
+
+
+def _connection_failed(exc):
+    """
+    True si el envío falló sin llegar a la impresora (conexión rechazada, timeout):
+    seguir mandándole lotes sólo suma otro timeout por lote.
+    """
+    if not hasattr(exc, 'delivered'):
+        return True
+    return isinstance(exc, OSError) or isinstance(getattr(exc, 'cause', None), OSError)
+
+
+class SpoolWorkers:
+    """
+    Un hilo por impresora que vacía la parte de la bandeja de esa impresora cada vez
+    que se lo despierta. Una impresora lenta o trabada sólo demora sus trabajos.
+
+    `send_for_printer(printer)` devuelve la función `send_fn(batch)` de esa impresora
+    y `drain_kwargs` se pasa tal cual a `PrintSpool.drain` (límites de lote).
+    """
+
+    def __init__(self, spool, render_fn, send_for_printer, **drain_kwargs):
+        self.spool = spool
+        self.render_fn = render_fn
+        self.send_for_printer = send_for_printer
+        self.drain_kwargs = drain_kwargs
+        self._cond = threading.Condition()
+        self._threads = {}
+        self._wanted = set()   # impresoras con un drain pedido y todavía no empezado
+        self._running = set()  # impresoras con un drain en curso
+        self._results = []
+        self._stop = False
+
+    def _loop(self, printer):
+        while True:
+            with self._cond:
+                while printer not in self._wanted and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                # Un wake durante el drain vuelve a pedir otro: los trabajos que llegaron
+                # después de que el drain leyó la bandeja no quedan esperando al próximo tick.
+                self._wanted.discard(printer)
+                self._running.add(printer)
+            try:
+                result = self.spool.drain(
+                    self.render_fn, self.send_for_printer(printer), printer=printer, **self.drain_kwargs
+                )
+            except Exception as exc:
+                result = {'printed': [], 'released': [], 'errors': [
+                    {'order': {}, 'lines': [], 'ticket_text': None, 'printer': printer, 'error': exc}
+                ]}
+            with self._cond:
+                self._running.discard(printer)
+                self._results.append(result)
+                self._cond.notify_all()
+
+    def wake(self, printers):
+        with self._cond:
+            for printer in printers:
+                self._wanted.add(printer)
+                if printer not in self._threads:
+                    name = f"impresora-{printer or 'predeterminada'}"
+                    thread = threading.Thread(target=self._loop, args=(printer,), name=name, daemon=True)
+                    self._threads[printer] = thread
+                    thread.start()
+            self._cond.notify_all()
+
+    def busy(self):
+        with self._cond:
+            return self._wanted | self._running
+
+    def collect(self, timeout=None):
+        """
+        Espera (hasta `timeout` segundos, None = sin límite) a que terminen los drains
+        pedidos y devuelve lo impreso/errores acumulados hasta ahora. Lo que termine
+        después se entrega en el próximo `collect`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while (self._wanted or self._running) and not self._stop:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            results, self._results = self._results, []
+        merged = {'printed': [], 'errors': [], 'released': []}
+        for result in results:
+            merged['printed'].extend(result['printed'])
+            merged['errors'].extend(result['errors'])
+            merged['released'].extend(result.get('released', ()))
+        return merged
+
+    def stop(self, timeout=None):
+        """
+        Pide que los hilos terminen (el drain en curso se completa) y los espera hasta
+        `timeout` segundos en total. True si terminaron todos.
+        """
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+            threads = list(self._threads.values())
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in threads)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+cocina_store.py
+Pedidos y líneas del día en memoria, compartidos por la impresión y la vista.
+
+La lista de comandas de la GUI se arma desde acá: la primera carga (y cada
+`reload_interval` segundos) trae de Odoo la ventana reciente completa; las
+siguientes sólo las líneas con `write_date` posterior a la marca del store. La
+impresión escribe en el mismo store: los pedidos leídos como pendientes y las
+líneas que se acaban de imprimir, así la vista se actualiza sin ir a Odoo.
+
+Lo que el store puede no ver hasta la siguiente recarga completa: líneas que
+dejan de cumplir el dominio (cantidad en 0, pedido cancelado), porque la
+consulta incremental sólo trae las que todavía lo cumplen.
+
+Uso:
+  store = OrderStore()
+  if store.needs_reload(scope=12, day='2026-10-16 00:00:00'):
+      store.reset(scope=12, day='2026-10-16 00:00:00')
+  store.merge(lines, orders, from_odoo=True)
+  store.mark_printed([101, 102], write_date='2026-10-16 21:03:00')
+  payloads = store.view(limit_orders=20, render=render_cache.ticket)
+"""
+
+import threading
+import time
+
+DEFAULT_RELOAD_INTERVAL = 300  # segundos entre recargas completas de la vista
+
+
+class OrderStore:
+    """
+    Líneas por id y pedidos por id del alcance actual (`scope`: la categoría TPV
+    filtrada, y `day`: inicio del día de la vista). `watermark` es el mayor
+    `write_date` de líneas leídas de Odoo por la vista: hasta ahí el store está al
+    día. Lo que escribe la impresión no mueve la marca (sólo ve pendientes).
+    """
+
+    def __init__(self, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._lines = {}
+        self._order_lines = {}   # order_id -> {line_id}
+        self._printed_at = {}    # line_id -> hora de la impresión local (sólo para ordenar la vista)
+        self.scope = None
+        self.day = None
+        self.watermark = None
+        self.loaded_at = None
+        self.stale = True
+
+    # ----- Alcance y recarga -----
+    def needs_reload(self, scope, day):
+        with self._lock:
+            if self.stale or self.loaded_at is None or scope != self.scope or day != self.day:
+                return True
+            return self.reload_interval > 0 and time.monotonic() - self.loaded_at >= self.reload_interval
+
+    def reset(self, scope, day):
+        """Vacía el store para una recarga completa de `scope`/`day`."""
+        with self._lock:
+            self._orders.clear()
+            self._lines.clear()
+            self._order_lines.clear()
+            self._printed_at.clear()
+            self.scope = scope
+            self.day = day
+            self.watermark = None
+            self.loaded_at = time.monotonic()
+            self.stale = False
+
+    def invalidate(self):
+        """La próxima consulta de la vista hace una recarga completa."""
+        with self._lock:
+            self.stale = True
+
+    def accepts(self, scope):
+        """Si el store está cargado para `scope` (la impresión sólo escribe en ese caso)."""
+        with self._lock:
+            return self.loaded_at is not None and scope == self.scope
+
+    def has_order(self, order_id):
+        with self._lock:
+            return order_id in self._orders
+
+    # ----- Escritura -----
+    def merge(self, lines, orders, from_odoo=True):
+        """
+        Agrega o actualiza líneas y pedidos. Con `from_odoo` (lectura de la vista)
+        la marca avanza hasta el mayor write_date leído. A las líneas que no traen
+        `x_impreso_cocina` (pendientes) se les asume False.
+        """
+        with self._lock:
+            for order in orders:
+                known = self._orders.get(order['id'])
+                self._orders[order['id']] = dict(known, **order) if known else dict(order)
+            for line in lines:
+                oid = line['order_id'][0]
+                known = self._lines.get(line['id'])
+                merged = dict(known, **line) if known else dict(line)
+                merged.setdefault('x_impreso_cocina', False)
+                self._lines[line['id']] = merged
+                if known is not None and known['order_id'][0] != oid:
+                    self._order_lines.get(known['order_id'][0], set()).discard(line['id'])
+                self._order_lines.setdefault(oid, set()).add(line['id'])
+                write_date = line.get('write_date')
+                if from_odoo and write_date and (self.watermark is None or write_date > self.watermark):
+                    self.watermark = write_date
+
+    def mark_printed(self, line_ids, write_date=None):
+        """
+        Marca líneas como impresas localmente (el marcado en Odoo va por el diario de
+        la bandeja). `write_date` anticipa el que pondrá Odoo al marcar, para que el
+        pedido suba en la lista como lo haría tras releerlo; el `write_date` de la
+        línea no se toca, así el ticket ya armado (RenderCache) sigue valiendo.
+        """
+        with self._lock:
+            for line_id in line_ids:
+                line = self._lines.get(line_id)
+                if line is not None:
+                    line['x_impreso_cocina'] = True
+                    if write_date and write_date > self._printed_at.get(line_id, ''):
+                        self._printed_at[line_id] = write_date
+
+    # ----- Lectura -----
+    def view(self, limit_orders=20, render=None):
+        """
+        Pedidos del día ordenados por última actividad (descendente), con la misma
+        forma que devolvía fetch_recent_printed. `render(order, lines)` arma el
+        texto del ticket (p. ej. `RenderCache.ticket`, que no rehace lo que no cambió).
+        Devuelve copias: se pueden leer desde otro hilo mientras el store cambia.
+        """
+        with self._lock:
+            entries = []
+            for oid, line_ids in self._order_lines.items():
+                order = self._orders.get(oid)
+                if not order or not line_ids:
+                    continue
+                date_order = order.get('date_order') or ''
+                if self.day and date_order and date_order < self.day:
+                    continue
+                lines = [self._lines[lid] for lid in sorted(line_ids)]
+                last_write = max((line.get('write_date') or '' for line in lines), default='')
+                printed_at = max((self._printed_at.get(lid, '') for lid in line_ids), default='')
+                entries.append((max(last_write, date_order, printed_at), last_write, order, lines))
+            entries.sort(key=lambda entry: (entry[0], entry[2]['id']), reverse=True)  # empate: el pedido más nuevo primero
+            if limit_orders:
+                entries = entries[:limit_orders]
+            out = []
+            for last_activity, last_write, order, lines in entries:
+                out.append({
+                    'order': dict(order),
+                    'lines': [dict(line) for line in lines],
+                    'ticket_text': render(order, lines) if render is not None else None,
+                    'printed': all(line.get('x_impreso_cocina') for line in lines),
+                    'last_write_date': last_write,
+                    'last_activity': last_activity,
+                })
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {'orders': len(self._orders), 'lines': len(self._lines), 'watermark': self.watermark}
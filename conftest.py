@@ -0,0 +1,2 @@
+# test_odoo.py es una prueba manual de conexión contra el Odoo real (necesita .env): no va en pytest.
+collect_ignore = ["test_odoo.py"]
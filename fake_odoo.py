@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+"""
+fake_odoo.py
+Odoo de mentira para probar y medir los scripts de cocina sin un servidor real.
+
+Sirve, en un mismo puerto:
+  POST /xmlrpc/2/common            -> authenticate / version (acepta cualquier usuario)
+  POST /xmlrpc/2/object            -> execute_kw: search, read, search_read, search_count,
+                                      write y fields_get sobre pos.order.line, pos.order,
+                                      product.product, product.template y pos.category
+                                      (datos en memoria)
+  POST /jsonrpc                    -> lo mismo por JSON-RPC (servicios common y object)
+  POST /web/session/authenticate   -> abre sesión web (cookie session_id)
+  POST /longpolling/poll           -> bus de Odoo: espera avisos de los canales pedidos
+  POST /fake/notify                -> publica un aviso de pos.order, cuerpo opcional
+                                      {"channel": "cocina_pos", "order_id": 5, "state": "paid"}
+
+Los dominios admiten '&', '|', '!', campos relacionados (`order_id.state`), el
+one2many `lines` de pos.order (`lines.x_impreso_cocina`: alguna línea cumple) y los
+operadores =, !=, <, <=, >, >=, in, not in y child_of. `latency` agrega una demora
+fija a cada llamada execute_kw, para simular un Odoo remoto. Un execute_kw con un
+uid distinto del que devuelve authenticate falla como AccessDenied (Fault 3 por
+XML-RPC), igual que un uid guardado que Odoo ya no acepta.
+
+Uso:
+  python fake_odoo.py --port 8069 --orders 500 --every 10   # 500 pedidos cobrados, un aviso cada 10 s
+  curl -X POST localhost:8069/fake/notify -d '{"order_id": 5}'
+  python imprimir_cocina_win.py --gui --bus --bus-url http://localhost:8069
+
+  server = start_server(db=FakeOdooDB.generate(2000), latency=0.005)   # en proceso (bench_cocina.py)
+"""
+
+import argparse
+import datetime as dt
+import itertools
+import json
+import secrets
+import threading
+import time
+import xmlrpc.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cocina_bus import DEFAULT_CHANNEL
+
+
+FAKE_UID = 2
+_ACCESS_DENIED_CODE = 3  # Fault de odoo.exceptions.AccessDenied por XML-RPC
+
+_PRODUCTS = [
+    # (nombre, categoría TPV)
+    ("Hamburguesa Clásica", 11), ("Hamburguesa Doble Cheddar", 11), ("Papas Fritas Grandes", 12),
+    ("Aros de Cebolla", 12), ("Cerveza Tirada 500cc", 21), ("Gaseosa Línea Coca-Cola", 21),
+    ("Ñoquis de la Casa", 13),
+]
+_CATEGORIES = {
+    10: ("Cocina", None), 11: ("Parrilla", 10), 12: ("Freidora", 10), 13: ("Pastas", 10),
+    20: ("Bebidas", None), 21: ("Barra", 20),
+}
+_RELATIONS = {
+    'order_id': 'pos.order', 'product_id': 'product.product', 'product_tmpl_id': 'product.template',
+    'pos_categ_id': 'pos.category', 'parent_id': 'pos.category',
+}
+
+
+def _now_str(offset_seconds=0):
+    return (dt.datetime.utcnow() - dt.timedelta(seconds=offset_seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class FakeOdooDB:
+    """Tablas en memoria con los campos que usan los scripts de cocina."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {'pos.order': {}, 'pos.order.line': {}, 'product.product': {}, 'product.template': {},
+                       'pos.category': {}}
+        self.calls = {}   # (modelo, método) -> cantidad
+        for cid, (name, parent) in _CATEGORIES.items():
+            self.tables['pos.category'][cid] = {
+                'id': cid, 'name': name, 'parent_id': [parent, _CATEGORIES[parent][0]] if parent else False,
+                'write_date': _now_str(86400),
+            }
+        for pid, (name, categ) in enumerate(_PRODUCTS, start=1):
+            # Una variante por plantilla, con el mismo id. pos_categ_id se copia en la
+            # variante (en Odoo es un related de la plantilla): ver set_product_category.
+            self.tables['product.template'][pid] = {
+                'id': pid, 'name': name, 'pos_categ_id': [categ, _CATEGORIES[categ][0]],
+                'product_variant_ids': [pid], 'write_date': _now_str(86400),
+            }
+            self.tables['product.product'][pid] = {
+                'id': pid, 'name': name, 'pos_categ_id': [categ, _CATEGORIES[categ][0]],
+                'product_tmpl_id': [pid, name], 'write_date': _now_str(86400),
+            }
+        self._order_ids = itertools.count(1)
+        self._line_ids = itertools.count(1)
+        self._order_lines = {}   # order_id -> [line_id] (para el one2many `lines` de pos.order)
+
+    @classmethod
+    def generate(cls, n_orders, lines_per_order=3, state='paid'):
+        db = cls()
+        for i in range(n_orders):
+            # Repartidos en la última hora, del más viejo al más nuevo.
+            db.add_order(lines_per_order, state=state, age_seconds=max(0, 3600 - i * 3600 // max(1, n_orders)))
+        return db
+
+    def add_order(self, n_lines=3, state='paid', age_seconds=0):
+        oid = next(self._order_ids)
+        stamp = _now_str(age_seconds)
+        name = f"Loren Burger/{oid:05d}"
+        self.tables['pos.order'][oid] = {
+            'id': oid, 'name': name, 'state': state, 'date_order': stamp, 'write_date': stamp,
+            'partner_id': False, 'table_id': [1 + oid % 12, f"Mesa {1 + oid % 12}"] if oid % 3 else False,
+            'amount_total': 0.0,
+        }
+        self._order_lines[oid] = []
+        for j in range(n_lines):
+            lid = next(self._line_ids)
+            pid = 1 + (oid + j) % len(_PRODUCTS)
+            product = self.tables['product.product'][pid]
+            self.tables['pos.order.line'][lid] = {
+                'id': lid, 'order_id': [oid, name], 'product_id': [pid, product['name']],
+                'display_name': product['name'], 'qty': float(1 + j % 2),
+                'note': "sin cebolla" if (oid + j) % 5 == 0 else False,
+                'x_impreso_cocina': False, 'x_impreso_fecha': False, 'x_cocina_claim': False,
+                'x_cocina_claim_at': False, 'write_date': stamp,
+            }
+            self._order_lines[oid].append(lid)
+        return oid
+
+    def set_product_category(self, product_id, categ_id):
+        """Cambia la categoría TPV como la ficha de producto: sólo toca el write_date de la plantilla."""
+        product = self.tables['product.product'][product_id]
+        categ = [categ_id, _CATEGORIES[categ_id][0]] if categ_id else False
+        template = self.tables['product.template'][product['product_tmpl_id'][0]]
+        template.update(pos_categ_id=categ, write_date=_now_str())
+        for pid in template['product_variant_ids']:
+            self.tables['product.product'][pid]['pos_categ_id'] = categ
+
+    # ----- Dominios -----
+    def _value(self, rec, path):
+        parts = path.split('.')
+        for idx, part in enumerate(parts):
+            value = rec.get(part, False)
+            if idx == len(parts) - 1:
+                return value[0] if isinstance(value, list) else value
+            if not value:
+                return False
+            rec = self.tables[_RELATIONS[part]].get(value[0] if isinstance(value, list) else value, {})
+
+    def _match_leaf(self, rec, leaf):
+        field, op, target = leaf
+        if field.startswith('lines.'):
+            # one2many de pos.order: alguna línea del pedido cumple la condición.
+            lines = self.tables['pos.order.line']
+            rest = (field[len('lines.'):], op, target)
+            return any(self._match_leaf(lines[lid], rest) for lid in self._order_lines.get(rec['id'], ()))
+        value = self._value(rec, field)
+        if op == 'child_of':
+            targets = set(target) if isinstance(target, (list, tuple)) else {target}
+            seen = set()
+            while value and value not in seen:
+                if value in targets:
+                    return True
+                seen.add(value)
+                parent = self.tables['pos.category'].get(value, {}).get('parent_id')
+                value = parent[0] if parent else False
+            return False
+        if op == '=':
+            return value == target or (target is False and not value)
+        if op == '!=':
+            return value != target and not (target is False and not value)
+        if op == 'in':
+            return value in target
+        if op == 'not in':
+            return value not in target
+        if value is False:
+            return False
+        if op == '>':
+            return value > target
+        if op == '>=':
+            return value >= target
+        if op == '<':
+            return value < target
+        if op == '<=':
+            return value <= target
+        raise ValueError(f"operador no soportado: {op}")
+
+    def _match(self, rec, domain):
+        def evaluate(pos):
+            term = domain[pos]
+            if term == '!':
+                result, pos = evaluate(pos + 1)
+                return not result, pos
+            if term in ('&', '|'):
+                left, pos = evaluate(pos + 1)
+                right, pos = evaluate(pos)
+                return (left and right) if term == '&' else (left or right), pos
+            return self._match_leaf(rec, term), pos + 1
+
+        pos, ok = 0, True
+        while pos < len(domain):
+            result, pos = evaluate(pos)
+            ok = ok and result
+        return ok
+
+    def search(self, model, domain, offset=0, limit=None, order=None):
+        recs = [r for r in self.tables[model].values() if self._match(r, domain)]
+        for part in reversed((order or 'id').split(',')):
+            bits = part.split()
+            desc = len(bits) > 1 and bits[1].lower() == 'desc'
+            recs.sort(key=lambda r, f=bits[0]: (r.get(f) is not False, r.get(f) or 0), reverse=desc)
+        recs = recs[offset:]
+        if limit:
+            recs = recs[:limit]
+        return [r['id'] for r in recs]
+
+    def read(self, model, ids, fields=None):
+        table = self.tables[model]
+        out = []
+        for rid in ids:
+            rec = table.get(rid)
+            if rec is not None:
+                row = {f: rec.get(f, False) for f in (fields or rec)}
+                row['id'] = rid
+                out.append(row)
+        return out
+
+    def execute_kw(self, model, method, rpc_args, rpc_kwargs=None):
+        kw = rpc_kwargs or {}
+        with self.lock:
+            self.calls[(model, method)] = self.calls.get((model, method), 0) + 1
+            if method == 'search':
+                return self.search(model, rpc_args[0], kw.get('offset', 0), kw.get('limit'), kw.get('order'))
+            if method == 'search_count':
+                return len(self.search(model, rpc_args[0]))
+            if method == 'read':
+                return self.read(model, rpc_args[0], kw.get('fields') or (rpc_args[1] if len(rpc_args) > 1 else None))
+            if method == 'search_read':
+                domain = rpc_args[0] if rpc_args else kw.get('domain', [])
+                ids = self.search(model, domain, kw.get('offset', 0), kw.get('limit'), kw.get('order'))
+                return self.read(model, ids, kw.get('fields'))
+            if method == 'write':
+                ids, vals = rpc_args
+                stamp = _now_str()
+                for rid in ids:
+                    self.tables[model][rid].update(vals, write_date=stamp)
+                return True
+            if method == 'fields_get':
+                sample = next(iter(self.tables[model].values()), {})
+                wanted = rpc_args[0] if rpc_args else list(sample)
+                return {f: {'type': 'boolean' if isinstance(sample.get(f), bool) else 'char'}
+                        for f in wanted if f in sample}
+        raise ValueError(f"método no soportado: {model}.{method}")
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def pending_lines(self):
+        with self.lock:
+            return sum(1 for l in self.tables['pos.order.line'].values() if not l['x_impreso_cocina'])
+
+
+class FakeBus:
+    """Cola de notificaciones con ids crecientes; se conservan `retention` segundos (como Odoo)."""
+
+    def __init__(self, retention=50):
+        self.retention = retention
+        self._cond = threading.Condition()
+        self._notifications = []
+        self._next_id = 1
+        self.polls = 0
+
+    def send(self, channel, message_type, payload):
+        with self._cond:
+            note = {
+                'id': self._next_id,
+                'channel': channel,
+                'message': {'type': message_type, 'payload': payload},
+                '_at': time.monotonic(),
+            }
+            self._next_id += 1
+            self._notifications.append(note)
+            cutoff = time.monotonic() - self.retention
+            self._notifications = [n for n in self._notifications if n['_at'] >= cutoff]
+            self._cond.notify_all()
+            return note['id']
+
+    def poll(self, channels, last, timeout):
+        channels = set(channels)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.polls += 1
+            while True:
+                found = [n for n in self._notifications if n['id'] > last and n['channel'] in channels]
+                if found:
+                    return [{k: v for k, v in n.items() if not k.startswith('_')} for n in found]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+
+
+class _AccessDenied(Exception):
+    def __init__(self):
+        super().__init__("Access Denied")
+
+
+class FakeOdooHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como Odoo detrás de un proxy
+
+    def log_message(self, fmt, *log_args):
+        if self.server.verbose:
+            super().log_message(fmt, *log_args)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def _reply(self, body, status=200, cookie=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if cookie:
+            self.send_header('Set-Cookie', f"session_id={cookie}; Path=/; HttpOnly")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _rpc_result(self, request, result, cookie=None):
+        self._reply({'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}, cookie=cookie)
+
+    def _rpc_error(self, request, code, message):
+        self._reply({'jsonrpc': '2.0', 'id': request.get('id'),
+                     'error': {'code': code, 'message': message, 'data': {'message': message}}})
+
+    def _session(self):
+        for part in (self.headers.get('Cookie') or '').split(';'):
+            key, _, value = part.strip().partition('=')
+            if key == 'session_id':
+                return value
+        return None
+
+    def _reply_bytes(self, data, ctype):
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self, service, method, rpc_args):
+        server = self.server
+        if service == 'common':
+            if method == 'authenticate':
+                return FAKE_UID
+            if method == 'version':
+                return {'server_version': 'fake', 'protocol_version': 1}
+            raise ValueError(f"método no soportado: common.{method}")
+        if method != 'execute_kw':
+            raise ValueError(f"método no soportado: object.{method}")
+        if len(rpc_args) < 2 or rpc_args[1] != FAKE_UID:
+            raise _AccessDenied()
+        if server.latency:
+            time.sleep(server.latency)
+        model, model_method = rpc_args[3], rpc_args[4]
+        return server.db.execute_kw(model, model_method, rpc_args[5] if len(rpc_args) > 5 else [],
+                                    rpc_args[6] if len(rpc_args) > 6 else None)
+
+    def _xmlrpc(self, service):
+        length = int(self.headers.get('Content-Length') or 0)
+        rpc_args, method = xmlrpc.client.loads(self.rfile.read(length), use_builtin_types=True)
+        try:
+            body = xmlrpc.client.dumps((self._dispatch(service, method, rpc_args),),
+                                       methodresponse=True, allow_none=True)
+        except _AccessDenied as exc:
+            body = xmlrpc.client.dumps(xmlrpc.client.Fault(_ACCESS_DENIED_CODE, str(exc)), methodresponse=True)
+        except Exception as exc:
+            body = xmlrpc.client.dumps(xmlrpc.client.Fault(1, str(exc)), methodresponse=True)
+        self._reply_bytes(body.encode('utf-8'), 'text/xml')
+
+    def do_POST(self):
+        if self.path in ('/xmlrpc/2/common', '/xmlrpc/2/object'):
+            self._xmlrpc(self.path.rsplit('/', 1)[1])
+            return
+        request = self._read_json()
+        params = request.get('params') or {}
+        server = self.server
+        if self.path == '/jsonrpc':
+            try:
+                result = self._dispatch(params.get('service'), params.get('method'), params.get('args') or [])
+            except Exception as exc:
+                self._rpc_error(request, 200, str(exc))
+                return
+            self._rpc_result(request, result)
+        elif self.path == '/web/session/authenticate':
+            token = secrets.token_hex(16)
+            server.sessions.add(token)
+            self._rpc_result(request, {'uid': 1, 'db': params.get('db')}, cookie=token)
+        elif self.path == server.bus_path:
+            if self._session() not in server.sessions:
+                self._rpc_error(request, 100, "Session expired")
+                return
+            notes = server.bus.poll(params.get('channels') or [], int(params.get('last') or 0), server.poll_timeout)
+            self._rpc_result(request, notes)
+        elif self.path == '/fake/notify':
+            note_id = server.bus.send(
+                request.get('channel') or server.channel, 'pos.order/state',
+                {'id': request.get('order_id') or 0, 'state': request.get('state') or 'paid'},
+            )
+            self._reply({'id': note_id})
+        else:
+            self._reply({'error': 'not found'}, status=404)
+
+
+class FakeOdooServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, db=None, latency=0.0, bus=None, channel=DEFAULT_CHANNEL, poll_timeout=50,
+                 bus_path='/longpolling/poll', verbose=False):
+        super().__init__(address, FakeOdooHandler)
+        self.db = db or FakeOdooDB()
+        self.latency = latency
+        self.bus = bus or FakeBus()
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.bus_path = bus_path
+        self.verbose = verbose
+        self.sessions = set()
+
+    def expire_sessions(self):
+        """Invalida las sesiones abiertas (para probar la reautenticación)."""
+        self.sessions.clear()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(host='127.0.0.1', port=0, **kwargs):
+    """Levanta el servidor en un hilo de fondo (port=0: puerto libre). Devuelve el servidor."""
+    server = FakeOdooServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="fake-odoo", daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Odoo de mentira (XML-RPC, JSON-RPC y bus) para pruebas")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8069)
+    ap.add_argument("--orders", type=int, default=0, help="Pedidos cobrados sin imprimir al arrancar")
+    ap.add_argument("--lines", type=int, default=3, help="Líneas por pedido")
+    ap.add_argument("--latency", type=float, default=0.0, help="Demora (s) agregada a cada execute_kw")
+    ap.add_argument("--channel", default=DEFAULT_CHANNEL, help="Canal donde se publican los avisos")
+    ap.add_argument("--every", type=float, default=0, help="Publica un aviso cada N segundos (0 = nunca)")
+    ap.add_argument("--poll-timeout", type=float, default=50, help="Segundos que dura cada long-poll")
+    ap.add_argument("--verbose", action="store_true", help="Muestra cada pedido HTTP")
+    a = ap.parse_args()
+
+    server = start_server(a.host, a.port, db=FakeOdooDB.generate(a.orders, a.lines), latency=a.latency,
+                          channel=a.channel, poll_timeout=a.poll_timeout, verbose=a.verbose)
+    print(f"Odoo de mentira escuchando en {server.url} (canal {a.channel}). Ctrl+C para salir.")
+    try:
+        while True:
+            if a.every > 0:
+                time.sleep(a.every)
+                with server.db.lock:
+                    order_id = server.db.add_order(a.lines)
+                note_id = server.bus.send(a.channel, 'pos.order/state', {'id': order_id, 'state': 'paid'})
+                print(f"Aviso {note_id}: pedido {order_id} cobrado")
+            else:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,11 @@ Uso:
   - Filtrar por categoría TPV (ID):        python imprimir_cocina_win.py --pos-categ 12
   - Elegir impresora (no la predeterminada): python imprimir_cocina_win.py --printer "EPSON TM-T20III Receipt"
   - Abrir interfaz gráfica:                python imprimir_cocina_win.py --gui
+  - GUI con avisos del bus de Odoo:        python imprimir_cocina_win.py --gui --bus
+  - GUI con intervalo adaptable:           python imprimir_cocina_win.py --gui --adaptive
+  - Servicio sin ventana (un solo proceso): python imprimir_cocina_win.py --watch --adaptive
+  - Buscar en comandas ya impresas:        python imprimir_cocina_win.py --search "mesa 5"
+  - Reimprimir del archivo (sin Odoo):     python imprimir_cocina_win.py --reprint 1234
 
 Requisitos:
   - pywin32
@@ -23,11 +28,18 @@ import sys
 import argparse
 import datetime as dt
 import json
-import textwrap
-import xmlrpc.client
+import signal
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 
+from cocina_bus import DEFAULT_CHANNEL, BusClient, BusTrigger
+from cocina_core import ARCHIVE_RETENTION_DAYS, SESSION_FILENAME, KitchenPrinter, OdooClient
+from cocina_engine import AutoEngine
+from cocina_escpos import CODEPAGES, DEFAULT_CODEPAGE, plain_text
+from cocina_metrics import Metrics, start_http_server
+from cocina_scheduler import AdaptiveScheduler
+
 # =========================
 # Configuración persistente
 # =========================
@@ -56,6 +68,25 @@ def save_config(config):
 CONFIG = load_config()
 
 
+def load_routes(config):
+    """
+    Tabla de ruteo por estación del config:
+      "routes": [{"name": "Parrilla", "pos_categ": 12, "printer": "tcp://192.168.1.50"}, ...]
+    Cada ruta puede traer su "codepage" (p. ej. "cp858"). Se ignoran entradas incompletas.
+    """
+    routes = []
+    for entry in config.get("routes") or []:
+        if not isinstance(entry, dict):
+            continue
+        categ, printer = entry.get("pos_categ"), entry.get("printer")
+        if isinstance(categ, int) and isinstance(printer, str) and printer.strip():
+            route = {"name": entry.get("name") or printer.strip(), "pos_categ": categ, "printer": printer.strip()}
+            if entry.get("codepage") in CODEPAGES:
+                route["codepage"] = entry["codepage"]
+            routes.append(route)
+    return routes
+
+
 def _argument_provided(flag):
     prefix = f"{flag}="
     for arg in sys.argv[1:]:
@@ -67,14 +98,58 @@ def _argument_provided(flag):
 # =========================
 # CLI
 # =========================
+# Lo mismo que cocina_rpc.TRANSPORTS: cocina_rpc (xmlrpc, http.client) se importa recién en la primera llamada.
+RPC_TRANSPORTS = ("xmlrpc", "jsonrpc")
+
 ap = argparse.ArgumentParser()
 ap.add_argument("--dry-run", action="store_true", help="No imprime ni escribe en Odoo")
 ap.add_argument("--pos-categ", type=int, default=None, help="ID de Categoría del TPV para filtrar (incluye hijas)")
 ap.add_argument("--max-orders", type=int, default=20, help="Máx. pedidos a procesar por corrida")
+ap.add_argument("--catch-up", action="store_true",
+                help="Vacía todo lo pendiente por páginas, sin el tope de --max-orders (p. ej. tras un corte)")
 ap.add_argument("--print-test", action="store_true", help="Imprime una página de prueba en la impresora seleccionada y sale")
-ap.add_argument("--printer", type=str, default=None, help="Nombre de impresora Windows (si no se indica, usa la predeterminada)")
+ap.add_argument("--search", type=str, default=None, metavar="TEXTO",
+                help="Busca en el archivo local de comandas impresas (pedido, mesa o cliente) y sale; \"\" = las últimas")
+ap.add_argument("--reprint", type=int, default=None, metavar="ID",
+                help="Reimprime un ticket del archivo local (ID de --search) con los bytes originales y sale")
+ap.add_argument("--retry-dead-marks", action="store_true",
+                help="Vuelve a intentar en Odoo el marcado de las líneas que quedaron en mark_dead y sale")
+ap.add_argument("--archive-days", type=int, default=ARCHIVE_RETENTION_DAYS,
+                help="Días que se guardan las comandas impresas en el archivo local (0 = sin archivo)")
+ap.add_argument("--printer", type=str, default=None,
+                help="Impresora: nombre en Windows, tcp://IP[:9100], file:ruta o null: (si no se indica, usa la predeterminada)")
+ap.add_argument("--codepage", choices=list(CODEPAGES), default=DEFAULT_CODEPAGE,
+                help="Página de códigos de la impresora (ESC t); cp858 o cp1252 tienen Á/É/Í/Ó/Ú y €")
+ap.add_argument("--batch-tickets", type=int, default=1,
+                help="Máx. comandas por documento/escritura a la impresora (1 = una por documento)")
+ap.add_argument("--batch-wait", type=float, default=2.0,
+                help="Segundos máximos que una comanda espera a que se complete su lote")
 ap.add_argument("--gui", action="store_true", help="Abre la interfaz gráfica de monitoreo/impr. de comandas")
-ap.add_argument("--auto-interval", type=int, default=30, help="Segundos entre ejecuciones automáticas (GUI)")
+ap.add_argument("--watch", action="store_true",
+                help="Queda corriendo e imprime en forma automática sin ventana (Ctrl+C para salir); con --gui arranca en automático")
+ap.add_argument("--auto-interval", type=int, default=30, help="Segundos entre ejecuciones automáticas (GUI y --watch)")
+ap.add_argument("--adaptive", action="store_true",
+                help="Intervalo automático adaptable (según actividad, demora de Odoo y horario; ver clave \"scheduler\")")
+ap.add_argument("--transport", choices=RPC_TRANSPORTS, default="xmlrpc",
+                help="Protocolo para las consultas a Odoo (jsonrpc: más liviano, admite gzip)")
+ap.add_argument("--rpc-pool-size", type=int, default=4, help="Conexiones XML-RPC persistentes hacia Odoo")
+ap.add_argument("--rpc-timeout", type=int, default=None,
+                help="Segundos máximos de espera por intento de cada llamada a Odoo (por defecto 30; la llamada entera, el doble)")
+ap.add_argument("--data-dir", type=str, default=None,
+                help="Carpeta del cursor y la bandeja local (por defecto, la del script)")
+ap.add_argument("--metrics-file", type=str, default=None,
+                help="Archivo JSON con tiempos por etapa (p50/p95/p99), reescrito en cada tick")
+ap.add_argument("--metrics-port", type=int, default=None,
+                help="Puerto local para /metrics (Prometheus) y /metrics.json")
+ap.add_argument("--full-scan-interval", type=int, default=300,
+                help="Segundos entre barridos completos de pendientes (0 = siempre completo)")
+ap.add_argument("--bus", action="store_true",
+                help="Modo automático por avisos del bus de Odoo (long-polling); sin bus vuelve a consultar cada intervalo")
+ap.add_argument("--bus-channel", type=str, default=DEFAULT_CHANNEL, help="Canal del bus donde Odoo avisa los cobros")
+ap.add_argument("--bus-url", type=str, default=None,
+                help="URL del long-polling si no es ODOO_URL (p. ej. el puerto 8072 de Odoo)")
+ap.add_argument("--station", type=str, default=None,
+                help="Nombre de este puesto: reserva las líneas antes de imprimir (varios puestos sin duplicar)")
 args = ap.parse_args()
 
 if not _argument_provided("--auto-interval"):
@@ -82,13 +157,71 @@ if not _argument_provided("--auto-interval"):
     if isinstance(cfg_interval, int) and cfg_interval > 0:
         args.auto_interval = cfg_interval
 
+if not _argument_provided("--transport"):
+    cfg_transport = CONFIG.get("transport")
+    if cfg_transport in RPC_TRANSPORTS:
+        args.transport = cfg_transport
+
+if not _argument_provided("--rpc-timeout"):
+    cfg_rpc_timeout = CONFIG.get("rpc_timeout")
+    if isinstance(cfg_rpc_timeout, int) and cfg_rpc_timeout > 0:
+        args.rpc_timeout = cfg_rpc_timeout
+
+if not _argument_provided("--codepage"):
+    cfg_codepage = CONFIG.get("codepage")
+    if cfg_codepage in CODEPAGES:
+        args.codepage = cfg_codepage
+
+if not _argument_provided("--archive-days"):
+    cfg_archive_days = CONFIG.get("archive_days")
+    if isinstance(cfg_archive_days, int) and cfg_archive_days >= 0:
+        args.archive_days = cfg_archive_days
+
+if not _argument_provided("--full-scan-interval"):
+    cfg_full_scan = CONFIG.get("full_scan_interval")
+    if isinstance(cfg_full_scan, int) and cfg_full_scan >= 0:
+        args.full_scan_interval = cfg_full_scan
+
+if not _argument_provided("--adaptive"):
+    cfg_adaptive = CONFIG.get("adaptive")
+    if isinstance(cfg_adaptive, bool):
+        args.adaptive = cfg_adaptive
+
+if not _argument_provided("--bus"):
+    cfg_bus = CONFIG.get("bus")
+    if isinstance(cfg_bus, bool):
+        args.bus = cfg_bus
+
+if not _argument_provided("--bus-channel"):
+    cfg_channel = CONFIG.get("bus_channel")
+    if isinstance(cfg_channel, str) and cfg_channel.strip():
+        args.bus_channel = cfg_channel.strip()
+
+if not _argument_provided("--bus-url"):
+    cfg_bus_url = CONFIG.get("bus_url")
+    if isinstance(cfg_bus_url, str) and cfg_bus_url.strip():
+        args.bus_url = cfg_bus_url.strip()
+
+if not _argument_provided("--metrics-file"):
+    cfg_metrics_file = CONFIG.get("metrics_file")
+    if isinstance(cfg_metrics_file, str) and cfg_metrics_file.strip():
+        args.metrics_file = cfg_metrics_file.strip()
+
+if not _argument_provided("--metrics-port"):
+    cfg_metrics_port = CONFIG.get("metrics_port")
+    if isinstance(cfg_metrics_port, int) and cfg_metrics_port > 0:
+        args.metrics_port = cfg_metrics_port
+
+if not _argument_provided("--station"):
+    cfg_station = CONFIG.get("station")
+    if isinstance(cfg_station, str) and cfg_station.strip():
+        args.station = cfg_station.strip()
+
 if not _argument_provided("--printer") and not args.printer:
     cfg_printer = CONFIG.get("printer")
     if isinstance(cfg_printer, str) and cfg_printer.strip():
         args.printer = cfg_printer.strip()
 
-SELECTED_PRINTER = args.printer or None
-
 # =========================
 # ENV
 # =========================
@@ -98,389 +231,176 @@ ODOO_DB = os.getenv("ODOO_DB")
 ODOO_USER = os.getenv("ODOO_USERNAME")
 ODOO_PWD = os.getenv("ODOO_PASSWORD")
 
-if args.gui and args.print_test:
-    print("La interfaz gráfica no está disponible con --print-test.")
+# Prueba de impresión y archivo de comandas: no necesitan Odoo.
+OFFLINE = args.print_test or args.search is not None or args.reprint is not None
+
+if (args.gui or args.watch) and OFFLINE:
+    print("La interfaz gráfica y --watch no están disponibles con --print-test, --search ni --reprint.")
     sys.exit(1)
 
-if not all([ODOO_URL, ODOO_DB, ODOO_USER, ODOO_PWD]) and not args.print_test:
+if not all([ODOO_URL, ODOO_DB, ODOO_USER, ODOO_PWD]) and not OFFLINE:
     print("Faltan variables en .env (ODOO_URL/DB/USERNAME/PASSWORD).")
     sys.exit(1)
 
 # =========================
-# Conexión Odoo (si hace falta)
+# Núcleo (cocina_core): la conexión a Odoo se abre en la primera llamada
 # =========================
-if not args.print_test:
-    common = xmlrpc.client.ServerProxy(f"{ODOO_URL}/xmlrpc/2/common")
-    uid = common.authenticate(ODOO_DB, ODOO_USER, ODOO_PWD, {})
-    if not uid:
-        print("No se pudo autenticar en Odoo. Verificá .env")
-        sys.exit(1)
-    models = xmlrpc.client.ServerProxy(f"{ODOO_URL}/xmlrpc/2/object")
-else:
-    uid = None
-    models = None
+DATA_DIR = Path(args.data_dir) if args.data_dir else Path(__file__).parent
+AUTO_PRINT_WAIT = 15  # segundos que el modo automático (y la GUI) espera a las impresoras antes de seguir
 
-# =========================
-# Utilidades de formato ticket
-# =========================
-RAW_ENCODING = "cp437"   # Si acentos salen mal, probá 'cp850'
-LINE_CHARS = 42          # Ancho típico de 80mm (42–48)
+# Tiempos por etapa: "rpc <modelo>.<método>", fetch_pending, build_ticket, escpos_text,
+# printer_write, mark_printed, tick y paid_to_printed (de date_order a impresa).
+METRICS = Metrics()
 
-def trunc_pad(s: str) -> str:
-    return s[:LINE_CHARS].ljust(LINE_CHARS)
+if not OFFLINE:
+    CLIENT = OdooClient(ODOO_URL, ODOO_DB, ODOO_USER, ODOO_PWD, transport=args.transport,
+                        pool_size=args.rpc_pool_size, uid_cache=DATA_DIR / SESSION_FILENAME, metrics=METRICS,
+                        rpc_timeout=args.rpc_timeout)
+else:
+    CLIENT = None
 
-def center(s: str) -> str:
-    s = s[:LINE_CHARS]
-    pad = max(0, (LINE_CHARS - len(s)) // 2)
-    return " " * pad + s
+KITCHEN = KitchenPrinter(
+    CLIENT, DATA_DIR, printer=args.printer or None, routes=load_routes(CONFIG), metrics=METRICS,
+    batch_tickets=args.batch_tickets, batch_wait=args.batch_wait,
+    full_scan_interval=args.full_scan_interval, metrics_file=args.metrics_file, station=args.station,
+    archive_days=args.archive_days, codepage=args.codepage,
+)
 
-def linea(ch="=") -> str:
-    return ch * LINE_CHARS
 
-def wrap_line(txt: str, indent=2):
-    res = []
-    for ln in textwrap.wrap(txt, width=LINE_CHARS - indent):
-        res.append((" " * indent) + ln)
-    return "\n".join(res)
-
-def format_header(order):
-    """
-    Encabezado: ticket, mesa/cliente, hora.
-    """
-    name = order.get('name') or ''
-    table = (order.get('table_id') or ['',''])[1] if order.get('table_id') else ''
-    partner = (order.get('partner_id') or ['',''])[1] if order.get('partner_id') else ''
-    dt_str = dt.datetime.now().strftime("%d/%m/%Y %H:%M")
-    h = []
-    h.append(center("COMANDA COCINA"))
-    h.append(center(dt_str))
-    h.append(linea("-"))
-    h.append(trunc_pad(f"Ticket: {name}"))
-    if table:
-        h.append(trunc_pad(f"Mesa: {table}"))
-    if partner:
-        h.append(trunc_pad(f"Cliente: {partner}"))
-    h.append(linea("="))
-    return "\n".join(h) + "\n"
-
-def build_ticket(order, lines):
-    """
-    Cuerpo del ticket a partir de líneas del pedido.
-    Cada ítem: QTY x DESCRIPCION
-               (nota)
-    """
-    out = []
-    out.append(format_header(order))
-    for l in lines:
-        qty = l.get('qty', 0)
-        name = l.get('display_name') or (l.get('product_id') or ['',''])[1]
-        base = f"{qty:g} x {name}"
-        out.append(trunc_pad(base))
-        note = (l.get('note') or "").strip()
-        if note:
-            out.append(wrap_line(f"({note})", indent=2))
-        out.append("")  # línea en blanco
-    out.append(linea("="))
-    out.append(center("FIN COMANDA"))
-    out.append("")
-    return "\n".join(out)
+def start_metrics_export():
+    if args.metrics_port:
+        try:
+            start_http_server(METRICS, args.metrics_port)
+        except OSError as exc:
+            print(f"Advertencia: no se pudo abrir el puerto de métricas {args.metrics_port}: {exc}")
 
 # =========================
-# Impresión Windows (RAW)  (reemplazar este bloque)
+# Modo automático (motor compartido por --watch y la GUI)
 # =========================
-def escpos_text(txt: str) -> bytes:
-    ESC = b'\x1b'
-    INIT = ESC + b'@'
-    LF = b'\n'
-    CUT = b'\x1d\x56\x01'      # podés probar \x00 si no corta
-    body = txt.replace('\r\n', '\n').replace('\r', '\n').encode(RAW_ENCODING, errors="ignore")
-    return INIT + body + LF*3 + CUT
-
-def _open_printer(printer_name: str):
-    import win32print
-    return win32print.OpenPrinter(printer_name)
-
-def _start_doc(handle, doc_name="Comanda Cocina", datatype="RAW"):
-    """
-    Compatibilidad: algunas versiones exigen tupla; otras aceptan dict.
-    Forzamos tupla y, si falla, probamos dict.
-    """
-    import win32print
-    try:
-        # ✅ Tupla (docname, outputfile, datatype)
-        return win32print.StartDocPrinter(handle, 1, (doc_name, None, datatype))
-    except TypeError:
-        # Fallback por si tu build acepta dict
-        doc_info = {"pDocName": doc_name, "pOutputFile": None, "pDatatype": datatype}
-        return win32print.StartDocPrinter(handle, 1, doc_info)
-
-def print_raw(printer_name: str, data: bytes):
-    import win32print
-    h = _open_printer(printer_name)
-    try:
-        _start_doc(h, "Comanda Cocina", "RAW")
-        win32print.StartPagePrinter(h)
-        win32print.WritePrinter(h, data)
-        win32print.EndPagePrinter(h)
-        win32print.EndDocPrinter(h)
-    finally:
-        win32print.ClosePrinter(h)
+WATCH_HEARTBEAT = 3600  # segundos entre líneas de estado de --watch (uptime, ticks, conexiones)
 
-def get_default_printer():
-    import win32print
-    try:
-        return win32print.GetDefaultPrinter()
-    except Exception:
+
+def make_bus_trigger(on_status=None):
+    """Escucha del bus (sin arrancar) si está habilitado con `--bus`; si no, None."""
+    if not args.bus:
         return None
+    client = BusClient(args.bus_url or ODOO_URL, ODOO_DB, ODOO_USER, ODOO_PWD, channels=[args.bus_channel])
+    return BusTrigger(client, on_status=on_status)
 
 
-def list_available_printers():
-    try:
-        import win32print
-    except ImportError:
-        return []
-
-    flags = win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
-    try:
-        printers = win32print.EnumPrinters(flags)
-    except Exception:
-        printers = []
-
-    names = []
-    for entry in printers:
-        if len(entry) >= 3:
-            name = entry[2]
-            if name and name not in names:
-                names.append(name)
-
-    default = get_default_printer()
-    if default:
-        names = [default] + [n for n in names if n != default]
-    return names
-
-
-def resolve_printer():
-    if SELECTED_PRINTER:
-        return SELECTED_PRINTER
-    if args.printer:
-        return args.printer
-    p = get_default_printer()
-    if not p:
-        raise RuntimeError("Windows no reporta impresora predeterminada. Indique --printer.")
-    return p
-
-def print_raw_selected(text: str, verbose=True):
-    p = resolve_printer()
-    if verbose:
-        print(f"[PRINT] Usando impresora: {p}")
-    print_raw(p, escpos_text(text))
-
-def print_test_page(msg="PRUEBA COCINA – EPSON TM-T20III"):
-    """
-    Test simple (sin Odoo). Envía texto plano RAW.
-    """
-    import win32print
-    p = resolve_printer()
-    h = _open_printer(p)
-    try:
-        _start_doc(h, "Test simple", "RAW")
-        win32print.StartPagePrinter(h)
-        win32print.WritePrinter(h, (msg + "\n\n").encode(RAW_ENCODING, errors="ignore"))
-        win32print.EndPagePrinter(h)
-        win32print.EndDocPrinter(h)
-    finally:
-        win32print.ClosePrinter(h)
+def make_scheduler(base_interval):
+    """Planificador adaptable (`--adaptive`, límites en la clave "scheduler" del config); si no, None."""
+    if not args.adaptive:
+        return None
+    return AdaptiveScheduler.from_config(CONFIG.get("scheduler"), base_interval=base_interval)
 
 
-# =========================
-# Odoo: fetch y marcado
-# =========================
-PENDING_ORDER_STATES = ['paid', 'done', 'invoiced']
+def auto_tick():
+    return KITCHEN.process_pending_orders(
+        pos_categ_id=args.pos_categ,
+        max_orders=args.max_orders,
+        dry_run=args.dry_run,
+        verbose=False,
+        print_wait=AUTO_PRINT_WAIT,
+        catch_up=True if args.catch_up else None,  # sin la opción: sólo si el tick anterior quedó atrasado
+    )
 
 
-def fetch_pending_lines(pos_categ_id=None, limit_orders=20):
+ENGINE = AutoEngine(
+    auto_tick,
+    lambda: max(1, int(args.auto_interval or 1)),
+    scheduler_factory=make_scheduler,
+    trigger_factory=make_bus_trigger,
+)
+
+
+def log(msg):
+    print(f"[{dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
+
+
+def describe_bus_status(available, error):
+    if available:
+        return "Bus de Odoo conectado: se imprime al recibir cada aviso."
+    return f"Bus de Odoo no disponible ({error}): se consulta por intervalo."
+
+
+def describe_rpc_event(event):
+    """Texto para el registro de un evento de cocina_rpc.RpcGuard (reintento o cambio del disyuntor)."""
+    if event['type'] == 'retry':
+        return (f"Odoo: reintento {event['attempt']} de {event['call']} en {event['delay']:.1f} s "
+                f"({event['error']}).")
+    state = event['state']
+    if state == 'open':
+        return (f"Odoo no responde ({event['error']}): llamadas suspendidas, "
+                f"se prueba de nuevo en {event['cooldown']:.0f} s.")
+    if state == 'half_open':
+        return "Odoo: probando si volvió a responder..."
+    return "Odoo responde de nuevo: llamadas reanudadas."
+
+
+def console_listener():
+    """Suscriptor de --watch: una línea por comanda/error y un resumen cada WATCH_HEARTBEAT."""
+    last_heartbeat = [time.monotonic()]
+
+    def on_event(event):
+        kind = event['type']
+        if kind == 'started':
+            log(f"Auto impresión iniciada ({event['mode']}).")
+        elif kind == 'stopped':
+            log("Auto impresión detenida.")
+        elif kind == 'bus':
+            log(describe_bus_status(event['available'], event['error']))
+        elif kind == 'error':
+            log(f"Error en automático: {event['error']}")
+        elif kind == 'tick':
+            result = event['result']
+            for payload in result['printed']:
+                log(f"Impreso pedido {payload['order'].get('name')} en {payload.get('printer') or 'impresora predeterminada'}.")
+            for err in result['errors']:
+                log(f"ERROR al imprimir pedido {err['order'].get('name')}: {err['error']}")
+            if result.get('mark_error'):
+                log(f"Marcado en Odoo pendiente ({result['marks_pending']} líneas): {result['mark_error']}")
+        if kind in ('tick', 'error') and event['reason_changed']:
+            log(event['status'])
+        if time.monotonic() - last_heartbeat[0] >= WATCH_HEARTBEAT:
+            last_heartbeat[0] = time.monotonic()
+            log(ENGINE.stats_line())
+            log(CLIENT.stats_line())
+
+    return on_event
+
+
+def run_watch():
     """
-    Devuelve dict {order_id: {'order': order_read, 'lines': [line_read,...]}}
-    Filtros: pedido state in PENDING_ORDER_STATES, x_impreso_cocina=False, qty>0.
+    Modo servicio: un solo proceso (una autenticación, conexiones persistentes) que
+    imprime en forma automática hasta recibir Ctrl+C, Ctrl+Break o SIGTERM. Al
+    pedir la parada termina el tick en curso (incluido el marcado en Odoo); un
+    segundo pedido corta en seco.
     """
-
-    domain_lines = [
-        ('x_impreso_cocina', '=', False),
-        ('qty', '>', 0),
-        ('order_id.state', 'in', PENDING_ORDER_STATES),
-    ]
-    if pos_categ_id:
-        domain_lines.append(('product_id.pos_categ_id', 'child_of', pos_categ_id))
-
-    line_ids = models.execute_kw(
-        ODOO_DB, uid, ODOO_PWD,
-        'pos.order.line', 'search',
-        [domain_lines], {'limit': 500}
-    )
-    if not line_ids:
-        return {}
-
-    fields_line = ['id', 'order_id', 'product_id', 'display_name', 'qty', 'note', 'x_impreso_cocina']
-    lines = models.execute_kw(
-        ODOO_DB, uid, ODOO_PWD,
-        'pos.order.line', 'read',
-        [line_ids], {'fields': fields_line}
-    )
-
-    # agrupar por pedido
-    orders_map = {}
-    for l in lines:
-        oid = l['order_id'][0]
-        orders_map.setdefault(oid, []).append(l)
-
-    order_ids = list(orders_map.keys())[:limit_orders]
-
-    fields_order = ['id', 'name', 'partner_id', 'table_id', 'date_order', 'amount_total', 'state']
-    orders = models.execute_kw(
-        ODOO_DB, uid, ODOO_PWD,
-        'pos.order', 'read', [order_ids], {'fields': fields_order}
-    )
-
-    out = {}
-    for o in orders:
-        out[o['id']] = {'order': o, 'lines': orders_map.get(o['id'], [])}
-    return out
-
-def fetch_recent_printed(pos_categ_id=None, limit_orders=20):
-    """Obtiene los pedidos del día (impresos o pendientes) ordenados por hora descendente."""
-    today_start = dt.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_start_str = today_start.strftime('%Y-%m-%d %H:%M:%S')
-
-    domain_lines = [
-        ('qty', '>', 0),
-        ('order_id.state', 'in', ['paid', 'done', 'invoiced']),
-        ('order_id.date_order', '>=', today_start_str),
-    ]
-    if pos_categ_id:
-        domain_lines.append(('product_id.pos_categ_id', 'child_of', pos_categ_id))
-
-    # Traemos suficientes líneas para cubrir el límite deseado de pedidos.
-    line_ids = models.execute_kw(
-        ODOO_DB, uid, ODOO_PWD,
-        'pos.order.line', 'search',
-        [domain_lines], {'limit': max(50, limit_orders * 10), 'order': 'write_date desc, id desc'}
-    )
-    if not line_ids:
-        return []
-
-    fields_line = [
-        'id', 'order_id', 'product_id', 'display_name', 'qty', 'note',
-        'x_impreso_cocina', 'write_date'
-    ]
-    lines = models.execute_kw(
-        ODOO_DB, uid, ODOO_PWD,
-        'pos.order.line', 'read',
-        [line_ids], {'fields': fields_line}
-    )
-
-    orders_map = {}
-    for line in lines:
-        oid = line['order_id'][0]
-        orders_map.setdefault(oid, []).append(line)
-
-    order_ids = list(orders_map.keys())
-    if not order_ids:
-        return []
-
-    fields_order = ['id', 'name', 'partner_id', 'table_id', 'date_order', 'amount_total', 'state']
-    orders = models.execute_kw(
-        ODOO_DB, uid, ODOO_PWD,
-        'pos.order', 'read', [order_ids], {'fields': fields_order}
-    )
-
-    orders_by_id = {order['id']: order for order in orders}
-    payloads = []
-    for oid, lines in orders_map.items():
-        order = orders_by_id.get(oid)
-        if not order:
-            continue
-        last_write = ''
-        all_printed = True
-        for line in lines:
-            write_date = line.get('write_date') or ''
-            if write_date > last_write:
-                last_write = write_date
-            if not line.get('x_impreso_cocina'):
-                all_printed = False
-        date_order = order.get('date_order') or ''
-        last_activity = max(last_write, date_order)
-        payloads.append({
-            'order': order,
-            'lines': lines,
-            'ticket_text': build_ticket(order, lines),
-            'printed': all_printed,
-            'last_write_date': last_write,
-            'last_activity': last_activity,
-        })
-
-    payloads.sort(key=lambda item: item.get('last_activity') or '', reverse=True)
-    if limit_orders:
-        payloads = payloads[:limit_orders]
-    return payloads
-
-def mark_printed(line_ids, error_msg=None):
-    vals = {'x_impreso_cocina': True}
+    stopping = []
+
+    def request_stop(signum, frame):
+        if stopping:
+            raise KeyboardInterrupt
+        stopping.append(signum)
+        log("Deteniendo: se termina el tick en curso...")
+        ENGINE.stop()
+
+    for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), request_stop)
+
+    ENGINE.subscribe(console_listener())
+    CLIENT.guard.subscribe(lambda event: log(describe_rpc_event(event)))
+    ENGINE.start()
     try:
-        now_str = dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-        vals['x_impreso_fecha'] = now_str  # si el campo existe
-    except Exception:
-        pass
-    return models.execute_kw(
-        ODOO_DB, uid, ODOO_PWD,
-        'pos.order.line', 'write',
-        [line_ids, vals]
-    )
-
-def process_pending_orders(pos_categ_id=None, max_orders=20, dry_run=False, verbose=True):
-    batches = fetch_pending_lines(pos_categ_id=pos_categ_id, limit_orders=max_orders)
-    if not batches:
-        if verbose:
-            print("No hay líneas pendientes para imprimir.")
-        return {'printed': [], 'errors': []}
-
-    printed_payloads = []
-    errors = []
-    for oid, payload in batches.items():
-        order = payload['order']
-        lines = payload['lines']
-        txt = build_ticket(order, lines)
-
-        if verbose:
-            print(f"\n=== Pedido {order.get('name')} (ID {oid}) ===")
-            print(txt)
-
-        if dry_run:
-            if verbose:
-                print("DRY-RUN: no se imprime ni se marca.")
-        else:
-            try:
-                print_raw_selected(txt, verbose=verbose)
-                mark_printed([l['id'] for l in lines])
-                if verbose:
-                    print("OK: Impreso y marcado.")
-            except Exception as exc:
-                if verbose:
-                    print(f"ERROR al imprimir pedido {order.get('name')}: {exc}")
-                errors.append({
-                    'order': order,
-                    'lines': lines,
-                    'ticket_text': txt,
-                    'error': exc,
-                })
-                continue
-
-        printed_payloads.append({
-            'order': order,
-            'lines': lines,
-            'ticket_text': txt,
-        })
-
-    return {'printed': printed_payloads, 'errors': errors}
+        # time.sleep se interrumpe con Ctrl+C también en Windows (Event.wait no).
+        while ENGINE.running:
+            time.sleep(0.5)
+    finally:
+        ENGINE.stop(timeout=AUTO_PRINT_WAIT + 5)
+        KITCHEN.close()
+        log(ENGINE.stats_line())
 
 # =========================
 # GUI
@@ -490,10 +410,106 @@ if args.gui:
         import threading
         import tkinter as tk
         from tkinter import ttk, messagebox
+        from cocina_print import list_available_printers
+        from cocina_rpc import CircuitOpenError
     except Exception as gui_err:
         print(f"No se pudo iniciar la interfaz gráfica: {gui_err}")
         sys.exit(1)
 
+    LOG_MAX_LINES = 2000
+    TREE_CHUNK = 250  # filas de la lista por vuelta del bucle de Tk al aplicar un refresco
+    ARCHIVE_SEARCH_DELAY = 250  # ms sin teclear antes de buscar en el archivo
+
+    class ArchiveWindow(tk.Toplevel):
+        """
+        Búsqueda en el archivo local de comandas impresas (cocina_archive): filtra
+        mientras se escribe y reimprime con los bytes originales, sin ir a Odoo.
+        """
+
+        def __init__(self, master):
+            super().__init__(master)
+            self.title("Comandas impresas (archivo)")
+            self.geometry("820x520")
+            self.entries = {}
+            self._search_job = None
+
+            top = ttk.Frame(self, padding=10)
+            top.pack(fill=tk.X)
+            ttk.Label(top, text="Buscar (pedido, mesa o cliente):").pack(side=tk.LEFT)
+            self.query_var = tk.StringVar()
+            query = ttk.Entry(top, textvariable=self.query_var, width=40)
+            query.pack(side=tk.LEFT, padx=5)
+            query.focus_set()
+            self.query_var.trace_add("write", lambda *_: self._schedule_search())
+            ttk.Button(top, text="Reimprimir", command=self.reprint_selected).pack(side=tk.LEFT, padx=(10, 0))
+
+            columns = ("ticket", "mesa", "cliente", "impresa", "impresora")
+            self.tree = ttk.Treeview(self, columns=columns, show="headings", height=10)
+            for column, title, width in (("ticket", "Ticket", 140), ("mesa", "Mesa", 110), ("cliente", "Cliente", 170),
+                                         ("impresa", "Impresa", 150), ("impresora", "Impresora", 180)):
+                self.tree.heading(column, text=title)
+                self.tree.column(column, width=width)
+            self.tree.pack(fill=tk.BOTH, expand=True, padx=10)
+            self.tree.bind("<<TreeviewSelect>>", self.on_select)
+            self.tree.bind("<Double-1>", lambda event: self.reprint_selected())
+
+            self.detail_text = tk.Text(self, wrap=tk.WORD, height=10, state=tk.DISABLED)
+            self.detail_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+            self.status_var = tk.StringVar(value="")
+            ttk.Label(self, textvariable=self.status_var, padding=(10, 0, 10, 5)).pack(fill=tk.X)
+            self.search()
+
+        def _schedule_search(self):
+            if self._search_job is not None:
+                self.after_cancel(self._search_job)
+            self._search_job = self.after(ARCHIVE_SEARCH_DELAY, self.search)
+
+        def search(self):
+            self._search_job = None
+            started = time.perf_counter()
+            try:
+                hits = KITCHEN.search_archive(self.query_var.get())
+            except Exception as exc:
+                self.status_var.set(f"Error al buscar: {exc}")
+                return
+            self.entries = {str(entry['ticket_id']): entry for entry in hits}
+            self.tree.delete(*self.tree.get_children())
+            for iid, entry in self.entries.items():
+                self.tree.insert('', tk.END, iid=iid, values=(
+                    entry['order_name'], entry['table'], entry['partner'], entry['printed_at'],
+                    entry['printer'] or "Predeterminada"))
+            self.status_var.set(f"{len(hits)} tickets en {(time.perf_counter() - started) * 1000:.0f} ms")
+            if hits:
+                self.tree.selection_set(self.tree.get_children()[0])
+
+        def _selected(self):
+            selection = self.tree.selection()
+            return self.entries.get(selection[0]) if selection else None
+
+        def on_select(self, event=None):
+            entry = self._selected()
+            self.detail_text.configure(state=tk.NORMAL)
+            self.detail_text.delete('1.0', tk.END)
+            if entry is not None:
+                self.detail_text.insert(tk.END, plain_text(entry['ticket_text']))
+            self.detail_text.configure(state=tk.DISABLED)
+
+        def reprint_selected(self):
+            entry = self._selected()
+            if entry is None:
+                messagebox.showinfo("Reimprimir", "Seleccione un ticket del archivo.", parent=self)
+                return
+            master = self.master
+
+            def job():
+                try:
+                    KITCHEN.reprint_archived(entry['ticket_id'], verbose=False)
+                    master.after(0, lambda: master.append_log(
+                        f"Reimpresa comanda {entry['order_name']} del archivo ({entry['printed_at']})"))
+                except Exception as exc:
+                    master.after(0, lambda: messagebox.showerror("Error al reimprimir", str(exc)))
+            threading.Thread(target=job, daemon=True).start()
+
     class KitchenPrinterGUI(tk.Tk):
         def __init__(self):
             super().__init__()
@@ -514,15 +530,24 @@ if args.gui:
             self.printer_var.set(initial_printer)
             self._update_selected_printer(initial_printer)
 
-            self.auto_thread = None
-            self.auto_stop = threading.Event()
-            self.printed_orders = []
+            self.printed_orders = {}   # id de pedido -> payload de fetch_recent_printed
+            self._tree_rows = {}       # iid (id de pedido) -> valores mostrados
+            self._tree_job = None      # tanda pendiente de _apply_tree_rows
+            self._refresh_seq = 0
+            self._detail_shown = ''
+            self._archive_window = None
 
             self._build_layout()
             self.protocol("WM_DELETE_WINDOW", self.on_close)
             self.persist_settings()
             self.refresh_printed_orders()
 
+            # La GUI no tiene bucle propio: se suscribe al motor automático (ENGINE).
+            ENGINE.subscribe(self._on_engine_event)
+            CLIENT.guard.subscribe(self._on_rpc_event)
+            if args.watch:
+                self.after(0, ENGINE.start)
+
         # ----- UI construction -----
         def _build_layout(self):
             main = ttk.Frame(self, padding=10)
@@ -543,20 +568,24 @@ if args.gui:
             interval_spin.pack(side=tk.LEFT, padx=(5, 15))
 
             ttk.Label(controls, text="Impresora:").pack(side=tk.LEFT)
-            combo_state = "readonly" if self.printer_list else "normal"
+            # Editable: además de las impresoras de Windows se puede escribir tcp://IP o file:ruta.
             self.printer_combo = ttk.Combobox(
                 controls,
                 values=self.printer_list,
                 textvariable=self.printer_var,
-                state=combo_state,
+                state="normal",
                 width=40,
             )
             self.printer_combo.pack(side=tk.LEFT, padx=(5, 15))
             self.printer_combo.bind("<<ComboboxSelected>>", self.on_printer_selected)
+            self.printer_combo.bind("<Return>", self.on_printer_selected)
+            self.printer_combo.bind("<FocusOut>", self.on_printer_selected)
 
             ttk.Button(controls, text="Imprimir pendientes", command=self.print_pending_orders).pack(side=tk.LEFT)
             ttk.Button(controls, text="Reimprimir selección", command=self.reprint_selected).pack(side=tk.LEFT, padx=5)
             ttk.Button(controls, text="Refrescar", command=self.refresh_printed_orders).pack(side=tk.LEFT)
+            if KITCHEN.archive_days:
+                ttk.Button(controls, text="Archivo...", command=self.open_archive).pack(side=tk.LEFT, padx=5)
             self.auto_btn = ttk.Button(controls, text="Iniciar automático", command=self.toggle_auto)
             self.auto_btn.pack(side=tk.LEFT, padx=(15, 0))
 
@@ -600,13 +629,13 @@ if args.gui:
 
             self.status_var = tk.StringVar(value="Listo")
             ttk.Label(main, textvariable=self.status_var).pack(fill=tk.X)
+            self.metrics_var = tk.StringVar(value="")
+            ttk.Label(main, textvariable=self.metrics_var).pack(fill=tk.X)
 
         # ----- Helpers -----
         def _update_selected_printer(self, name):
-            global SELECTED_PRINTER
             cleaned = (name or "").strip()
-            SELECTED_PRINTER = cleaned or None
-            args.printer = SELECTED_PRINTER
+            KITCHEN.printer = args.printer = cleaned or None
 
         def on_printer_selected(self, event=None):
             self._update_selected_printer(self.printer_var.get())
@@ -616,15 +645,28 @@ if args.gui:
             ts = dt.datetime.now().strftime("%H:%M:%S")
             self.log_text.configure(state=tk.NORMAL)
             self.log_text.insert(tk.END, f"[{ts}] {msg}\n")
+            # Tope de líneas: la ventana puede quedar abierta días.
+            excess = int(self.log_text.index('end-1c').split('.')[0]) - LOG_MAX_LINES
+            if excess > 0:
+                self.log_text.delete('1.0', f"{excess + 1}.0")
             self.log_text.see(tk.END)
             self.log_text.configure(state=tk.DISABLED)
 
         def set_status(self, msg):
             self.status_var.set(msg)
 
+        def show_tick_metrics(self, result):
+            queues = result.get('queues') or {}
+            self.metrics_var.set(
+                f"Último tick: {result.get('tick_seconds', 0) * 1000:.0f} ms · "
+                f"sin imprimir en bandeja: {result.get('backlog', 0)} "
+                f"(por armar {queues.get('to_render', 0)}, por imprimir {queues.get('to_print', 0)}) · "
+                f"marcado pendiente: {result.get('marks_pending', 0)} líneas"
+            )
+
         def persist_settings(self):
             global CONFIG
-            CONFIG['auto_interval'] = self._safe_interval()
+            CONFIG['auto_interval'] = args.auto_interval = self._safe_interval()
             printer_name = (self.printer_var.get() or "").strip()
             if printer_name:
                 CONFIG['printer'] = printer_name
@@ -646,64 +688,129 @@ if args.gui:
 
         # ----- Data handling -----
         def refresh_printed_orders(self):
+            self._refresh_seq += 1
+            seq = self._refresh_seq
+
             def job():
                 try:
-                    data = fetch_recent_printed(pos_categ_id=args.pos_categ, limit_orders=args.max_orders)
-                    self.after(0, lambda: self._load_printed_orders(data))
+                    data = KITCHEN.fetch_recent_printed(pos_categ_id=args.pos_categ, limit_orders=args.max_orders)
+
+                    def load():
+                        # Si mientras tanto se pidió otro refresco, esta respuesta ya es vieja.
+                        if seq == self._refresh_seq:
+                            self._load_printed_orders(data)
+                    self.after(0, load)
                 except Exception as exc:
                     self.after(0, lambda: messagebox.showerror("Error al refrescar", str(exc)))
                     self.after(0, lambda: self.set_status("Error al refrescar"))
             self.set_status("Actualizando comandas...")
             self._run_async(job)
 
-        def _load_printed_orders(self, orders):
-            self.tree.delete(*self.tree.get_children())
-            self.printed_orders = orders
-            for idx, payload in enumerate(orders):
-                order = payload['order']
-                table = (order.get('table_id') or ['', ''])
-                partner = (order.get('partner_id') or ['', ''])
-                mesa = table[1] if len(table) > 1 else ''
-                cliente = partner[1] if len(partner) > 1 else ''
-                fecha = payload.get('last_activity') or order.get('date_order') or ''
-                estado = "Impresa" if payload.get('printed') else "Pendiente"
-                self.tree.insert('', tk.END, iid=str(idx), values=(order.get('name'), mesa, cliente, fecha, estado))
-            self.set_status(f"Comandas del día: {len(orders)}")
-            if orders:
-                self.tree.selection_set('0')
+        def show_store_orders(self):
+            """Rearma la lista desde el store compartido (lo recién impreso ya está ahí), sin ir a Odoo."""
+            data = KITCHEN.recent_orders(pos_categ_id=args.pos_categ, limit_orders=args.max_orders)
+            if data is None:
+                self.refresh_printed_orders()
+                return
+            self._refresh_seq += 1  # una lectura de Odoo en curso ya no es más nueva que esto
+            self._load_printed_orders(data)
+
+        @staticmethod
+        def _row_values(payload):
+            order = payload['order']
+            table = (order.get('table_id') or ['', ''])
+            partner = (order.get('partner_id') or ['', ''])
+            mesa = table[1] if len(table) > 1 else ''
+            cliente = partner[1] if len(partner) > 1 else ''
+            fecha = payload.get('last_activity') or order.get('date_order') or ''
+            estado = "Impresa" if payload.get('printed') else "Pendiente"
+            return (order.get('name'), mesa, cliente, fecha, estado)
 
-        def on_tree_select(self, event=None):
+        def _load_printed_orders(self, orders):
+            """
+            Actualiza la lista con un diff por id de pedido: borra las filas que ya no
+            están, modifica las que cambiaron, inserta las nuevas y reordena sólo si
+            hace falta. La selección se conserva. Los cambios se aplican de a
+            TREE_CHUNK filas por vuelta del bucle de Tk para no congelar la ventana.
+            """
+            if self._tree_job is not None:
+                self.after_cancel(self._tree_job)
+                self._tree_job = None
+            self.printed_orders = {payload['order']['id']: payload for payload in orders}
+            wanted = [(str(oid), self._row_values(payload)) for oid, payload in self.printed_orders.items()]
+            wanted_ids = {iid for iid, _ in wanted}
+            gone = [iid for iid in self._tree_rows if iid not in wanted_ids]
+            if gone:
+                self.tree.delete(*gone)
+                for iid in gone:
+                    del self._tree_rows[iid]
+            # Si las filas que quedan ya están en el orden pedido, las nuevas se insertan
+            # en su lugar y no hace falta mover ninguna.
+            kept = [iid for iid, _ in wanted if iid in self._tree_rows]
+            reorder = kept != list(self.tree.get_children())
+            self._apply_tree_rows(iter(enumerate(wanted)), reorder)
+
+        def _apply_tree_rows(self, pending, reorder):
+            for _ in range(TREE_CHUNK):
+                item = next(pending, None)
+                if item is None:
+                    self._tree_job = None
+                    self._tree_rows_applied()
+                    return
+                index, (iid, values) = item
+                current = self._tree_rows.get(iid)
+                if current is None:
+                    position = tk.END if index >= len(self._tree_rows) else index
+                    self.tree.insert('', position, iid=iid, values=values)
+                else:
+                    if current != values:
+                        self.tree.item(iid, values=values)
+                    if reorder:
+                        self.tree.move(iid, '', index)
+                self._tree_rows[iid] = values
+            self._tree_job = self.after(1, lambda: self._apply_tree_rows(pending, reorder))
+
+        def _tree_rows_applied(self):
+            self.set_status(f"Comandas del día: {len(self.printed_orders)}")
+            if self.tree.selection():
+                self.on_tree_select()  # el pedido seleccionado pudo cambiar (p. ej. ya impreso)
+            elif self._tree_rows:
+                self.tree.selection_set(self.tree.get_children()[0])
+
+        def _selected_payload(self):
             selection = self.tree.selection()
             if not selection:
-                self.detail_text.configure(state=tk.NORMAL)
-                self.detail_text.delete('1.0', tk.END)
-                self.detail_text.configure(state=tk.DISABLED)
-                return
+                return None
             try:
-                idx = int(selection[0])
+                return self.printed_orders.get(int(selection[0]))
             except (TypeError, ValueError):
-                return
-            payload = self.printed_orders[idx]
+                return None
+
+        def on_tree_select(self, event=None):
+            payload = self._selected_payload()
+            text = payload.get('ticket_text', '') if payload is not None else ''
+            if text == self._detail_shown:
+                return  # mismo ticket: no se redibuja (ni se pierde el scroll)
+            self._detail_shown = text
             self.detail_text.configure(state=tk.NORMAL)
             self.detail_text.delete('1.0', tk.END)
-            self.detail_text.insert(tk.END, payload.get('ticket_text', ''))
+            if text:
+                self.detail_text.insert(tk.END, plain_text(text))
             self.detail_text.configure(state=tk.DISABLED)
 
         def print_pending_orders(self):
             def job():
                 try:
-                    result = process_pending_orders(
-                        pos_categ_id=args.pos_categ,
-                        max_orders=args.max_orders,
-                        dry_run=args.dry_run,
-                        verbose=False,
-                    )
+                    result = ENGINE.run_once()
                     def update_ui():
+                        self.show_tick_metrics(result)
                         printed = result['printed']
                         errors = result['errors']
+                        if result.get('mark_error'):
+                            self.append_log(f"Marcado en Odoo pendiente ({result['marks_pending']} líneas): {result['mark_error']}")
                         if printed:
                             self.append_log(f"Impresas {len(printed)} comandas nuevas.")
-                            self.refresh_printed_orders()
+                            self.show_store_orders()
                         else:
                             self.append_log("No había comandas pendientes.")
                         if errors:
@@ -722,84 +829,94 @@ if args.gui:
             self._run_async(job)
 
         def reprint_selected(self):
-            selection = self.tree.selection()
-            if not selection:
-                messagebox.showinfo("Reimprimir", "Seleccione una comanda de la lista.")
-                return
-            try:
-                idx = int(selection[0])
-            except (TypeError, ValueError):
+            payload = self._selected_payload()
+            if payload is None:
                 messagebox.showinfo("Reimprimir", "Seleccione una comanda de la lista.")
                 return
-            payload = self.printed_orders[idx]
             if not payload.get('printed'):
                 messagebox.showinfo("Reimprimir", "Solo se pueden reimprimir comandas ya impresas.")
                 return
             txt = payload.get('ticket_text')
             def job():
                 try:
-                    print_raw_selected(txt, verbose=False)
+                    KITCHEN.print_raw_selected(txt, verbose=False)
                     self.after(0, lambda: self.append_log(f"Reimpresa comanda {payload['order'].get('name')}"))
                 except Exception as exc:
                     self.after(0, lambda: messagebox.showerror("Error al reimprimir", str(exc)))
             self._run_async(job)
 
+        def open_archive(self):
+            if self._archive_window is not None and self._archive_window.winfo_exists():
+                self._archive_window.lift()
+                self._archive_window.search()  # puede haber tickets nuevos
+                return
+            self._archive_window = ArchiveWindow(self)
+
         def toggle_auto(self):
-            if self.auto_thread and self.auto_thread.is_alive():
-                self.auto_stop.set()
-                thread = self.auto_thread
-                thread.join(timeout=2)
-                self.auto_thread = None
+            if ENGINE.running:
+                ENGINE.stop()
+                self.auto_btn.configure(text="Deteniendo...")
+                return
+            if not ENGINE.start():
+                self.append_log("El automático todavía está terminando el tick anterior.")
+
+        def _on_engine_event(self, event):
+            # Llega desde el hilo del motor: se atiende en el hilo de Tk.
+            self.after(0, lambda: self._handle_engine_event(event))
+
+        def _on_rpc_event(self, event):
+            # Reintentos y disyuntor de cocina_rpc: llegan desde cualquier hilo que llame a Odoo.
+            self.after(0, lambda: self.append_log(describe_rpc_event(event)))
+
+        def _handle_engine_event(self, event):
+            kind = event['type']
+            if kind == 'started':
+                self.auto_btn.configure(text="Detener automático")
+                self.append_log(f"Auto impresión iniciada ({event['mode']}).")
+                self.set_status("Ejecución automática")
+            elif kind == 'stopped':
                 self.auto_btn.configure(text="Iniciar automático")
                 self.append_log("Auto impresión detenida.")
+                self.append_log(ENGINE.stats_line())
+                self.append_log(CLIENT.stats_line())
                 self.set_status("Listo")
-                return
-
-            self.auto_stop.clear()
-
-            def loop():
-                while not self.auto_stop.is_set():
-                    self.after(0, lambda: self.set_status("Ejecución automática"))
-                    try:
-                        result = process_pending_orders(
-                            pos_categ_id=args.pos_categ,
-                            max_orders=args.max_orders,
-                            dry_run=args.dry_run,
-                            verbose=False,
-                        )
-                        printed = result['printed']
-                        errors = result['errors']
-                        if printed:
-                            self.after(0, lambda: self.append_log(f"Automático: impresas {len(printed)} comandas."))
-                            self.after(0, self.refresh_printed_orders)
-                        else:
-                            self.after(0, lambda: self.append_log("Automático: sin comandas pendientes."))
-                        if errors:
-                            self.after(0, lambda: self.append_log(f"Automático: {len(errors)} errores de impresión."))
-                            self.after(0, lambda: messagebox.showwarning(
-                                "Errores de impresión",
-                                "Revise el registro de eventos para ver los errores de impresión."
-                            ))
-                    except Exception as exc:
-                        self.after(0, lambda: self.append_log(f"Error en automático: {exc}"))
-                        self.after(0, lambda: messagebox.showerror("Auto impresión", str(exc)))
-                    wait_seconds = self._safe_interval()
-                    for _ in range(wait_seconds):
-                        if self.auto_stop.wait(1):
-                            break
-                self.after(0, lambda: self.set_status("Listo"))
-
-            self.auto_thread = threading.Thread(target=loop, daemon=True)
-            self.auto_thread.start()
-            self.auto_btn.configure(text="Detener automático")
-            self.append_log("Auto impresión iniciada.")
+            elif kind == 'bus':
+                self.append_log(describe_bus_status(event['available'], event['error']))
+            elif kind == 'error':
+                self.append_log(f"Error en automático: {event['error']}")
+                if not isinstance(event['error'], CircuitOpenError):  # ya avisado al abrirse el disyuntor
+                    messagebox.showerror("Auto impresión", str(event['error']))
+            elif kind == 'tick':
+                result = event['result']
+                self.show_tick_metrics(result)
+                printed = result['printed']
+                errors = result['errors']
+                if result.get('mark_error'):
+                    self.append_log(
+                        f"Automático: marcado en Odoo pendiente ({result['marks_pending']} líneas): {result['mark_error']}"
+                    )
+                if printed:
+                    self.append_log(f"Automático: impresas {len(printed)} comandas.")
+                    self.show_store_orders()
+                else:
+                    self.append_log("Automático: sin comandas pendientes.")
+                if errors:
+                    self.append_log(f"Automático: {len(errors)} errores de impresión.")
+                    messagebox.showwarning(
+                        "Errores de impresión",
+                        "Revise el registro de eventos para ver los errores de impresión."
+                    )
+            if kind in ('tick', 'error'):
+                if event['reason_changed']:
+                    self.append_log(f"Automático: {event['status']}")
+                self.set_status(f"Automático: {event['status']}")
 
         def destroy(self):
             self.persist_settings()
-            if self.auto_thread and self.auto_thread.is_alive():
-                self.auto_stop.set()
-                self.auto_thread.join(timeout=2)
-            self.auto_thread = None
+            ENGINE.unsubscribe(self._on_engine_event)
+            CLIENT.guard.unsubscribe(self._on_rpc_event)
+            ENGINE.stop(timeout=2)
+            KITCHEN.close()
             super().destroy()
 
         def on_close(self):
@@ -808,24 +925,67 @@ if args.gui:
 # =========================
 # Main
 # =========================
+def describe_archived(entry):
+    place = " · ".join(part for part in (entry['table'], entry['partner']) if part)
+    return (f"{entry['ticket_id']:>7}  {entry['printed_at']}  {entry['order_name']}"
+            + (f"  ({place})" if place else "")
+            + f"  -> {entry['printer'] or 'impresora predeterminada'}")
+
+
+def run_archive():
+    """--search / --reprint: archivo local de comandas impresas, sin consultar Odoo."""
+    if KITCHEN.archive is None:
+        print("El archivo de comandas está desactivado (--archive-days 0).")
+        return
+    try:
+        if args.search is not None:
+            started = time.perf_counter()
+            hits = KITCHEN.search_archive(args.search)
+            for entry in hits:
+                print(describe_archived(entry))
+            print(f"{len(hits)} tickets en {(time.perf_counter() - started) * 1000:.1f} ms.")
+        if args.reprint is not None:
+            # Por defecto, la impresora donde salió (no la guardada en el config).
+            printer = args.printer if _argument_provided("--printer") else None
+            entry = KITCHEN.reprint_archived(args.reprint, printer=printer)
+            print(f"OK: Reimpreso {entry['order_name']} (impreso originalmente {entry['printed_at']}).")
+    except Exception as e:
+        print(f"ERROR en el archivo de comandas: {e}")
+
+
 def main():
     # Test de impresión sin Odoo
     if args.print_test:
-        print_test_page()
+        KITCHEN.print_test_page()
         print("OK: Página de prueba enviada.")
         return
+    if args.search is not None or args.reprint is not None:
+        run_archive()
+        return
 
     try:
-        process_pending_orders(
+        if args.retry_dead_marks:
+            requeued = KITCHEN.retry_dead_marks()
+            print(f"{requeued} líneas de mark_dead vuelven al diario de marcado.")
+            return
+        if args.watch:
+            run_watch()
+            return
+        KITCHEN.process_pending_orders(
             pos_categ_id=args.pos_categ,
             max_orders=args.max_orders,
             dry_run=args.dry_run,
             verbose=True,
+            catch_up=args.catch_up,
         )
     except Exception as e:
         print(f"ERROR al imprimir: {e}")
+    finally:
+        if CLIENT is not None:
+            print(CLIENT.stats_line())
 
 if __name__ == "__main__":
+    start_metrics_export()
     try:
         if args.gui:
             app = KitchenPrinterGUI()
@@ -834,3 +994,7 @@ if __name__ == "__main__":
             main()
     except KeyboardInterrupt:
         print("\nCancelado por el usuario.")
+    finally:
+        # Espera a los hilos de impresión y marcado, escribe las marcas pendientes en Odoo
+        # y cierra bandeja y archivo (SQLite) y sockets de impresora.
+        KITCHEN.close()
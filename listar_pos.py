@@ -1,16 +1,17 @@
 # listar_pos.py
-import os, xmlrpc.client, datetime as dt
+import os, datetime as dt
 from dotenv import load_dotenv
+from cocina_core import OdooClient
+from cocina_odoo import FetchEngine
 load_dotenv()
 
 URL=os.getenv("ODOO_URL"); DB=os.getenv("ODOO_DB"); USR=os.getenv("ODOO_USERNAME"); PWD=os.getenv("ODOO_PASSWORD")
 
-common = xmlrpc.client.ServerProxy(f"{URL}/xmlrpc/2/common")
-uid = common.authenticate(DB, USR, PWD, {})
-models = xmlrpc.client.ServerProxy(f"{URL}/xmlrpc/2/object")
+client = OdooClient(URL, DB, USR, PWD, pool_size=1)  # autentica en la primera llamada
+engine = FetchEngine(client.execute)
 
-# ¿existe el booleano x_impreso_cocina?
-fields = models.execute_kw(DB, uid, PWD, 'pos.order.line', 'fields_get', [[], ['type']])
+# ¿existe el booleano x_impreso_cocina? (sólo pedimos ese campo, no todo el modelo)
+fields = engine.call('pos.order.line', 'fields_get', [['x_impreso_cocina']], {'attributes': ['type']})
 has_flag = 'x_impreso_cocina' in fields
 
 # últimos pedidos pagados (hoy)
@@ -22,24 +23,21 @@ domain = [('qty','>',0),
 if has_flag:
     domain.insert(0, ('x_impreso_cocina','=',False))
 
-line_ids = models.execute_kw(DB, uid, PWD, 'pos.order.line', 'search', [domain], {'limit': 200})
-print("x_impreso_cocina existe?:", has_flag, "| Líneas encontradas:", len(line_ids))
+res = engine.fetch_lines_with_orders(
+    domain,
+    ['id','order_id','product_id','display_name','qty','note'] + (['x_impreso_cocina'] if has_flag else []),
+    ['name','state','date_order','partner_id','table_id'],
+    limit=200,
+)
+print("x_impreso_cocina existe?:", has_flag, "| Líneas encontradas:", len(res.lines),
+      "| Llamadas a Odoo:", engine.total_round_trips)
 
-if not line_ids:
+if not res:
     print("No hay líneas que cumplan el dominio.")
     raise SystemExit
 
-lines = models.execute_kw(DB, uid, PWD, 'pos.order.line', 'read', [line_ids],
-                          {'fields':['id','order_id','product_id','display_name','qty','note'] + (['x_impreso_cocina'] if has_flag else [])})
-
-# agrupar por pedido
-by_order = {}
-for l in lines:
-    oid = l['order_id'][0]
-    by_order.setdefault(oid, []).append(l)
-
-orders = models.execute_kw(DB, uid, PWD, 'pos.order', 'read', [list(by_order)], {'fields':['name','state','date_order','partner_id','table_id']})
-omap = {o['id']:o for o in orders}
+by_order = res.lines_by_order
+omap = res.orders_by_id
 
 for oid, lst in by_order.items():
     o = omap[oid]
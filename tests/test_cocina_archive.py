@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Archivo de comandas: búsqueda por prefijo de palabra en pedido, mesa y cliente."""
+
+from cocina_archive import TicketArchive
+
+
+def _entry(oid, table=None, partner=None, printed_at='2026-10-17 12:00:00'):
+    order = {'id': oid, 'name': f"Loren Burger/{oid:05d}",
+             'table_id': [oid, table] if table else False, 'partner_id': [oid, partner] if partner else False}
+    return {'order': order, 'lines': [{'id': oid * 10}], 'ticket_text': f"ticket {oid}",
+            'escpos': f"ESC {oid}".encode(), 'printed_at': printed_at}
+
+
+def _orders(hits):
+    return [hit['order_id'] for hit in hits]
+
+
+def test_search_matches_word_prefixes_newest_first(tmp_path):
+    archive = TicketArchive(tmp_path / "archive.db")
+    archive.add_many([
+        _entry(42, table="Mesa 5", partner="Ana García"),
+        _entry(43, table="Mesa 12"),
+        _entry(44, table="Mesa 1", partner="Juan Garcés", printed_at='2026-10-17 13:00:00'),
+        _entry(420, partner="Pedro Gómez"),
+    ])
+    try:
+        assert _orders(archive.search("mesa 1")) == [44, 43]        # "1" también es prefijo de "12"
+        assert _orders(archive.search("MESA 5")) == [42]            # sin distinguir mayúsculas
+        assert _orders(archive.search("garc")) == [44, 42]
+        assert _orders(archive.search("garcía")) == [42]
+        assert _orders(archive.search("garc mesa 5")) == [42]       # todas las palabras
+        assert _orders(archive.search("00042")) == [42]             # "0042" no es prefijo de "00420"
+        assert _orders(archive.search("0004")) == [44, 43, 42]
+        assert archive.search("rodríguez") == []
+        assert _orders(archive.search("")) == [420, 44, 43, 42]     # sin texto: los últimos
+        assert _orders(archive.search("", limit=2)) == [420, 44]
+        assert _orders(archive.search("mesa", since='2026-10-17 12:30:00')) == [44]
+        assert _orders(archive.search("mesa", until='2026-10-17 12:30:00')) == [43, 42]
+
+        [hit] = archive.search("ana")
+        assert 'escpos' not in hit and hit['table'] == "Mesa 5"
+        assert archive.get(hit['ticket_id'])['escpos'] == b"ESC 42"
+    finally:
+        archive.close()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""BusTrigger contra el bus de mentira de fake_odoo (HTTP local)."""
+
+import socket
+import threading
+import time
+
+import pytest
+
+from cocina_bus import BusClient, BusTrigger, BusUnavailable
+from fake_odoo import start_server
+
+
+def _client(url):
+    return BusClient(url, "db", "cocina", "secreto", timeout=5)
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _Statuses:
+    def __init__(self):
+        self.changes = []
+
+    def __call__(self, available, error):
+        self.changes.append((available, error))
+
+
+@pytest.fixture
+def server():
+    srv = start_server(poll_timeout=0.5)
+    yield srv
+    srv.shutdown()
+
+
+def test_notification_wakes_the_engine(server):
+    trigger = BusTrigger(_client(server.url)).start()
+    try:
+        assert _wait_until(lambda: trigger.available)
+        threading.Timer(0.1, server.bus.send, ("cocina_pos", "pos.order/state", {"id": 7})).start()
+
+        started = time.monotonic()
+        assert trigger.wait(30, fallback_timeout=30) == 'bus'
+        assert time.monotonic() - started < 5
+        assert trigger.notifications == 1
+        assert trigger.client.last >= 1
+    finally:
+        trigger.stop()
+
+
+def test_bus_404_falls_back_to_interval_polling(server):
+    server.bus_path = "/sin/longpolling"   # Odoo sin el módulo bus / proxy que no lo deja pasar
+    statuses = _Statuses()
+    trigger = BusTrigger(_client(server.url), retry_interval=30, on_status=statuses).start()
+    try:
+        assert _wait_until(lambda: trigger.available is False)
+        available, error = statuses.changes[0]
+        assert available is False
+        assert isinstance(error, BusUnavailable) and "404" in str(error)
+
+        started = time.monotonic()
+        assert trigger.wait(30, fallback_timeout=0.2) == 'timeout'
+        assert time.monotonic() - started < 2   # usa el intervalo de respaldo, no el del bus
+    finally:
+        trigger.stop()
+
+
+def test_connection_refused_falls_back_to_interval_polling():
+    trigger = BusTrigger(_client(f"http://127.0.0.1:{_free_port()}"), retry_interval=30).start()
+    try:
+        assert _wait_until(lambda: trigger.available is False)
+        assert isinstance(trigger.last_error, ConnectionRefusedError)
+
+        started = time.monotonic()
+        assert trigger.wait(30, fallback_timeout=0.2) == 'timeout'
+        assert time.monotonic() - started < 2
+    finally:
+        trigger.stop()
+
+
+def test_reconnects_with_backoff(server):
+    bus_path = server.bus_path
+    server.bus_path = "/caido"
+    client = _client(server.url)
+    attempts = []
+    poll = client.poll
+
+    def counted_poll():
+        attempts.append(time.monotonic())
+        return poll()
+
+    client.poll = counted_poll
+    statuses = _Statuses()
+    trigger = BusTrigger(client, retry_interval=0.05, max_retry_interval=0.2, on_status=statuses).start()
+    try:
+        assert _wait_until(lambda: len(attempts) >= 5)
+        gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+        assert gaps[0] >= 0.04
+        assert gaps[1] >= 0.09            # la espera se duplica...
+        assert max(gaps[:4]) < 0.2 + 0.15  # ...hasta max_retry_interval
+
+        server.bus_path = bus_path        # el bus vuelve
+        assert _wait_until(lambda: trigger.available)
+        assert [s[0] for s in statuses.changes] == [False, True]
+
+        server.bus.send("cocina_pos", "pos.order/state", {"id": 1})
+        assert trigger.wait(30, fallback_timeout=30) == 'bus'
+    finally:
+        trigger.stop()
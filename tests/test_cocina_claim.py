@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Reservas de líneas entre puestos: la bandeja suelta sólo lo ajeno y lo perdido se vuelve a pedir."""
+
+import datetime as dt
+import time
+
+import pytest
+
+from cocina_core import SESSION_FILENAME, KitchenPrinter, OdooClient
+from cocina_spool import PrintSpool
+from fake_odoo import FakeOdooDB, start_server
+
+
+def _lines(order, *ids):
+    return [{'id': lid, 'order_id': [order['id'], order['name']], 'display_name': f"Producto {lid}", 'qty': 1.0}
+            for lid in ids]
+
+
+def test_drain_releases_only_lost_lines_and_prints_the_rest(tmp_path):
+    spool = PrintSpool(tmp_path / "spool.db", lambda ids, printed_at=None: None)
+    o1, o2 = {'id': 1, 'name': "P1"}, {'id': 2, 'name': "P2"}
+    spool.add_job(o1, _lines(o1, 1, 2))
+    spool.add_job(o2, _lines(o2, 3, 4))
+    render = lambda order, lines: f"{order['name']}:" + ",".join(str(l['id']) for l in lines)
+
+    def printer_down(batch):
+        raise OSError("impresora sin papel")
+
+    first = spool.drain(render, printer_down)
+    assert len(first['errors']) == 2 and not first['printed']
+
+    # Mientras tanto venció la reserva de la línea 1 y la tomó otro puesto.
+    sent = []
+    result = spool.drain(render, lambda batch: sent.extend(txt for _, txt in batch), max_tickets=10,
+                         owned_fn=lambda ids: set(ids) - {1})
+
+    assert [[l['id'] for l in r['lines']] for r in result['released']] == [[1]]
+    assert sent == ["P1:2", "P2:3,4"]   # el resto del pedido 1 sale en este mismo drain, rearmado
+    assert [[l['id'] for l in p['lines']] for p in result['printed']] == [[2], [3, 4]]
+    assert not result['errors']
+    assert not spool.is_spooled(1)      # otro fetch puede volver a traerla
+    assert all(spool.is_spooled(lid) for lid in (2, 3, 4))
+    assert spool.unfinished_jobs() == []
+    spool.close()
+
+
+def test_drain_releases_whole_job_when_every_line_was_lost(tmp_path):
+    spool = PrintSpool(tmp_path / "spool.db", lambda ids, printed_at=None: None)
+    order = {'id': 1, 'name': "P1"}
+    spool.add_job(order, _lines(order, 1, 2))
+
+    result = spool.drain(lambda o, l: "x", lambda batch: pytest.fail("no debería imprimir"),
+                         owned_fn=lambda ids: set())
+
+    assert [[l['id'] for l in r['lines']] for r in result['released']] == [[1, 2]]
+    assert spool.counts()['released'] == 1
+    assert not spool.is_spooled(1) and not spool.is_spooled(2)
+    spool.close()
+
+
+@pytest.fixture
+def odoo(tmp_path):
+    """Odoo de mentira por HTTP y un cliente cuyo `on_claim(line_ids)` corre justo después de reservar."""
+    db = FakeOdooDB()
+    server = start_server(db=db)
+    client = OdooClient(server.url, "db", "cocina", "secreto", uid_cache=tmp_path / SESSION_FILENAME)
+    execute = client.execute
+    client.on_claim = None
+
+    def execute_with_hook(model, method, rpc_args, rpc_kwargs=None):
+        result = execute(model, method, rpc_args, rpc_kwargs)
+        if method == 'write' and 'x_cocina_claim' in rpc_args[1] and client.on_claim is not None:
+            hook, client.on_claim = client.on_claim, None
+            hook(rpc_args[0])
+        return result
+
+    client.execute = execute_with_hook
+    yield db, client
+    server.shutdown()
+
+
+def _printed_lines(result):
+    return sorted(l['id'] for p in result['printed'] for l in p['lines'])
+
+
+def test_line_lost_to_another_station_is_refetched_after_claim_expires(tmp_path, odoo):
+    db, client = odoo
+    db.add_order(n_lines=2)
+    kitchen = KitchenPrinter(client, tmp_path, printer="null:", station="a", batch_wait=0)
+    kitchen.claimer.ttl = 1
+    kitchen.claimer.settle = 0
+    table = db.tables['pos.order.line']
+    try:
+        # El puesto "b" pisa la reserva de la línea 1 entre el write y la relectura de "a".
+        now = dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        client.on_claim = lambda ids: db.execute_kw(
+            'pos.order.line', 'write', [[1], {'x_cocina_claim': 'b', 'x_cocina_claim_at': now}])
+        lost_at = time.monotonic()
+        assert _printed_lines(kitchen.process_pending_orders(verbose=False)) == [2]
+        assert kitchen.claimer.lost == 1
+
+        # Llegan pedidos nuevos: el cursor incremental pasa por delante de la línea 1.
+        db.add_order(n_lines=1)
+        assert _printed_lines(kitchen.process_pending_orders(verbose=False)) == [3]
+        assert not kitchen.cursor.needs_full_scan()
+
+        # "b" se cayó sin imprimir: su reserva vence sin que la línea vuelva a cambiar.
+        table[1]['x_cocina_claim_at'] = '2000-01-01 00:00:00'
+        time.sleep(max(0, lost_at + kitchen.claimer.ttl + 0.1 - time.monotonic()))
+        result = kitchen.process_pending_orders(verbose=False)
+
+        assert _printed_lines(result) == [1]      # sin esperar al barrido completo
+        assert table[1]['x_cocina_claim'] == 'a' and table[1]['x_impreso_cocina']
+        assert kitchen.claimer.due() == []
+    finally:
+        kitchen.close()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""cocina_core se importa sin efectos: ni sqlite3 ni cocina_rpc/xmlrpc hasta que hacen falta."""
+
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_import_defers_sqlite_and_rpc():
+    code = (
+        "import sys, cocina_core\n"
+        "print(','.join(m for m in ('sqlite3', 'xmlrpc.client', 'cocina_rpc', 'cocina_spool', 'cocina_archive',"
+        " 'tkinter', 'win32print') if m in sys.modules))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "cocina_archive"   # sólo sus constantes; sqlite3 llega al abrir el archivo
+
+
+def test_close_waits_for_the_drain_and_flushes_marks(tmp_path):
+    import threading
+    import time
+
+    from cocina_core import SESSION_FILENAME, SPOOL_FILENAME, KitchenPrinter, OdooClient
+    from cocina_spool import PrintSpool
+    from fake_odoo import FakeOdooDB, start_server
+
+    db = FakeOdooDB()
+    order_id = db.add_order(n_lines=2)
+    server = start_server(db=db)
+    try:
+        client = OdooClient(server.url, "db", "cocina", "secreto", uid_cache=tmp_path / SESSION_FILENAME)
+        kitchen = KitchenPrinter(client, tmp_path, printer="null:", batch_wait=0)
+        sending = threading.Event()
+        send_jobs = kitchen._send_jobs
+
+        def slow_send(batch, printer):
+            sending.set()
+            time.sleep(0.5)   # impresora lenta: el cierre llega en pleno envío
+            send_jobs(batch, printer)
+
+        kitchen._send_jobs = slow_send
+        order = {'id': order_id, 'name': f"Pedido {order_id}", 'date_order': '2026-10-17 12:00:00'}
+        lines = [{'id': lid, 'order_id': [order_id, order['name']], 'display_name': f"Producto {lid}", 'qty': 1.0}
+                 for lid in (1, 2)]
+        kitchen.spool.add_job(order, lines)
+        kitchen.workers.wake([None])
+        assert sending.wait(5)
+        kitchen.close()
+
+        assert all(db.tables['pos.order.line'][lid]['x_impreso_cocina'] for lid in (1, 2))
+        spool = PrintSpool(tmp_path / SPOOL_FILENAME, lambda ids, printed_at=None: None)
+        try:
+            assert spool.counts().get('acked') == 1 and spool.unfinished_jobs() == []
+        finally:
+            spool.close()
+    finally:
+        server.shutdown()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""EscPosEncoder: `ESC t n` de cada página y reemplazo de lo que la página no tiene."""
+
+import pytest
+
+from cocina_escpos import CUT, FEED_LINES, EscPosEncoder, get_encoder, plain_text
+
+
+@pytest.mark.parametrize("codepage, n", [('cp437', 0), ('cp850', 2), ('cp1252', 16), ('cp858', 19)])
+def test_ticket_starts_with_init_and_codepage_selection(codepage, n):
+    data = get_encoder(codepage).encode("hola")
+    assert data.startswith(b"\x1b@\x1bt" + bytes([n]) + b"hola")
+    assert data.endswith(b"\n" * FEED_LINES + CUT)
+    assert not get_encoder(codepage).encode("hola", cut=False).endswith(CUT)
+
+
+def test_characters_missing_from_the_codepage_are_transliterated():
+    cp437 = EscPosEncoder('cp437')
+    assert cp437.text_bytes("Ñandú, pingüino") == "Ñandú, pingüino".encode('cp437')   # los tiene: sin tocar
+    assert cp437.text_bytes("ÁÉÍÓÚ") == "AÉIOU".encode('cp437')                  # cp437 sólo tiene la É
+    assert cp437.text_bytes("“ok” – 1¾ €") == b'"ok" - 13/4 EUR'
+    assert cp437.text_bytes("Hamburguesa 🍔") == b"Hamburguesa ?"                    # nunca se pierde en silencio
+
+    cp858 = EscPosEncoder('cp858')
+    assert cp858.text_bytes("Á €") == "Á €".encode('cp858')                           # cp858 sí tiene Á y €
+    assert cp437.text_bytes("€") == b"EUR"                                            # la tabla compartida no se pisa
+
+
+def test_styles_and_line_endings():
+    data = get_encoder('cp437').encode("<h>COMANDA</h>\r\n<b>Mesa 5</b>", cut=False)
+    assert data[5:] == b"\x1d!\x01COMANDA\x1d!\x00\n\x1bE\x01Mesa 5\x1bE\x00"
+    assert plain_text("<h>COMANDA</h>\n<b>Mesa 5</b>") == "COMANDA\nMesa 5"
+
+
+def test_unknown_codepage_is_rejected():
+    with pytest.raises(ValueError):
+        EscPosEncoder('utf-8')
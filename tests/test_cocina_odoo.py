@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Lecturas de Odoo (FetchEngine) e índice de categorías TPV contra el Odoo de mentira en memoria."""
+
+import threading
+
+from cocina_core import SESSION_FILENAME, KitchenPrinter, OdooClient
+from cocina_odoo import PENDING_LINE_FIELDS, TICKET_ORDER_FIELDS, CategoryResolver, FetchEngine
+from fake_odoo import FakeOdooDB, start_server
+
+
+def test_category_change_on_template_reaches_the_index():
+    db = FakeOdooDB()
+    resolver = CategoryResolver(db.execute_kw)
+    db.execute_kw('product.product', 'write', [[2], {'name': "Hamburguesa Doble"}])  # la marca avanza
+    resolver.refresh(force=True)
+    assert resolver.category_of(1) == 11  # Hamburguesa Clásica: Parrilla
+
+    # Se cambia la categoría desde la ficha: el write_date de la variante no se mueve.
+    before = db.tables['product.product'][1]['write_date']
+    db.set_product_category(1, 12)
+    assert db.tables['product.product'][1]['write_date'] == before
+
+    resolver.refresh(force=True)
+
+    assert resolver.category_of(1) == 12
+    assert 1 in resolver.products_in(10) and 1 in resolver.products_in(12)
+    assert 1 not in resolver.products_in(11)
+    domain, _ = resolver.line_domain(11)
+    assert 1 not in domain[1][2]
+
+
+def test_incremental_refresh_also_reads_templates():
+    db = FakeOdooDB()
+    resolver = CategoryResolver(db.execute_kw)
+    resolver.refresh(force=True)
+    resolver.refresh(force=True)   # la marca queda en lo último leído
+    db.set_product_category(3, 13)
+
+    read = []
+    resolver._execute = lambda model, method, args, kwargs: read.append(model) or db.execute_kw(model, method, args, kwargs)
+    resolver.refresh(force=True)
+
+    assert read == ['pos.category', 'product.product', 'product.template']
+    assert resolver.category_of(3) == 13
+
+
+def test_last_round_trips_is_per_thread():
+    db = FakeOdooDB.generate(6, lines_per_order=2)
+    engine = FetchEngine(db.execute_kw)
+    first_done, second_done = threading.Event(), threading.Event()
+    seen = {}
+
+    def with_orders():   # search_read de líneas + read de pedidos: 2 llamadas
+        engine.fetch_lines_with_orders([('qty', '>', 0)], PENDING_LINE_FIELDS, TICKET_ORDER_FIELDS)
+        first_done.set()
+        second_done.wait(5)   # otro hilo consulta en el medio
+        seen['with_orders'] = engine.last_round_trips
+
+    def names_only():    # los nombres vienen en order_id: 1 llamada
+        first_done.wait(5)
+        engine.fetch_lines_with_orders([('qty', '>', 0)], PENDING_LINE_FIELDS, ['id', 'name'])
+        seen['names_only'] = engine.last_round_trips
+        second_done.set()
+
+    threads = [threading.Thread(target=with_orders), threading.Thread(target=names_only)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert seen == {'with_orders': 2, 'names_only': 1}
+    assert engine.last_round_trips == 0   # este hilo no consultó nada
+    assert engine.total_round_trips == 3
+
+
+def test_iter_order_pages_walks_by_order_id_without_offset():
+    db = FakeOdooDB.generate(7, lines_per_order=2)
+    order_queries = []
+
+    def execute(model, method, args, kwargs):
+        if model == 'pos.order':
+            order_queries.append((args[0][-1], kwargs))
+        return db.execute_kw(model, method, args, kwargs)
+
+    engine = FetchEngine(execute)
+    pages = []
+    for res in engine.iter_order_pages([('qty', '>', 0)], PENDING_LINE_FIELDS, TICKET_ORDER_FIELDS, page_orders=3):
+        pages.append(sorted(res.orders_by_id))
+        assert all(len(res.lines_by_order[oid]) == len(db._order_lines[oid]) for oid in res.orders_by_id)
+        if len(pages) == 1:
+            db.add_order(n_lines=1)   # llega un pedido a mitad del recorrido
+
+    assert pages == [[1, 2, 3], [4, 5, 6], [7, 8]]   # nada repetido y el nuevo entra al final
+    assert [q[0] for q in order_queries] == [('id', '>', 0), ('id', '>', 3), ('id', '>', 6)]
+    assert all('offset' not in q[1] for q in order_queries)
+    assert engine.last_round_trips == 6
+
+
+def test_cursor_only_advances_when_the_page_walk_completes(tmp_path):
+    db = FakeOdooDB.generate(5, lines_per_order=1)
+    server = start_server(db=db)
+    try:
+        client = OdooClient(server.url, "db", "cocina", "secreto", uid_cache=tmp_path / SESSION_FILENAME)
+        kitchen = KitchenPrinter(client, tmp_path, printer="null:")
+        cursor = kitchen.cursor
+
+        pages = kitchen.iter_pending_pages(page_orders=2, cursor=cursor)
+        assert sorted(next(pages)) == [1, 2]
+        pages.close()             # se corta (p. ej. la impresora no da abasto)
+        cursor.commit()
+        assert cursor.write_date is None and cursor.needs_full_scan()
+
+        walked = [sorted(page) for page in kitchen.iter_pending_pages(page_orders=2, cursor=cursor)]
+        cursor.commit()
+        assert walked == [[1, 2], [3, 4], [5]]
+        assert cursor.write_date and not cursor.needs_full_scan()
+        kitchen.close()
+    finally:
+        server.shutdown()
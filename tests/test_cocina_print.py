@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Backends de impresión contra una impresora de mentira (servidor TCP local)."""
+
+import os
+import socket
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import cocina_print
+from cocina_print import (
+    BatchWriteError, FileBackend, PartialWriteError, SocketBackend, create_backend, write_batch,
+)
+
+
+class FakePrinter:
+    """Servidor TCP que guarda lo recibido por cada conexión (como una impresora en el 9100)."""
+
+    def __init__(self):
+        self._server = socket.socket()
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+        self.received = []   # un bytearray por conexión aceptada
+        self._conns = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            buf = bytearray()
+            with self._lock:
+                self._conns.append(conn)
+                self.received.append(buf)
+            threading.Thread(target=self._read, args=(conn, buf), daemon=True).start()
+
+    def _read(self, conn, buf):
+        while True:
+            try:
+                chunk = conn.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            with self._lock:
+                buf.extend(chunk)
+
+    def wait_for(self, total, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if sum(len(b) for b in self.received) >= total:
+                    return
+            time.sleep(0.01)
+        raise AssertionError(f"la impresora no recibió {total} bytes")
+
+    def drop(self):
+        """Corta las conexiones abiertas (como una impresora que se reinicia)."""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+
+    def close(self):
+        self.drop()
+        self._server.close()
+
+
+@pytest.fixture
+def printer():
+    fake = FakePrinter()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def backend(printer):
+    b = SocketBackend("127.0.0.1", printer.port, timeout=2.0)
+    yield b
+    b.close()
+
+
+def test_socket_reuses_connection_between_jobs(printer, backend):
+    backend.write(b"ticket 1\n")
+    backend.write(b"ticket 2\n")
+    backend.write(b"ticket 3\n")
+    printer.wait_for(27)
+
+    assert backend.connects == 1
+    assert backend.jobs == 3
+    assert [bytes(b) for b in printer.received] == [b"ticket 1\nticket 2\nticket 3\n"]
+
+
+def test_socket_reconnects_after_printer_drops_connection(printer, backend):
+    backend.write(b"antes")
+    printer.wait_for(5)
+    printer.drop()
+    time.sleep(0.05)  # que llegue el FIN antes del próximo trabajo
+
+    backend.write(b"despues")
+    printer.wait_for(12)
+
+    assert backend.connects == 2
+    assert [bytes(b) for b in printer.received] == [b"antes", b"despues"]
+
+
+class _BrokenSocket:
+    """Acepta `accept` bytes y después falla, como una conexión que se corta a mitad."""
+
+    def __init__(self, accept):
+        self.accept = accept
+        self.closed = False
+
+    def send(self, view):
+        if not self.accept:
+            raise ConnectionResetError("reset por la impresora")
+        n = min(self.accept, len(view))
+        self.accept -= n
+        return n
+
+    def close(self):
+        self.closed = True
+
+
+def test_socket_partial_write_raises_partial_write_error(backend, monkeypatch):
+    broken = _BrokenSocket(accept=4)
+    monkeypatch.setattr(backend, "_connect", lambda: broken)
+
+    with pytest.raises(PartialWriteError) as info:
+        backend.write(b"0123456789")
+
+    assert info.value.written == 4
+    assert isinstance(info.value.cause, ConnectionResetError)
+    assert broken.closed and backend._sock is None  # no se reintenta: duplicaría lo ya impreso
+    assert backend.jobs == 0
+
+
+def test_write_batch_counts_tickets_delivered_before_cut(backend, monkeypatch):
+    monkeypatch.setattr(backend, "_connect", lambda: _BrokenSocket(accept=7))
+
+    with pytest.raises(BatchWriteError) as info:
+        write_batch(backend, [b"aaa", b"bbb", b"ccc"])
+
+    assert (info.value.delivered, info.value.total) == (2, 3)
+
+
+def test_file_backend_writes_exact_bytes(tmp_path):
+    path = tmp_path / "comandas.bin"
+    data = [b"\x1b@hola\n\x1dV\x00", bytes(range(256))]
+    backend = create_backend(f"file:{path}")
+    assert isinstance(backend, FileBackend)
+
+    for chunk in data:
+        backend.write(chunk)
+    backend.close()
+
+    assert path.read_bytes() == b"".join(data)
+    assert backend.jobs == 2
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="sin pipes con nombre")
+def test_file_backend_writes_exact_bytes_to_pipe(tmp_path):
+    fifo = tmp_path / "comandas.fifo"
+    os.mkfifo(fifo)
+    got = bytearray()
+
+    def reader():
+        with open(fifo, "rb") as fh:
+            got.extend(fh.read())
+
+    t = threading.Thread(target=reader)
+    t.start()
+    backend = FileBackend(str(fifo))
+    backend.write(b"\x1b@comanda 1\n")
+    backend.write(b"\x1b@comanda 2\n")
+    backend.close()
+    t.join(5)
+
+    assert bytes(got) == b"\x1b@comanda 1\n\x1b@comanda 2\n"
+
+
+def test_win32_partial_write_still_closes_document(monkeypatch):
+    calls = []
+    fake = types.SimpleNamespace(
+        OpenPrinter=lambda name: calls.append("open") or "h",
+        StartDocPrinter=lambda h, level, info: calls.append("start_doc"),
+        StartPagePrinter=lambda h: calls.append("start_page"),
+        WritePrinter=lambda h, data: calls.append("write") or 3,
+        EndPagePrinter=lambda h: calls.append("end_page"),
+        EndDocPrinter=lambda h: calls.append("end_doc"),
+        ClosePrinter=lambda h: calls.append("close"),
+    )
+    monkeypatch.setitem(sys.modules, "win32print", fake)
+
+    with pytest.raises(PartialWriteError):
+        cocina_print.print_raw("EPSON", b"0123456789")
+
+    assert calls == ["open", "start_doc", "start_page", "write", "end_page", "end_doc", "close"]
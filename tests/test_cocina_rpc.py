@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""RpcGuard: disyuntor abierto -> semiabierto -> cerrado, y las escrituras no se reintentan."""
+
+import time
+import xmlrpc.client
+
+import pytest
+
+from cocina_core import OdooClient
+from cocina_rpc import CircuitOpenError, RpcGuard
+from fake_odoo import FakeOdooDB, start_server
+
+
+def _down(timeout):
+    raise ConnectionRefusedError("Odoo caído")
+
+
+def test_breaker_opens_probes_once_and_closes():
+    guard = RpcGuard(threshold=2, cooldown=0.05, max_cooldown=1, retries=0)
+    events = []
+    guard.subscribe(lambda ev: events.append((ev['type'], ev.get('state'))))
+
+    for _ in range(2):
+        with pytest.raises(ConnectionRefusedError):
+            guard.call(_down, 'pos.order.read', idempotent=True)
+    assert guard.state == 'open' and guard.trips == 1
+
+    with pytest.raises(CircuitOpenError):
+        guard.call(lambda timeout: pytest.fail("con el disyuntor abierto no se llama"))
+    assert guard.rejected == 1
+
+    # Pasado el cooldown pasa una sola prueba; si falla se vuelve a abrir con el doble de espera.
+    time.sleep(0.06)
+    with pytest.raises(ConnectionRefusedError):
+        guard.call(_down, 'pos.order.read', idempotent=True)
+    assert guard.state == 'open' and guard.cooldown == pytest.approx(0.1)
+
+    time.sleep(0.11)
+    others = []
+
+    def probe(timeout):
+        # Mientras la prueba está en curso, las demás llamadas no pasan.
+        with pytest.raises(CircuitOpenError):
+            guard.call(lambda t: others.append(t))
+        return "ok"
+
+    assert guard.call(probe, 'pos.order.read') == "ok"
+    assert others == []
+    assert guard.state == 'closed' and guard.cooldown == 0.05
+    assert events == [('breaker', 'open'), ('breaker', 'half_open'), ('breaker', 'open'),
+                      ('breaker', 'half_open'), ('breaker', 'closed')]
+
+
+def test_fault_from_odoo_does_not_count_as_a_failure():
+    guard = RpcGuard(threshold=1)
+
+    def denied(timeout):
+        raise xmlrpc.client.Fault(3, "AccessDenied")
+
+    with pytest.raises(xmlrpc.client.Fault):
+        guard.call(denied, 'pos.order.line.write')
+    assert guard.state == 'closed' and guard.failures == 0
+
+
+def test_reads_are_retried_but_writes_are_not():
+    db = FakeOdooDB()
+    db.add_order(n_lines=1)
+    server = start_server(db=db, latency=0.3)   # cada execute_kw tarda más que el timeout del cliente
+    try:
+        client = OdooClient(server.url, "db", "cocina", "secreto", rpc_timeout=0.1)
+        guard = client.guard
+        guard.deadline, guard.backoff = 5, 0.01
+
+        with pytest.raises(OSError):
+            client.execute('pos.order', 'search_read', [[]], {'fields': ['name']})
+        with pytest.raises(OSError):
+            client.execute('pos.order.line', 'write', [[1], {'x_impreso_cocina': True}])
+        time.sleep(0.5)   # el servidor termina lo que ya había recibido
+
+        assert db.calls[('pos.order', 'search_read')] == 1 + guard.retries
+        assert db.calls[('pos.order.line', 'write')] == 1   # pudo haber llegado: no se repite
+        assert guard.retried == guard.retries
+    finally:
+        server.shutdown()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Intervalo adaptable: una impresora caída estira la espera en vez de dejar a Odoo al ritmo máximo."""
+
+from cocina_engine import AutoEngine
+from cocina_scheduler import AdaptiveScheduler
+
+
+def _engine():
+    engine = AutoEngine(lambda: {}, lambda: 5)
+    engine.scheduler = AdaptiveScheduler(base_interval=5, min_interval=2, max_interval=60)
+    return engine
+
+
+def test_print_errors_back_off_instead_of_counting_as_work():
+    engine = _engine()
+    offline = {'printed': [], 'fetched': 0, 'errors': [{'order': {}, 'lines': [], 'error': OSError("sin conexión")}]}
+
+    intervals = [engine._next_interval(offline, None)[0] for _ in range(6)]
+
+    assert intervals == [10, 20, 40, 60, 60, 60]
+    assert "impresora" in engine.scheduler.reason
+
+
+def test_new_orders_or_printed_tickets_reset_to_the_minimum():
+    engine = _engine()
+    failing = {'error': OSError("sin conexión")}
+    engine._next_interval({'printed': [], 'fetched': 0, 'errors': [failing]}, None)
+
+    assert engine._next_interval({'printed': [], 'fetched': 3, 'errors': [failing]}, None)[0] == 2
+    engine._next_interval({'printed': [], 'fetched': 0, 'errors': [failing]}, None)
+    assert engine._next_interval({'printed': [{}], 'fetched': 0, 'errors': []}, None)[0] == 2
+    assert engine._next_interval({'printed': [], 'fetched': 0, 'errors': []}, None)[0] == 3   # vacío: x1.5
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Bandeja local: drain por lotes contra la impresora y diario de marcado (MarkQueue),
+con un write por hora de impresión y líneas rechazadas aisladas.
+"""
+
+import xmlrpc.client
+
+import pytest
+
+from cocina_print import BatchWriteError
+from cocina_spool import MarkQueue, PrintSpool
+
+
+class _Odoo:
+    """write_fn de prueba: anota cada write y rechaza las líneas de `faulty` como Odoo."""
+
+    def __init__(self, faulty=(), down=False):
+        self.faulty = set(faulty)
+        self.down = down
+        self.writes = []
+        self.marked = {}
+
+    def __call__(self, line_ids, printed_at):
+        if self.down:
+            raise ConnectionRefusedError("Odoo caído")
+        if self.faulty & set(line_ids):
+            raise xmlrpc.client.Fault(2, "Record does not exist or has been deleted.")
+        self.writes.append((list(line_ids), printed_at))
+        self.marked.update((lid, printed_at) for lid in line_ids)
+
+
+def test_flush_writes_each_line_with_its_own_print_time(tmp_path):
+    odoo = _Odoo()
+    marks = MarkQueue(tmp_path / "marks.db", odoo)
+    marks.enqueue(1, [10, 11], printed_at="2026-10-17 12:00:00")
+    marks.enqueue(2, [20], printed_at="2026-10-17 12:00:07")
+    marks.enqueue(3, [30], printed_at="2026-10-17 12:00:00")
+
+    assert marks.flush() == 4
+
+    assert odoo.writes == [([10, 11, 30], "2026-10-17 12:00:00"), ([20], "2026-10-17 12:00:07")]
+    assert marks.pending_count() == 0
+
+
+def test_faulty_line_is_isolated_then_dead_lettered(tmp_path, capsys):
+    odoo = _Odoo(faulty={11})
+    acked = []
+    marks = MarkQueue(tmp_path / "marks.db", odoo, on_flushed=acked.extend, max_attempts=3)
+    marks.enqueue(1, [10, 11, 12], printed_at="2026-10-17 12:00:00")
+
+    assert marks.flush() == 2      # las demás del lote no quedan trabadas
+    assert sorted(odoo.marked) == [10, 12]
+    assert marks.pending_count() == 1 and marks.is_journaled(11)
+
+    marks.flush()
+    assert marks.dead_letters() == []
+    marks.flush()                  # tercera vez: pasa a mark_dead
+
+    assert marks.pending_count() == 0
+    assert marks.is_journaled(11)  # impresa: no se vuelve a imprimir
+    [dead] = marks.dead_letters()
+    assert (dead['line_id'], dead['order_id'], dead['printed_at']) == (11, 1, "2026-10-17 12:00:00")
+    assert "does not exist" in dead['error']
+    assert sorted(acked) == [10, 11, 12]
+    assert "línea 11" in capsys.readouterr().out
+
+    reopened = MarkQueue(tmp_path / "marks.db", odoo)
+    assert reopened.is_journaled(11) and reopened.pending_count() == 0
+
+
+def test_connection_error_keeps_the_whole_journal(tmp_path):
+    odoo = _Odoo(down=True)
+    marks = MarkQueue(tmp_path / "marks.db", odoo, max_attempts=1)
+    marks.enqueue(1, [10, 11], printed_at="2026-10-17 12:00:00")
+
+    with pytest.raises(ConnectionRefusedError):
+        marks.flush()
+
+    assert marks.pending_count() == 2 and marks.dead_letters() == []
+    odoo.down = False
+    assert marks.flush() == 2
+
+
+def test_systemic_fault_keeps_the_journal_without_counting_attempts(tmp_path):
+    calls = []
+
+    def denied(line_ids, printed_at):
+        calls.append(list(line_ids))
+        raise xmlrpc.client.Fault(3, "AccessDenied")
+
+    marks = MarkQueue(tmp_path / "marks.db", denied, max_attempts=3)
+    marks.enqueue(1, range(100, 150), printed_at="2026-10-17 12:00:00")
+    marks.enqueue(2, [200], printed_at="2026-10-17 12:00:05")
+
+    for _ in range(5):
+        with pytest.raises(xmlrpc.client.Fault):
+            marks.flush()
+
+    assert marks.pending_count() == 51 and marks.dead_letters() == []
+    assert marks.dead == 0 and marks.failures == 5
+    attempts = marks._conn.execute("SELECT MAX(attempts) FROM mark_journal").fetchone()[0]
+    assert attempts == 0
+
+
+def test_requeue_dead_puts_lines_back_in_the_journal(tmp_path):
+    odoo = _Odoo(faulty={11})
+    marks = MarkQueue(tmp_path / "marks.db", odoo, max_attempts=1)
+    marks.enqueue(1, [10, 11], printed_at="2026-10-17 12:00:00")
+    marks.flush()
+    assert [d['line_id'] for d in marks.dead_letters()] == [11]
+
+    odoo.faulty.clear()   # p. ej. se corrigió el permiso en Odoo
+    assert marks.requeue_dead() == 1
+    assert marks.dead_letters() == [] and marks.pending_count() == 1
+    assert marks.is_journaled(11) and marks.has_pending.is_set()
+    assert marks.flush() == 1
+    assert odoo.marked[11] == "2026-10-17 12:00:00"
+    assert marks.requeue_dead() == 0
+
+
+def _spool_with_jobs(tmp_path, n_jobs):
+    spool = PrintSpool(tmp_path / "spool.db", lambda ids, printed_at=None: None)
+    for oid in range(1, n_jobs + 1):
+        order = {'id': oid, 'name': f"P{oid}"}
+        spool.add_job(order, [{'id': oid * 10, 'order_id': [oid, order['name']], 'display_name': "x", 'qty': 1.0}])
+    return spool
+
+
+def _render(order, lines):
+    return f"{order['name']}:" + ",".join(str(l['id']) for l in lines)
+
+
+def test_drain_stops_sending_after_a_connection_failure(tmp_path):
+    spool = _spool_with_jobs(tmp_path, 6)
+    rendered, sent = [], []
+
+    def render(order, lines):
+        rendered.append(order['id'])
+        return _render(order, lines)
+
+    def powered_off(batch):
+        sent.append(len(batch))
+        raise BatchWriteError(0, len(batch), ConnectionRefusedError("impresora apagada"))
+
+    result = spool.drain(render, powered_off, max_tickets=2, render_ahead=1)
+
+    assert sent == [2]                 # un solo intento de conexión, no uno por lote
+    assert len(result['errors']) == 6 and not result['printed']
+    assert all(isinstance(err['error'], BatchWriteError) for err in result['errors'])
+    assert len(rendered) < 6           # lo que sigue ni se arma
+    assert len(spool.unfinished_jobs()) == 6
+
+    # La impresora volvió: el próximo drain imprime todo.
+    again = spool.drain(_render, lambda batch: None, max_tickets=2)
+    assert len(again['printed']) == 6 and spool.unfinished_jobs() == []
+    spool.close()
+
+
+def test_drain_keeps_sending_after_a_partial_delivery(tmp_path):
+    spool = _spool_with_jobs(tmp_path, 4)
+    sent = []
+
+    def cut_after_first(batch):
+        sent.append([job['order']['id'] for job, _ in batch])
+        if len(sent) == 1:
+            raise BatchWriteError(1, len(batch), OSError("se cortó a mitad"))
+
+    result = spool.drain(_render, cut_after_first, max_tickets=2)
+
+    assert sent == [[1, 2], [3, 4]]    # la impresora responde: el lote siguiente sale igual
+    assert [p['order']['id'] for p in result['printed']] == [1, 3, 4]
+    assert [e['order']['id'] for e in result['errors']] == [2]
+    assert [job['order']['id'] for job in spool.unfinished_jobs()] == [2]
+    spool.close()
+
+
+def test_drain_measures_batches_with_size_fn(tmp_path):
+    spool = _spool_with_jobs(tmp_path, 5)
+    sent = []
+    escpos = lambda job, txt: 40   # init, estilos, avance y corte: bastante más que el texto
+
+    spool.drain(_render, lambda batch: sent.append(len(batch)), max_tickets=10, max_bytes=100, size_fn=escpos)
+
+    assert sent == [3, 2]
+    spool.close()
+
+
+def test_jobs_left_half_done_by_a_crash_print_once_after_restart(tmp_path):
+    odoo = _Odoo()
+    spool = PrintSpool(tmp_path / "spool.db", odoo)
+    line = lambda oid, lid: {'id': lid, 'order_id': [oid, f"P{oid}"], 'display_name': "x", 'qty': 1.0}
+    spool.add_job({'id': 1, 'name': "P1"}, [line(1, 10)])                     # se cortó tras leer
+    rendered = spool.add_job({'id': 2, 'name': "P2"}, [line(2, 20)])
+    spool._set_rendered(rendered, "P2 armado antes del corte")                 # se cortó tras armar
+    spool.close()
+
+    spool = PrintSpool(tmp_path / "spool.db", odoo)
+    assert spool.is_spooled(10) and spool.is_spooled(20)   # el próximo fetch no los vuelve a traer
+    assert spool.add_job({'id': 1, 'name': "P1"}, [line(1, 10)]) is None
+    rendered_now, sent = [], []
+
+    def render(order, lines):
+        rendered_now.append(order['id'])
+        return _render(order, lines)
+
+    result = spool.drain(render, lambda batch: sent.extend(txt for _, txt in batch), max_tickets=10)
+    assert sent == ["P1:10", "P2 armado antes del corte"]
+    assert rendered_now == [1]                             # lo ya armado no se vuelve a armar
+    assert len(result['printed']) == 2
+    spool.close()                                          # se corta antes de marcar en Odoo
+
+    spool = PrintSpool(tmp_path / "spool.db", odoo)
+    assert spool.unfinished_jobs() == []
+    assert spool.drain(render, lambda batch: sent.extend(batch))['printed'] == []
+    assert len(sent) == 2                                  # impreso una sola vez
+    assert spool.marks.pending_count() == 2 and spool.counts()['printed'] == 2
+    assert spool.marks.flush() == 2
+    assert sorted(odoo.marked) == [10, 20] and spool.counts()['acked'] == 2
+    spool.close()
+
+
+def test_partial_batch_journals_only_the_delivered_tickets(tmp_path):
+    spool = _spool_with_jobs(tmp_path, 3)
+
+    def two_of_three(batch):
+        raise BatchWriteError(2, len(batch), OSError("se cortó a mitad"))
+
+    result = spool.drain(_render, two_of_three, max_tickets=3)
+
+    assert [p['order']['id'] for p in result['printed']] == [1, 2]
+    assert [e['order']['id'] for e in result['errors']] == [3]
+    assert spool.marks.is_journaled(10) and spool.marks.is_journaled(20)
+    assert not spool.marks.is_journaled(30) and spool.line_state(30) == 'rendered'
+    assert spool.counts()['printed'] == 2
+    spool.close()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""OrderStore: marcar impresa una línea no invalida el ticket ya armado (RenderCache)."""
+
+from cocina_core import RenderCache
+from cocina_store import OrderStore
+
+
+def _order(oid, date_order):
+    return {'id': oid, 'name': f"P{oid}", 'date_order': date_order, 'write_date': date_order}
+
+
+def _line(lid, oid, write_date):
+    return {'id': lid, 'order_id': [oid, f"P{oid}"], 'display_name': f"Producto {lid}", 'qty': 1.0,
+            'write_date': write_date}
+
+
+def test_mark_printed_keeps_cached_render_and_moves_order_up():
+    renders = []
+    cache = RenderCache(lambda order, lines: renders.append(order['id']) or f"ticket {order['id']} @{len(renders)}",
+                        lambda text, codepage: text.encode())
+    store = OrderStore()
+    store.reset(scope=None, day="2026-10-17 00:00:00")
+    store.merge([_line(1, 1, "2026-10-17 12:00:00"), _line(2, 2, "2026-10-17 12:05:00")],
+                [_order(1, "2026-10-17 12:00:00"), _order(2, "2026-10-17 12:05:00")])
+
+    before = store.view(render=cache.ticket)
+    assert [p['order']['id'] for p in before] == [2, 1]
+
+    store.mark_printed([1], write_date="2026-10-17 12:10:00")
+    after = store.view(render=cache.ticket)
+
+    assert [p['order']['id'] for p in after] == [1, 2]            # sube como tras releerlo de Odoo
+    assert after[0]['printed'] and after[0]['last_activity'] == "2026-10-17 12:10:00"
+    assert after[0]['lines'][0]['write_date'] == "2026-10-17 12:00:00"
+    assert after[0]['ticket_text'] == before[1]['ticket_text']    # mismo texto, con la hora del primer armado
+    assert sorted(renders) == [1, 2]                              # no se volvió a armar